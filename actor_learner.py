@@ -0,0 +1,232 @@
+import argparse
+import multiprocessing
+import queue
+import random
+import traceback
+import numpy as np
+from multiprocessing import shared_memory
+from environment import PackageEnv, EVENT_DELIVERED
+from q_learning import hash_state, num_states
+from q_table import QTableStore, write_q_tables
+from replay_buffer import batch_update
+
+# First item of the message an actor sends when it raises
+ACTOR_FAILED = 'actor failed'
+
+# Actor-learner training: actor processes play episodes with a greedy-policy snapshot kept in
+# shared memory and push their transitions through a bounded queue to a single learner, which
+# owns the Q-tables, applies the updates in batches and republishes the snapshot. Simulation
+# and learning overlap, and the number of actors can be raised without adding writers.
+
+# Greedy action of every (agent, state), published by the learner and read by the actors.
+# Actors read it without locking; a row that is being rewritten only costs one stale action.
+class PolicySnapshot:
+    def __init__(self, num_agents, num_states, name=None):
+        size = num_agents * num_states
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.actions = np.ndarray((num_agents, num_states), dtype=np.int8, buffer=self.shm.buf)
+        if name is None:
+            self.actions.fill(0)
+
+    def publish(self, Q_table):
+        self.actions[:] = np.argmax(Q_table.q_values, axis=2)
+
+    def close(self, unlink=False):
+        self.actions = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+# Position of every item among the earlier items with the same key (0 for the first)
+def _occurrence_rank(keys):
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    positions = np.arange(len(keys))
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+    return rank
+
+# Applies a chunk of transitions in arrival order. Q_learning visits both ends of a transition
+# before updating, so all new (agent, state) rows join the shared aggregate first; then the
+# updates run in waves where each (agent, state, action) appears once, so repeated pairs keep
+# their order and step sizes.
+def learn_chunk(Q_table, chunk, gamma, alpha=0.5, learning_rate=0.2):
+    agent_ids, states, actions, rewards, next_states, dones = chunk
+
+    touched = np.unique(np.concatenate([agent_ids * Q_table.num_states + states,
+                                        agent_ids * Q_table.num_states + next_states]))
+    touched_agents, touched_states = np.divmod(touched, Q_table.num_states)
+    new = ~Q_table.visited[touched_agents, touched_states]
+    touched_agents, touched_states = touched_agents[new], touched_states[new]
+    Q_table.visited[touched_agents, touched_states] = True
+    np.add.at(Q_table.shared_sum, touched_states, Q_table.q_values[touched_agents, touched_states])
+    np.add.at(Q_table.shared_count, touched_states, 1)
+
+    keys = (agent_ids * Q_table.num_states + states) * Q_table.num_actions + actions
+    rank = _occurrence_rank(keys)
+    for wave in range(rank.max() + 1 if len(rank) else 0):
+        mask = rank == wave
+        batch_update(Q_table, agent_ids[mask], states[mask], actions[mask], rewards[mask],
+                     next_states[mask], dones[mask], gamma, alpha, learning_rate)
+
+# Actor process: claims (agent, episode) tasks from the shared counter until num_episodes
+# episodes of every agent have been handed out, and sends transitions in chunks of at least
+# chunk_size. Each chunk carries the (episode, agent, reward, length, fuel used) of the episodes
+# it completes. A None on the queue tells the learner this actor is done, and an
+# (ACTOR_FAILED, actor_id, traceback) that it raised, so the learner fails instead of running short.
+def _actor(actor_id, snapshot_name, num_agents, table_states, task_counter, num_episodes, epsilon,
+           decay_rate, epsilon_floor, env_kwargs, transitions, chunk_size, seed):
+    random.seed(None if seed is None else seed + actor_id)
+    snapshot = PolicySnapshot(num_agents, table_states, snapshot_name)
+    policy = snapshot.actions
+
+    try:
+        env = PackageEnv(num_agents=num_agents, **env_kwargs)
+        event_rewards = env.event_rewards
+        num_actions = len(env.actions)
+        columns = [[] for _ in range(6)]
+        agent_column, state_column, action_column, reward_column, next_column, done_column = columns
+        results = []
+        while True:
+            with task_counter.get_lock():
+                task = task_counter.value
+                task_counter.value += 1
+            if task >= num_episodes * num_agents:
+                break
+            episode, agent_id = divmod(task, num_agents)
+            episode_epsilon = max(epsilon_floor, epsilon * decay_rate ** episode)
+
+            state, _, _ = env.reset()
+            prev_state = hash_state(state, agent_id, env)
+            total_reward = 0
+            num_steps = 0
+            done = False
+            while not done:
+                if random.random() < episode_epsilon:
+                    action_idx = random.randrange(num_actions)
+                else:
+                    action_idx = policy[agent_id, prev_state]
+                event = env.fast_step(action_idx, agent_id)
+                reward = event_rewards[event]
+                done = event >= EVENT_DELIVERED
+                curr_state = hash_state(env.current_state, agent_id, env)
+
+                agent_column.append(agent_id)
+                state_column.append(prev_state)
+                action_column.append(action_idx)
+                reward_column.append(reward)
+                next_column.append(curr_state)
+                done_column.append(done)
+                total_reward += reward
+                num_steps += 1
+                prev_state = curr_state
+
+            results.append((episode, agent_id, total_reward, num_steps, env.fuel - env.fuel_consumed[agent_id]))
+            if len(agent_column) >= chunk_size:
+                transitions.put((_pack(columns), results))
+                columns = [[] for _ in range(6)]
+                agent_column, state_column, action_column, reward_column, next_column, done_column = columns
+                results = []
+        if results:
+            transitions.put((_pack(columns), results))
+    except BaseException:
+        transitions.put((ACTOR_FAILED, actor_id, traceback.format_exc()))
+        raise
+    else:
+        transitions.put(None)
+    finally:
+        policy = None
+        snapshot.close()
+
+def _pack(columns):
+    agent_ids, states, actions, rewards, next_states, dones = columns
+    return (np.array(agent_ids, dtype=np.int64), np.array(states, dtype=np.int64),
+            np.array(actions, dtype=np.int64), np.array(rewards, dtype=np.float64),
+            np.array(next_states, dtype=np.int64), np.array(dones, dtype=bool))
+
+# Trains num_agents Q-tables for num_episodes episodes each with num_actors actor processes
+# and one learner (this process). The actors see the learner's greedy policy as of the last
+# publish, at most publish_every transitions old; queue_size bounds how many chunks can wait,
+# so fast actors block instead of running ahead of the learner.
+# metrics (a metrics.MetricsRecorder) receives every finished episode as it arrives.
+# Returns the Q-tables and the per-agent episode rewards in the order they were learned.
+def train_actor_learner(num_episodes, num_agents, num_actors=None, gamma=0.99, epsilon=1.0,
+                        decay_rate=0.9995, epsilon_floor=0.25, learning_rate=0.2, alpha=0.5,
+                        grid_size=5, num_obstacles=2, obstacles=None, chunk_size=512, queue_size=16,
+                        publish_every=2048, metrics=None, seed=None):
+    if num_actors is None:
+        num_actors = max(1, multiprocessing.cpu_count() - 1)
+    env_kwargs = {'grid_size': grid_size, 'num_obstacles': num_obstacles, 'obstacles': obstacles}
+    table_states = num_states(grid_size)
+    Q_table = QTableStore(num_agents, table_states)
+    snapshot = PolicySnapshot(num_agents, table_states)
+    transitions = multiprocessing.Queue(maxsize=queue_size)
+    task_counter = multiprocessing.Value('q', 0)
+    agent_rewards = [[] for _ in range(num_agents)]
+
+    actors = [multiprocessing.Process(target=_actor, daemon=True, args=(
+        actor_id, snapshot.shm.name, num_agents, table_states, task_counter, num_episodes, epsilon,
+        decay_rate, epsilon_floor, env_kwargs, transitions, chunk_size, seed))
+        for actor_id in range(num_actors)]
+    for actor in actors:
+        actor.start()
+
+    try:
+        running = num_actors
+        since_publish = 0
+        while running:
+            try:
+                item = transitions.get(timeout=1)
+            except queue.Empty:
+                # An actor killed outside Python never sends its sentinel
+                crashed = [actor for actor in actors if actor.exitcode not in (None, 0)]
+                if crashed or not any(actor.is_alive() for actor in actors):
+                    raise RuntimeError("Actor processes exited without finishing")
+                continue
+            if item is None:
+                running -= 1
+                continue
+            if item[0] == ACTOR_FAILED:
+                raise RuntimeError(f"Actor {item[1]} failed:\n{item[2]}")
+            chunk, results = item
+            learn_chunk(Q_table, chunk, gamma, alpha, learning_rate)
+            for episode, agent_id, reward, length, fuel_used in results:
+                agent_rewards[agent_id].append(reward)
+                if metrics is not None:
+                    metrics.record(episode, agent_id, reward, length, fuel_used)
+
+            since_publish += len(chunk[0])
+            if since_publish >= publish_every:
+                snapshot.publish(Q_table)
+                since_publish = 0
+        for actor in actors:
+            actor.join()
+    finally:
+        for actor in actors:
+            if actor.is_alive():
+                actor.terminate()
+        snapshot.close(unlink=True)
+        if metrics is not None:
+            metrics.log.flush()
+
+    return Q_table, agent_rewards
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the Q-tables with actor processes and one learner")
+    parser.add_argument('--episodes', type=int, default=10000)
+    parser.add_argument('--agents', type=int, default=3)
+    parser.add_argument('--actors', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default='q_table_actor_learner.bin',
+                        help="kept apart from q_table.bin, which policy.npy is compiled from")
+    args = parser.parse_args()
+
+    Q_table, agent_rewards = train_actor_learner(args.episodes, args.agents, args.actors, seed=args.seed)
+    for agent_id, rewards in enumerate(agent_rewards):
+        print(f"Agent {agent_id + 1} mean reward over the last 100 episodes: {np.mean(rewards[-100:]):.2f}")
+    write_q_tables(Q_table, args.output)
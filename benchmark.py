@@ -0,0 +1,254 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import time
+from collections import deque
+
+import numpy as np
+
+from environment import FleetEnv, PackageEnv, VecPackageEnv, EVENT_DELIVERED
+from q_learning import Q_learning, hash_state, num_states, q_learning_multi_agent
+from q_table import QTableStore
+from random_streams import task_stream
+
+# Performance benchmarks for the environment and the trainer.
+# Every benchmark draws from its own NumPy generators seeded from seed, so runs are comparable,
+# and results are plain dicts so they can be dumped as JSON and diffed between commits.
+
+# Largest dense Q-table the tabular benchmarks will allocate
+MAX_TABLE_BYTES = 512 * 1024 * 1024
+
+# Obstacle count and fuel used for a benchmark grid: the stock 2 obstacles and 100 fuel on 5x5,
+# about 2% of the cells and enough fuel to cross the map on larger ones
+def env_kwargs(grid_size):
+    return {'grid_size': grid_size, 'num_obstacles': max(2, grid_size * grid_size // 50),
+            'fuel': max(100, 4 * grid_size)}
+
+def table_fits(num_agents, grid_size):
+    return QTableStore.buffer_size(num_agents, num_states(grid_size)) <= MAX_TABLE_BYTES
+
+# Raw PackageEnv.step throughput with random actions, resetting when an episode ends
+def bench_env_step(num_agents, grid_size=5, num_steps=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    env = PackageEnv(num_agents=num_agents, rng=rng, **env_kwargs(grid_size))
+    env.reset()
+    actions = [env.actions[i] for i in rng.integers(0, len(env.actions), num_steps)]
+    agent_ids = rng.integers(0, num_agents, num_steps).tolist()
+
+    start = time.perf_counter()
+    for action, agent_id in zip(actions, agent_ids):
+        _, _, done, _ = env.step(action, agent_id)
+        if done:
+            env.reset()
+    elapsed = time.perf_counter() - start
+
+    return {'benchmark': 'env_step', 'num_agents': num_agents, 'grid_size': env.grid_size,
+            'steps': num_steps, 'seconds': elapsed, 'steps_per_sec': num_steps / elapsed}
+
+# PackageEnv.fast_step throughput on the same random action stream as bench_env_step
+def bench_env_fast_step(num_agents, grid_size=5, num_steps=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    env = PackageEnv(num_agents=num_agents, rng=rng, **env_kwargs(grid_size))
+    env.reset()
+    actions = rng.integers(0, len(env.actions), num_steps).tolist()
+    agent_ids = rng.integers(0, num_agents, num_steps).tolist()
+
+    start = time.perf_counter()
+    for action_idx, agent_id in zip(actions, agent_ids):
+        if env.fast_step(action_idx, agent_id) >= EVENT_DELIVERED:
+            env.reset()
+    elapsed = time.perf_counter() - start
+
+    return {'benchmark': 'env_fast_step', 'num_agents': num_agents, 'grid_size': env.grid_size,
+            'steps': num_steps, 'seconds': elapsed, 'steps_per_sec': num_steps / elapsed}
+
+# VecPackageEnv.step throughput, counted in single-environment steps
+def bench_vec_env_step(num_agents, grid_size=5, num_envs=4096, num_steps=200, seed=0):
+    env = VecPackageEnv(num_envs, num_agents=num_agents, seed=seed, **env_kwargs(grid_size))
+    rng = np.random.default_rng(seed)
+    actions = rng.integers(0, len(env.ACTIONS), size=(num_steps, num_envs))
+    agent_ids = rng.integers(0, num_agents, size=num_steps)
+
+    start = time.perf_counter()
+    for step_actions, agent_id in zip(actions, agent_ids):
+        _, _, dones, _ = env.step(step_actions, agent_id)
+        env.reset(dones)
+    elapsed = time.perf_counter() - start
+
+    total = num_steps * num_envs
+    return {'benchmark': 'vec_env_step', 'num_agents': num_agents, 'grid_size': grid_size,
+            'num_envs': num_envs, 'steps': total, 'seconds': elapsed, 'steps_per_sec': total / elapsed}
+
+# FleetEnv.step throughput with every agent acting at random each step, and the cost of a step
+# in which only num_movers of them move
+def bench_fleet_step(num_agents, grid_size=200, num_steps=200, num_movers=100, seed=0):
+    env = FleetEnv(num_agents, grid_size=grid_size, num_obstacles=grid_size * grid_size // 50, seed=seed)
+    rng = np.random.default_rng(seed)
+    actions = rng.integers(0, len(env.ACTIONS), size=(num_steps, num_agents))
+    movers = np.array([rng.choice(num_agents, num_movers, replace=False) for _ in range(num_steps)])
+    moves = rng.integers(0, 4, size=(num_steps, num_movers))
+
+    start = time.perf_counter()
+    for step_actions in actions:
+        env.step(step_actions)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    for step_moves, agent_ids in zip(moves, movers):
+        env.step(step_moves, agent_ids)
+    sparse_elapsed = time.perf_counter() - start
+
+    total = num_steps * num_agents
+    return {'benchmark': 'fleet_step', 'num_agents': num_agents, 'grid_size': grid_size,
+            'steps': total, 'seconds': elapsed, 'steps_per_sec': total / elapsed,
+            'collisions': env.num_collisions, 'num_movers': num_movers,
+            'ms_per_sparse_step': sparse_elapsed / num_steps * 1e3}
+
+# Cost of one hash_state call on states sampled from fresh resets
+def bench_hash_state(num_agents, grid_size=5, num_calls=50000, seed=0):
+    env = PackageEnv(num_agents=num_agents, rng=np.random.default_rng(seed), **env_kwargs(grid_size))
+    states = []
+    for _ in range(100):
+        state, _, _ = env.reset()
+        states.append({key: list(value) for key, value in state.items()})
+
+    start = time.perf_counter()
+    for i in range(num_calls):
+        hash_state(states[i % len(states)], i % num_agents, env)
+    elapsed = time.perf_counter() - start
+
+    return {'benchmark': 'hash_state', 'num_agents': num_agents, 'grid_size': env.grid_size,
+            'calls': num_calls, 'seconds': elapsed, 'ns_per_call': elapsed / num_calls * 1e9}
+
+# Q_learning episodes per second for one agent on a fixed epsilon, drawing exploration and layouts
+# from one random_streams stream as seeded training does
+def bench_q_learning(num_agents, grid_size=5, num_episodes=200, epsilon=0.5, seed=0):
+    stream = task_stream(seed, 0, 0)
+    Q_table = QTableStore(num_agents, num_states(grid_size))
+    env = PackageEnv(num_agents=num_agents, rng=stream.generator, **env_kwargs(grid_size))
+
+    start = time.perf_counter()
+    for episode in range(num_episodes):
+        Q_learning(episode % num_agents, Q_table, epsilon, 0.99, 0.2, env, stream=stream)
+    elapsed = time.perf_counter() - start
+
+    return {'benchmark': 'q_learning', 'num_agents': num_agents, 'grid_size': env.grid_size,
+            'episodes': num_episodes, 'seconds': elapsed, 'episodes_per_sec': num_episodes / elapsed}
+
+# End-to-end q_learning_multi_agent wall time until the moving average of the per-episode
+# reward (averaged over agents) first reaches the threshold
+def bench_time_to_threshold(num_agents, grid_size=5, backend='thread', threshold=10000, window=100,
+                            max_episodes=5000, seed=0):
+    recent = deque(maxlen=window)
+    running = {'sum': 0.0, 'episode': None}
+
+    def callback(episodes, chunk_rewards):
+        for i, episode in enumerate(episodes):
+            reward = sum(rewards[i] for rewards in chunk_rewards) / num_agents
+            if len(recent) == window:
+                running['sum'] -= recent[0]
+            recent.append(reward)
+            running['sum'] += reward
+            if len(recent) == window and running['sum'] / window >= threshold:
+                running['episode'] = episode
+                return True
+        return False
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        q_learning_multi_agent(max_episodes, num_agents, backend=backend, callback=callback, plot=False,
+                               grid_size=grid_size, num_obstacles=env_kwargs(grid_size)['num_obstacles'],
+                               seed=seed)
+    elapsed = time.perf_counter() - start
+
+    return {'benchmark': 'time_to_threshold', 'num_agents': num_agents, 'grid_size': grid_size,
+            'backend': backend, 'threshold': threshold, 'window': window, 'max_episodes': max_episodes,
+            'reached': running['episode'] is not None, 'episodes': running['episode'], 'seconds': elapsed}
+
+# Counts the environment steps of a q_learning_multi_agent run, in place of a metrics recorder
+class StepCounter:
+    def __init__(self):
+        self.steps = 0
+
+    def record_round(self, episodes, chunk_results):
+        self.steps += sum(num_steps for results in chunk_results for _, num_steps, _ in results)
+
+# Training throughput of each backend as the agent count grows: every agent runs num_episodes
+# episodes at a fixed epsilon, and steps_per_sec counts the steps of all agents together, so on
+# enough cores it should grow about linearly with the agent count. speedup is relative to the
+# first agent count of the same backend and cores is what the machine had to offer.
+def bench_backend_scaling(agent_counts=(1, 2, 3), backends=('thread', 'process'), grid_size=5,
+                          num_episodes=300, seed=0):
+    results = []
+    for backend in backends:
+        base = None
+        for num_agents in agent_counts:
+            counter = StepCounter()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                q_learning_multi_agent(num_episodes, num_agents, epsilon=0.5, decay_rate=1.0, backend=backend,
+                                       plot=False, grid_size=grid_size,
+                                       num_obstacles=env_kwargs(grid_size)['num_obstacles'],
+                                       metrics=counter, seed=seed)
+            elapsed = time.perf_counter() - start
+            steps_per_sec = counter.steps / elapsed
+            if base is None:
+                base = steps_per_sec
+            results.append({'benchmark': 'backend_scaling', 'backend': backend, 'num_agents': num_agents,
+                            'grid_size': grid_size, 'episodes': num_episodes * num_agents,
+                            'steps': counter.steps, 'seconds': elapsed, 'steps_per_sec': steps_per_sec,
+                            'speedup': steps_per_sec / base, 'cores': len(os.sched_getaffinity(0))
+                            if hasattr(os, 'sched_getaffinity') else os.cpu_count()})
+    return results
+
+def run_benchmarks(agent_counts=(1, 2, 3), grid_sizes=(5,), backends=('thread',), threshold=10000,
+                   max_episodes=5000, quick=False, seed=0, fleet_sizes=(1000, 10000)):
+    scale = 10 if quick else 1
+    results = []
+    for num_agents in agent_counts:
+        for grid_size in grid_sizes:
+            results.append(bench_env_step(num_agents, grid_size, num_steps=20000 // scale, seed=seed))
+            results.append(bench_env_fast_step(num_agents, grid_size, num_steps=20000 // scale, seed=seed))
+            results.append(bench_vec_env_step(num_agents, grid_size, num_steps=200 // scale, seed=seed))
+            results.append(bench_hash_state(num_agents, grid_size, num_calls=50000 // scale, seed=seed))
+            # The dense Q-table grows as grid_size ** 5, so training is only timed where it fits
+            if not table_fits(num_agents, grid_size):
+                continue
+            results.append(bench_q_learning(num_agents, grid_size, num_episodes=200 // scale, seed=seed))
+            for backend in backends:
+                results.append(bench_time_to_threshold(num_agents, grid_size, backend, threshold,
+                                                       max_episodes=max_episodes // scale, seed=seed))
+    results.extend(bench_backend_scaling(agent_counts, backends, num_episodes=300 // scale, seed=seed))
+    for num_agents in fleet_sizes:
+        results.append(bench_fleet_step(num_agents, num_steps=200 // scale, seed=seed))
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'seed': seed,
+            'quick': quick
+        },
+        'results': results
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark environment stepping and training throughput")
+    parser.add_argument('--agents', type=int, nargs='+', default=[1, 2, 3])
+    parser.add_argument('--grid-sizes', type=int, nargs='+', default=[5, 20, 100])
+    parser.add_argument('--backends', nargs='+', default=['thread', 'process'])
+    parser.add_argument('--threshold', type=float, default=10000)
+    parser.add_argument('--max-episodes', type=int, default=5000)
+    parser.add_argument('--fleet-sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true', help="run every benchmark with a tenth of the work")
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.agents, args.grid_sizes, args.backends, args.threshold,
+                            args.max_episodes, args.quick, args.seed, args.fleet_sizes)
+    with open(args.output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+    print(json.dumps(report, indent=2))
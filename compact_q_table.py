@@ -0,0 +1,175 @@
+import argparse
+import numpy as np
+from policy import UNSEEN
+from q_table import QTableStore, read_arrays, read_q_tables, write_arrays
+
+# Compact read-only Q-tables for large grids and fleets. Only rows that were visited, updated at
+# least once or differ from the initial value are kept (QTableStore.touched_keys; tables
+# converted from the old pickles carry no update counts), so every dropped row reads as the
+# initial value. The Q-values are quantized to 16 bits and the update counts saturate at 65535.
+# Each kept row also stores its greedy action, so near-ties that quantize to the same value never
+# change the policy, and its visited flag, so the optimistic initial values of states an agent
+# never saw stay out of the shared value and the greedy policy (UNSEEN, as in
+# policy.compile_policy). Rows are found through a sorted array of keys
+# (agent_id * num_states + state) with a binary search.
+
+UINT16_MAX = np.iinfo(np.uint16).max
+
+class CompactQTable:
+    # dtype 'int16' stores every row as 16-bit steps between its own min and max (row_min and
+    # row_scale keep the range); 'float16' stores the values directly, which is coarser for the
+    # large rewards used here (about 8 apart near 10000)
+    # visited defaults to every kept row (files written before it was stored)
+    def __init__(self, num_agents, num_states, num_actions, initial_value, keys, q_data, counts, greedy,
+                 row_min=None, row_scale=None, visited=None):
+        self.num_agents = num_agents
+        self.num_states = num_states
+        self.num_actions = num_actions
+        self.initial_value = initial_value
+        self.keys = keys
+        self.q_data = q_data
+        self.counts = counts
+        self.greedy = greedy
+        self.row_min = row_min
+        self.row_scale = row_scale
+        self.visited = np.ones(len(keys), dtype=bool) if visited is None else visited
+        self.dtype = 'int16' if q_data.dtype == np.int16 else 'float16'
+
+    @classmethod
+    def from_store(cls, store, dtype='int16'):
+        if dtype not in ('int16', 'float16'):
+            raise ValueError(f"Unknown dtype: {dtype}")
+        keys = store.touched_keys()
+        agent_ids, states = np.divmod(keys, store.num_states)
+        rows = np.asarray(store.q_values[agent_ids, states])
+        counts = np.minimum(store.num_updates[agent_ids, states], UINT16_MAX).astype(np.uint16)
+        visited = np.asarray(store.visited[agent_ids, states])
+        greedy = np.argmax(rows, axis=1).astype(np.uint8)
+
+        if dtype == 'float16':
+            return cls(store.num_agents, store.num_states, store.num_actions, store.initial_value,
+                       keys, rows.astype(np.float16), counts, greedy, visited=visited)
+        row_min = rows.min(axis=1).astype(np.float32)
+        span = rows.max(axis=1) - row_min
+        row_scale = np.where(span > 0, span / UINT16_MAX, 1).astype(np.float32)
+        steps = np.rint((rows - row_min[:, None]) / row_scale[:, None])
+        q_data = (np.clip(steps, 0, UINT16_MAX) - 32768).astype(np.int16)
+        return cls(store.num_agents, store.num_states, store.num_actions, store.initial_value,
+                   keys, q_data, counts, greedy, row_min, row_scale, visited)
+
+    @property
+    def nbytes(self):
+        arrays = [self.keys, self.q_data, self.counts, self.greedy, self.visited, self.row_min, self.row_scale]
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    # Positions of the (agent, state) rows in the compact arrays, -1 where the row was dropped
+    def find_rows(self, agent_ids, states):
+        keys = np.asarray(agent_ids, dtype=np.int64) * self.num_states + np.asarray(states, dtype=np.int64)
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        return np.where(found, positions, -1)
+
+    def _decode(self, positions):
+        if self.dtype == 'float16':
+            return self.q_data[positions].astype(np.float64)
+        steps = self.q_data[positions].astype(np.float64) + 32768
+        return self.row_min[positions, None] + steps * self.row_scale[positions, None]
+
+    # Q-values of many (agent, state) pairs; dropped rows read as the initial value
+    def q_rows(self, agent_ids, states):
+        positions = self.find_rows(agent_ids, states)
+        rows = np.full((len(positions), self.num_actions), float(self.initial_value))
+        kept = positions >= 0
+        rows[kept] = self._decode(positions[kept])
+        return rows
+
+    def lookup(self, agent_id, state):
+        return self.q_rows([agent_id], [state])[0]
+
+    # Greedy actions of many (agent, state) pairs, UNSEEN where the agent never visited the state
+    def greedy_actions(self, agent_ids, states):
+        positions = self.find_rows(agent_ids, states)
+        seen = positions >= 0
+        seen[seen] = self.visited[positions[seen]]
+        return np.where(seen, self.greedy[positions], UNSEEN).astype(np.int64)
+
+    # Mean Q-value over the agents that visited the state, 0 when none did, as
+    # QTableStore.shared_value
+    def shared_value(self, state, action):
+        positions = self.find_rows(np.arange(self.num_agents), np.full(self.num_agents, state))
+        positions = positions[positions >= 0]
+        positions = positions[self.visited[positions]]
+        if len(positions) == 0:
+            return 0
+        return float(self._decode(positions)[:, action].mean())
+
+    def update_counts(self, agent_id, state):
+        position = self.find_rows([agent_id], [state])[0]
+        if position < 0:
+            return np.zeros(self.num_actions, dtype=np.uint16)
+        return self.counts[position]
+
+    # Dense store with the kept rows restored (e.g. to continue training)
+    def to_store(self):
+        store = QTableStore(self.num_agents, self.num_states, self.num_actions, self.initial_value)
+        agent_ids, states = np.divmod(self.keys, self.num_states)
+        store.q_values[agent_ids, states] = self._decode(np.arange(len(self.keys)))
+        store.num_updates[agent_ids, states] = self.counts
+        store.visited[agent_ids, states] = self.visited
+        store.rebuild_shared()
+        return store
+
+# Writes the table in the same binary container as q_table.write_q_tables
+def write_compact(table, path, metadata=None):
+    named_arrays = [('keys', table.keys), ('q_data', table.q_data), ('counts', table.counts),
+                    ('greedy', table.greedy), ('visited', table.visited)]
+    if table.dtype == 'int16':
+        named_arrays += [('row_min', table.row_min), ('row_scale', table.row_scale)]
+    write_arrays(path, named_arrays, {
+        'kind': 'compact',
+        'num_agents': table.num_agents,
+        'num_states': table.num_states,
+        'num_actions': table.num_actions,
+        'initial_value': table.initial_value
+    }, metadata)
+
+# Loads a compact table; mode='r' memory-maps it (see q_table.read_arrays)
+def read_compact(path, mode='r'):
+    header, arrays = read_arrays(path, mode)
+    if header.get('kind') != 'compact':
+        raise ValueError(f"{path} does not hold a compact Q-table")
+    table = CompactQTable(header['num_agents'], header['num_states'], header['num_actions'],
+                          header['initial_value'], arrays['keys'], arrays['q_data'], arrays['counts'],
+                          arrays['greedy'], arrays.get('row_min'), arrays.get('row_scale'), arrays.get('visited'))
+    return table, header['metadata']
+
+# Compares the greedy policy of the compact table with the dense store's on every visited row
+def compare_policies(store, table):
+    agent_ids, states = np.nonzero(np.asarray(store.visited))
+    dense = np.argmax(np.asarray(store.q_values)[agent_ids, states], axis=1)
+    compact = table.greedy_actions(agent_ids, states)
+    dense_bytes = QTableStore.buffer_size(store.num_agents, store.num_states, store.num_actions)
+    return {
+        'rows': int(len(states)),
+        'kept_rows': int(len(table.keys)),
+        'policy_agreement': float(np.mean(dense == compact)) if len(states) else 1.0,
+        'dense_bytes': dense_bytes,
+        'compact_bytes': table.nbytes,
+        'reduction': dense_bytes / max(1, table.nbytes)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact trained Q-tables into a quantized sparse table")
+    parser.add_argument('q_table', nargs='?', default='q_table.bin')
+    parser.add_argument('output', nargs='?', default='q_table_compact.bin')
+    parser.add_argument('--dtype', choices=['int16', 'float16'], default='int16')
+    args = parser.parse_args()
+
+    store, metadata = read_q_tables(args.q_table)
+    table = CompactQTable.from_store(store, args.dtype)
+    write_compact(table, args.output, metadata)
+    report = compare_policies(store, table)
+    print(f"Kept {report['kept_rows']} of {store.num_agents * store.num_states} rows, "
+          f"{report['dense_bytes']} -> {report['compact_bytes']} bytes ({report['reduction']:.1f}x)")
+    print(f"Greedy policy agreement on visited rows: {report['policy_agreement']:.4%}")
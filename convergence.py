@@ -0,0 +1,91 @@
+import numpy as np
+from metrics import RollingWindow
+
+# Convergence detection for q_learning_multi_agent. After every training round the monitor
+# compares the Q-tables with the previous round and looks at three signals:
+#   - policy change rate: fraction of visited (agent, state) rows whose greedy action changed
+#   - mean |dQ|: average change of the Q-values updated during the round (the max is also
+#     reported, but a rarely visited state can still take a large step long after convergence)
+#   - rolling reward: the agents' mean reward over the last reward_window episodes stays
+#     within reward_tolerance (relative) of where it was when the stable stretch began
+# The first two are averaged over the last signal_window rounds, since single rounds are noisy.
+# Training has converged once all three hold for patience consecutive episodes.
+
+class ConvergenceMonitor:
+    # stop=False only flags convergence (converged_episode is set) and lets training run on
+    def __init__(self, policy_change_threshold=0.005, q_delta_threshold=60.0, reward_window=200,
+                 reward_tolerance=0.05, patience=500, min_episodes=1000, signal_window=10, stop=True):
+        self.policy_change_threshold = policy_change_threshold
+        self.q_delta_threshold = q_delta_threshold
+        self.reward_tolerance = reward_tolerance
+        self.patience = patience
+        self.min_episodes = min_episodes
+        self.stop = stop
+        self.rewards = RollingWindow(reward_window)
+        self.policy_changes = RollingWindow(signal_window)
+        self.q_deltas = RollingWindow(signal_window)
+
+        self.previous_q = None
+        self.previous_policy = None
+        self.stable_since = None
+        self.stable_reward = None
+        self.converged_episode = None
+        self.stop_reason = None
+        self.episodes_run = 0
+        # Signals of the last round, for logging
+        self.policy_change_rate = None
+        self.mean_q_delta = None
+        self.max_q_delta = None
+
+    # Called after every round with the training tables; returns True when training should stop
+    def update(self, Q_table, episodes, chunk_rewards):
+        for i in range(len(episodes)):
+            self.rewards.add(sum(rewards[i] for rewards in chunk_rewards) / len(chunk_rewards))
+
+        policy = np.argmax(Q_table.q_values, axis=2)
+        if self.previous_q is None:
+            self.previous_q = np.array(Q_table.q_values)
+            self.previous_policy = policy
+            return False
+
+        visited = np.asarray(Q_table.visited)
+        changed = (policy != self.previous_policy) & visited
+        self.policy_change_rate = changed.sum() / max(1, visited.sum())
+        deltas = np.abs(Q_table.q_values - self.previous_q)
+        updated = deltas[deltas > 0]
+        self.mean_q_delta = float(updated.mean()) if updated.size else 0.0
+        self.max_q_delta = float(updated.max()) if updated.size else 0.0
+        self.previous_q[:] = Q_table.q_values
+        self.previous_policy = policy
+
+        self.policy_changes.add(self.policy_change_rate)
+        self.q_deltas.add(self.mean_q_delta)
+
+        reward = self.rewards.mean()
+        stable = (self.policy_changes.mean() <= self.policy_change_threshold and
+                  self.q_deltas.mean() <= self.q_delta_threshold and
+                  episodes.stop >= self.min_episodes)
+        if stable and self.stable_since is not None:
+            stable = abs(reward - self.stable_reward) <= self.reward_tolerance * max(1.0, abs(self.stable_reward))
+        if not stable:
+            self.stable_since = None
+            return False
+        if self.stable_since is None:
+            self.stable_since = episodes.start
+            self.stable_reward = reward
+
+        if self.converged_episode is None and episodes.stop - self.stable_since >= self.patience:
+            self.converged_episode = episodes.stop
+        return self.stop and self.converged_episode is not None
+
+    # Records why training ended and how many episodes ran
+    def finish(self, stop_reason, episodes_run):
+        self.stop_reason = stop_reason
+        self.episodes_run = episodes_run
+
+    def summary(self):
+        return {
+            'stop_reason': self.stop_reason,
+            'episodes_run': self.episodes_run,
+            'converged_episode': self.converged_episode
+        }
@@ -5,16 +5,74 @@ import random
 # used some of the code from old PAs to help with the visualization
 # used GenAI and documentation for debugging and readability
 
+# Event codes returned by PackageEnv.fast_step. The low bits say what the action did and the
+# terminal flags are added on top, so any code >= EVENT_DELIVERED ends the episode.
+# EVENT_COLLIDED only comes from FleetEnv, where agents can block each other.
+EVENT_MOVED = 0
+EVENT_BLOCKED = 1
+EVENT_PICKED_UP = 2
+EVENT_NO_PICKUP = 3
+EVENT_DROPPED = 4
+EVENT_NO_DROP = 5
+EVENT_INVALID = 6
+EVENT_COLLIDED = 7
+EVENT_DELIVERED = 8
+EVENT_EMPTY = 16
+
+# Builds the (cells, 4) table of the cell reached by UP, DOWN, LEFT and RIGHT from every cell
+# (cell = x * grid_size + y). Moves off the grid or into an obstacle stay on the same cell.
+def build_next_cell_table(grid_size, obstacle_grid):
+    x, y = np.divmod(np.arange(grid_size * grid_size), grid_size)
+    next_cell = np.empty((grid_size * grid_size, 4), dtype=np.int64)
+    # Same directions as PackageEnv.move_agent
+    for direction, (dx, dy) in enumerate([(0, -1), (0, 1), (-1, 0), (1, 0)]):
+        new_x, new_y = x + dx, y + dy
+        in_bounds = (new_x >= 0) & (new_x < grid_size) & (new_y >= 0) & (new_y < grid_size)
+        target = np.where(in_bounds, new_x * grid_size + new_y, 0)
+        free = in_bounds & ~obstacle_grid.ravel()[target]
+        next_cell[:, direction] = np.where(free, target, x * grid_size + y)
+    return next_cell
+
 class PackageEnv(gym.Env):
-    def __init__(self, num_agents):
+    # obstacles: fixed list of (x, y) obstacle cells kept across resets; when None,
+    # num_obstacles cells are re-sampled on every reset
+    # rng: NumPy Generator used for the layouts; None uses the global random module
+    # focus_cells: (x, y) cells to retrain around after a layout change; with probability
+    # focus_rate a reset starts the agents on free cells at most one move from them
+    def __init__(self, num_agents, grid_size=5, num_obstacles=2, obstacles=None, fuel=100, rng=None,
+                 focus_cells=None, focus_rate=0.5):
         super(PackageEnv, self).__init__()
+        self.rng = rng
 
         self.num_agents = num_agents
         self.num_packages = num_agents
-        self.grid_size = 5
+        self.grid_size = grid_size
+        self.fuel = fuel
         self.roads = self.rooms = [(i, j) for i in range(self.grid_size) for j in range(self.grid_size)]
         self.goal_room = (self.grid_size - 1, self.grid_size - 1)
 
+        self.fixed_obstacles = [tuple(pos) for pos in obstacles] if obstacles is not None else None
+        self.num_obstacles = len(self.fixed_obstacles) if obstacles is not None else num_obstacles
+        self.available_positions = [(i, j) for i, j in self.rooms if (i, j) != self.goal_room]
+        if self.fixed_obstacles is not None:
+            if self.goal_room in self.fixed_obstacles:
+                raise ValueError("The goal room cannot be an obstacle.")
+            blocked = set(self.fixed_obstacles)
+            self.available_positions = [pos for pos in self.available_positions if pos not in blocked]
+            needed = self.num_agents + self.num_packages
+        else:
+            needed = self.num_agents + self.num_packages + self.num_obstacles
+        if needed > len(self.available_positions):
+            raise ValueError("Not enough free cells for the requested agents, packages and obstacles.")
+
+        self.focus_rate = focus_rate
+        self.focus_positions = None
+        if focus_cells is not None:
+            if self.fixed_obstacles is None:
+                raise ValueError("Focused resets need a fixed obstacle layout.")
+            near = {(x + dx, y + dy) for x, y in focus_cells for dx, dy in [(0, 0), (0, -1), (0, 1), (-1, 0), (1, 0)]}
+            self.focus_positions = [pos for pos in self.available_positions if pos in near]
+
         self.rewards = {
             'UP': -1,
             'DOWN': -1,
@@ -27,24 +85,72 @@ class PackageEnv(gym.Env):
 
         # Actions
         self.actions = ['UP', 'DOWN', 'LEFT', 'RIGHT', 'PICKUP', 'DROP']
+        self.directions = {'UP': 0, 'DOWN': 1, 'LEFT': 2, 'RIGHT': 3}
+
+        # Reward of every fast_step event code, so the fast path never builds the reward itself
+        self.event_rewards = [0] * (EVENT_EMPTY * 2)
+        for event in range(EVENT_DELIVERED):
+            base = {EVENT_MOVED: -1, EVENT_BLOCKED: -1, EVENT_PICKED_UP: self.rewards['PICKUP'],
+                    EVENT_DROPPED: self.rewards['DROP']}.get(event, 0)
+            self.event_rewards[event] = base
+            self.event_rewards[event | EVENT_DELIVERED] = base + self.rewards['DROP']
+            self.event_rewards[event | EVENT_EMPTY] = base + self.rewards['EMPTY']
+        self.last_event = EVENT_INVALID
+
+        self.obstacle_grid = np.zeros((self.grid_size, self.grid_size), dtype=bool)
+        self.next_cell = None
 
         self.reset()
 
+    # Marks the obstacles on the occupancy grid and rebuilds the next-cell table
+    def set_obstacles(self, obstacles):
+        self.obstacles = list(obstacles)
+        self.obstacle_grid[:] = False
+        for x, y in self.obstacles:
+            self.obstacle_grid[x, y] = True
+        self.next_cell = build_next_cell_table(self.grid_size, self.obstacle_grid)
+        # Nested lists index faster than NumPy scalars on the per-step fast path
+        self.next_cell_rows = self.next_cell.tolist()
+
+    # Distinct free positions (from population, by default every free cell), drawn from self.rng
+    # when one is set
+    def sample_positions(self, count, population=None):
+        if population is None:
+            population = self.available_positions
+        if self.rng is None:
+            return random.sample(population, count)
+        picks = self.rng.choice(len(population), count, replace=False)
+        return [population[i] for i in picks]
+
+    # Whether this reset should start the agents next to the focus cells
+    def focused_reset(self):
+        if self.focus_positions is None or len(self.focus_positions) < self.num_agents:
+            return False
+        return (random.random() if self.rng is None else self.rng.random()) < self.focus_rate
+
     # Resets all agents and packages to random positions
     def reset(self):
-        available_positions = [(i, j) for i, j in self.rooms if (i, j) != self.goal_room]
+        if self.fixed_obstacles is None:
+            # Sample positions for agents, packages, AND obstacles
+            total = self.num_agents + self.num_packages + self.num_obstacles
+            all_positions = self.sample_positions(total)
+            self.set_obstacles(all_positions[self.num_agents + self.num_packages:])  # Last positions become obstacles
+        else:
+            if self.focused_reset():
+                agents = self.sample_positions(self.num_agents, self.focus_positions)
+                rest = [pos for pos in self.available_positions if pos not in agents]
+                all_positions = agents + self.sample_positions(self.num_packages, rest)
+            else:
+                all_positions = self.sample_positions(self.num_agents + self.num_packages)
+            if self.next_cell is None:
+                self.set_obstacles(self.fixed_obstacles)
 
-        # Sample positions for agents, packages, AND obstacles
-        total = self.num_agents + self.num_packages + 2  # +2 for obstacles
-        all_positions = random.sample(available_positions, total)
-        
         # Distribute the positions
         self.agent_positions = all_positions[:self.num_agents]
         self.package_positions = all_positions[self.num_agents:self.num_agents + self.num_packages]
-        self.obstacles = all_positions[self.num_agents + self.num_packages:]  # Last 2 positions become obstacles
 
         self.package_picked = [False] * self.num_agents
-        self.fuel_consumed = [100] * self.num_agents
+        self.fuel_consumed = [self.fuel] * self.num_agents
 
         self.current_state = {
             'agent_positions': self.agent_positions,
@@ -65,24 +171,15 @@ class PackageEnv(gym.Env):
         return False
 
     # Moves agents with accordance to proper movement rules.
+    # Bounds and obstacles are already folded into the next-cell table, so a move is one lookup.
     def move_agent(self, agent_id, action):
-        current_pos = self.current_state['agent_positions'][agent_id]
-        x, y = current_pos
-
-        directions = {
-            'LEFT': (x - 1, y),
-            'RIGHT': (x + 1, y),
-            'UP': (x, y - 1),
-            'DOWN': (x, y + 1)
-        }
-
-        new_pos = directions.get(action, self.current_state['agent_positions'][agent_id])
+        x, y = self.current_state['agent_positions'][agent_id]
+        cell = x * self.grid_size + y
+        new_cell = self.next_cell[cell, self.directions[action]]
 
         # Check if move is valid (within bounds AND not into obstacle)
-        if (0 <= new_pos[0] < self.grid_size and 
-            0 <= new_pos[1] < self.grid_size and 
-            new_pos not in self.obstacles):
-            self.current_state['agent_positions'][agent_id] = new_pos
+        if new_cell != cell:
+            self.current_state['agent_positions'][agent_id] = self.rooms[new_cell]
             self.current_state['fuel_consumed'][agent_id] -= 1
             return f"Moved to {self.current_state['agent_positions']}", self.rewards[action]
         else:
@@ -133,3 +230,400 @@ class PackageEnv(gym.Env):
 
         info = {'result': result, 'action': action_name}
         return self.current_state, reward, done, info
+
+    # Same transition as step, for an action index into self.actions, without building messages,
+    # dicts or tuples. Returns an EVENT_* code; the reward is self.event_rewards[event] and the
+    # episode is over when event >= EVENT_DELIVERED. describe_event gives the step() message.
+    def fast_step(self, action_idx, agent_id):
+        positions = self.agent_positions
+        if 0 <= action_idx < 4:
+            x, y = positions[agent_id]
+            cell = x * self.grid_size + y
+            new_cell = self.next_cell_rows[cell][action_idx]
+            self.fuel_consumed[agent_id] -= 1
+            if new_cell != cell:
+                positions[agent_id] = self.rooms[new_cell]
+                event = EVENT_MOVED
+            else:
+                event = EVENT_BLOCKED
+        elif action_idx == 4:
+            if positions[agent_id] == self.package_positions[agent_id] and not self.package_picked[agent_id]:
+                self.package_picked[agent_id] = True
+                event = EVENT_PICKED_UP
+            else:
+                event = EVENT_NO_PICKUP
+        elif action_idx == 5:
+            if self.package_picked[agent_id] and positions[agent_id] == self.goal_room:
+                event = EVENT_DROPPED
+            else:
+                event = EVENT_NO_DROP
+        else:
+            event = EVENT_INVALID
+
+        if positions[agent_id] == self.goal_room and self.package_picked[agent_id]:
+            event |= EVENT_DELIVERED
+        elif self.fuel_consumed[agent_id] <= 0:
+            event |= EVENT_EMPTY
+        self.last_event = event
+        return event
+
+    # Human-readable message for a fast_step event, matching the 'result' that step() reports
+    def describe_event(self, event):
+        messages = {
+            EVENT_MOVED: f"Moved to {self.current_state['agent_positions']}",
+            EVENT_BLOCKED: "Cannot move: Obstacle or boundary in the way",
+            EVENT_PICKED_UP: "Picked up package",
+            EVENT_NO_PICKUP: "No package to pickup",
+            EVENT_DROPPED: "Dropped package",
+            EVENT_NO_DROP: "No package to drop",
+            EVENT_INVALID: "Invalid action"
+        }
+        result = messages[event & (EVENT_DELIVERED - 1)]
+        if event & EVENT_DELIVERED:
+            result += f" You've dropped the package! {self.rewards['DROP']} points!"
+        elif event & EVENT_EMPTY:
+            result += f" You've run out of fuel! {self.rewards['EMPTY']} points!"
+        return result
+
+
+# Vectorized version of PackageEnv that keeps num_envs independent episodes in NumPy arrays.
+# Cells are stored as flat indices (x * grid_size + y) and actions as indices into ACTIONS.
+class VecPackageEnv:
+    ACTIONS = ['UP', 'DOWN', 'LEFT', 'RIGHT', 'PICKUP', 'DROP']
+    # Same movement convention as PackageEnv.move_agent: UP/DOWN change y, LEFT/RIGHT change x
+    ACTION_DX = np.array([0, 0, -1, 1, 0, 0, 0])
+    ACTION_DY = np.array([-1, 1, 0, 0, 0, 0, 0])
+
+    def __init__(self, num_envs, num_agents=1, grid_size=5, num_obstacles=2, fuel=100, seed=None):
+        self.num_envs = num_envs
+        self.num_agents = num_agents
+        self.num_packages = num_agents
+        self.grid_size = grid_size
+        self.num_cells = grid_size * grid_size
+        self.num_obstacles = num_obstacles
+        self.fuel = fuel
+        self.goal_room = (grid_size - 1, grid_size - 1)
+        self.goal_cell = self.goal_room[0] * grid_size + self.goal_room[1]
+        self.rng = np.random.default_rng(seed)
+
+        if 2 * num_agents + num_obstacles > self.num_cells - 1:
+            raise ValueError("Not enough cells for the requested agents, packages and obstacles.")
+
+        # Same rewards as PackageEnv
+        self.move_reward = -1
+        self.pickup_reward = 5000
+        self.drop_reward = 10000
+        self.empty_reward = -10000
+
+        # Every cell except the goal can hold an agent, a package or an obstacle
+        self.available_cells = np.array([c for c in range(self.num_cells) if c != self.goal_cell])
+
+        self.agent_cells = np.zeros((num_envs, num_agents), dtype=np.int64)
+        self.package_cells = np.zeros((num_envs, num_agents), dtype=np.int64)
+        self.package_picked = np.zeros((num_envs, num_agents), dtype=bool)
+        self.fuel_consumed = np.zeros((num_envs, num_agents), dtype=np.int64)
+        self.obstacles = np.zeros((num_envs, self.num_cells), dtype=bool)
+        self.env_ids = np.arange(num_envs)
+
+        self.current_state = {
+            'agent_cells': self.agent_cells,
+            'package_cells': self.package_cells,
+            'package_picked': self.package_picked,
+            'fuel_consumed': self.fuel_consumed
+        }
+
+        self.reset()
+
+    # Samples k distinct available cells for each of n environments
+    def _sample_cells(self, n, k):
+        population = len(self.available_cells)
+        if k * 4 > population:
+            # Small grids: a random permutation per row is cheap
+            order = np.argsort(self.rng.random((n, population)), axis=1)[:, :k]
+            return self.available_cells[order]
+
+        # Large grids: draw with replacement and redraw the few rows that collide
+        picks = self.rng.integers(0, population, size=(n, k))
+        while True:
+            sorted_picks = np.sort(picks, axis=1)
+            bad = np.flatnonzero((sorted_picks[:, 1:] == sorted_picks[:, :-1]).any(axis=1))
+            if len(bad) == 0:
+                return self.available_cells[picks]
+            picks[bad] = self.rng.integers(0, population, size=(len(bad), k))
+
+    # Resets every environment, or only the ones listed in env_ids, to random positions
+    def reset(self, env_ids=None):
+        if env_ids is None:
+            env_ids = self.env_ids
+        env_ids = np.asarray(env_ids)
+        if env_ids.dtype == bool:
+            env_ids = np.flatnonzero(env_ids)
+        n = len(env_ids)
+        if n == 0:
+            return self.current_state, 0, False
+
+        a = self.num_agents
+        cells = self._sample_cells(n, 2 * a + self.num_obstacles)
+
+        self.agent_cells[env_ids] = cells[:, :a]
+        self.package_cells[env_ids] = cells[:, a:2 * a]
+        self.package_picked[env_ids] = False
+        self.fuel_consumed[env_ids] = self.fuel
+
+        self.obstacles[env_ids] = False
+        if self.num_obstacles:
+            rows = np.repeat(env_ids, self.num_obstacles)
+            self.obstacles[rows, cells[:, 2 * a:].ravel()] = True
+
+        return self.current_state, 0, False
+
+    # Converts the flat cell indices of one agent back to (x, y) arrays
+    def agent_positions(self, agent_id=0):
+        return np.divmod(self.agent_cells[:, agent_id], self.grid_size)
+
+    # Performs one action per environment for agent_id, with the reward and termination rules of PackageEnv.step
+    def step(self, actions, agent_id=0):
+        actions = np.asarray(actions)
+        g = self.grid_size
+        cell = self.agent_cells[:, agent_id]
+        picked = self.package_picked[:, agent_id]
+        fuel = self.fuel_consumed[:, agent_id]
+
+        # Unknown actions behave like PackageEnv's "Invalid action": no move and no reward
+        valid = (actions >= 0) & (actions < len(self.ACTIONS))
+        action_ids = np.where(valid, actions, len(self.ACTIONS))
+
+        # Movement: bounds and obstacles are checked against the proposed cell
+        is_move = action_ids < 4
+        x, y = np.divmod(cell, g)
+        new_x = x + self.ACTION_DX[action_ids]
+        new_y = y + self.ACTION_DY[action_ids]
+        in_bounds = (new_x >= 0) & (new_x < g) & (new_y >= 0) & (new_y < g)
+        new_cell = np.where(in_bounds, new_x * g + new_y, cell)
+        can_move = is_move & in_bounds & ~self.obstacles[self.env_ids, new_cell]
+        cell = np.where(can_move, new_cell, cell)
+        self.agent_cells[:, agent_id] = cell
+        fuel -= is_move
+        self.fuel_consumed[:, agent_id] = fuel
+
+        rewards = np.where(is_move, self.move_reward, 0)
+
+        # Pickup
+        picks = (action_ids == 4) & (cell == self.package_cells[:, agent_id]) & ~picked
+        picked = picked | picks
+        self.package_picked[:, agent_id] = picked
+        rewards += picks * self.pickup_reward
+
+        # Drop
+        at_goal = cell == self.goal_cell
+        drops = (action_ids == 5) & picked & at_goal
+        rewards += drops * self.drop_reward
+
+        # Terminal states, checked in the same order as PackageEnv.is_terminal
+        delivered = at_goal & picked
+        empty = ~delivered & (fuel <= 0)
+        rewards += delivered * self.drop_reward + empty * self.empty_reward
+        dones = delivered | empty
+
+        return self.current_state, rewards, dones, {}
+
+
+# Fleet-scale environment: thousands of agents and packages on one large grid, where agents
+# block each other. Every cell holds at most one agent, tracked in a per-cell occupancy index
+# (the agent id, or -1 when the cell is free), and num_packages is independent of num_agents.
+# Goal rooms are the exception: they are depots that any number of agents can stand on, are never
+# marked in the occupancy index and never block a move, so an agent that stays on the goal room
+# after delivering does not lock the others out of it.
+# Agents keep working after a delivery and pick up the next waiting package.
+# A step only touches the agents that act, so its cost grows with the number of movers rather
+# than with the fleet size, and conflicts are resolved in one vectorized pass:
+#   - a move succeeds only into a cell that was free at the start of the step, so agents never
+#     swap places or follow each other into a cell that is being vacated in the same step
+#   - when several agents move into the same free cell, the lowest agent id gets it (all of them
+#     get in when it is a goal room)
+#   - the others stay where they are with EVENT_COLLIDED and pay the move cost
+class FleetEnv:
+    ACTIONS = ['UP', 'DOWN', 'LEFT', 'RIGHT', 'PICKUP', 'DROP']
+
+    # goal_rooms: (x, y) delivery cells, by default the bottom-right corner like PackageEnv
+    # obstacles: fixed list of (x, y) obstacle cells; when None, num_obstacles are re-sampled on every reset
+    # fuel: moves each agent can make, or None for unlimited
+    def __init__(self, num_agents, num_packages=None, grid_size=64, num_obstacles=0, obstacles=None,
+                 goal_rooms=None, fuel=None, seed=None):
+        self.num_agents = num_agents
+        self.num_packages = num_agents if num_packages is None else num_packages
+        self.grid_size = grid_size
+        self.num_cells = grid_size * grid_size
+        self.fuel = fuel
+        self.rng = np.random.default_rng(seed)
+
+        if goal_rooms is None:
+            goal_rooms = [(grid_size - 1, grid_size - 1)]
+        self.goal_rooms = [tuple(pos) for pos in goal_rooms]
+        self.is_goal = np.zeros(self.num_cells, dtype=bool)
+        for x, y in self.goal_rooms:
+            self.is_goal[x * grid_size + y] = True
+
+        self.fixed_obstacles = None
+        if obstacles is not None:
+            self.fixed_obstacles = np.array([x * grid_size + y for x, y in obstacles], dtype=np.int64)
+            if self.is_goal[self.fixed_obstacles].any():
+                raise ValueError("A goal room cannot be an obstacle.")
+        self.num_obstacles = len(self.fixed_obstacles) if obstacles is not None else num_obstacles
+
+        # Agents, packages and obstacles are all placed off the goal rooms, agents and obstacles
+        # on distinct cells, packages on distinct cells of their own
+        free_cells = self.num_cells - len(self.goal_rooms) - self.num_obstacles
+        if max(self.num_agents, self.num_packages) > free_cells:
+            raise ValueError("Not enough free cells for the requested agents, packages and obstacles.")
+
+        self.rewards = {'MOVE': -1, 'PICKUP': 5000, 'DROP': 10000, 'EMPTY': -10000}
+        # Reward of every event code, indexed with the event arrays returned by step
+        base = np.zeros(EVENT_DELIVERED, dtype=np.int64)
+        base[[EVENT_MOVED, EVENT_BLOCKED, EVENT_COLLIDED]] = self.rewards['MOVE']
+        base[EVENT_PICKED_UP] = self.rewards['PICKUP']
+        base[EVENT_DROPPED] = self.rewards['DROP']
+        self.event_rewards = np.zeros(EVENT_EMPTY * 2, dtype=np.int64)
+        self.event_rewards[:EVENT_DELIVERED] = base
+        self.event_rewards[EVENT_DELIVERED:EVENT_EMPTY] = base + self.rewards['DROP']
+        self.event_rewards[EVENT_EMPTY:EVENT_EMPTY + EVENT_DELIVERED] = base + self.rewards['EMPTY']
+
+        self.obstacle_grid = np.zeros((grid_size, grid_size), dtype=bool)
+        self.next_cell = None
+        self.occupancy = np.full(self.num_cells, -1, dtype=np.int64)
+        # Waiting package on every cell, or -1
+        self.package_at = np.full(self.num_cells, -1, dtype=np.int64)
+
+        self.reset()
+
+    def set_obstacles(self, cells):
+        self.obstacle_grid.ravel()[:] = False
+        self.obstacle_grid.ravel()[cells] = True
+        self.next_cell = build_next_cell_table(self.grid_size, self.obstacle_grid)
+
+    # Distinct cells that are neither goal rooms nor in exclude
+    def _sample_cells(self, count, exclude):
+        allowed = ~self.is_goal
+        allowed[exclude] = False
+        return self.rng.choice(np.flatnonzero(allowed), count, replace=False)
+
+    # Scatters the agents and packages (and the obstacles, unless they are fixed) over the grid
+    def reset(self):
+        if self.fixed_obstacles is None:
+            obstacle_cells = self._sample_cells(self.num_obstacles, [])
+            self.set_obstacles(obstacle_cells)
+        else:
+            obstacle_cells = self.fixed_obstacles
+            if self.next_cell is None:
+                self.set_obstacles(obstacle_cells)
+
+        self.agent_cells = self._sample_cells(self.num_agents, obstacle_cells)
+        self.package_cells = self._sample_cells(self.num_packages, obstacle_cells)
+        # Package each agent carries, or -1
+        self.carrying = np.full(self.num_agents, -1, dtype=np.int64)
+        self.delivered = np.zeros(self.num_packages, dtype=bool)
+        # Fuel left per agent, unused when fuel is None
+        self.fuel_consumed = np.full(self.num_agents, 0 if self.fuel is None else self.fuel, dtype=np.int64)
+
+        self.occupancy.fill(-1)
+        self.occupancy[self.agent_cells] = np.arange(self.num_agents)
+        self.package_at.fill(-1)
+        self.package_at[self.package_cells] = np.arange(self.num_packages)
+
+        self.num_delivered = 0
+        self.num_collisions = 0
+
+        self.current_state = {
+            'agent_cells': self.agent_cells,
+            'package_cells': self.package_cells,
+            'carrying': self.carrying,
+            'delivered': self.delivered,
+            'fuel_consumed': self.fuel_consumed
+        }
+        return self.current_state, 0, False
+
+    # Agent id on every given cell, -1 where the cell is free or a goal room
+    def agents_at(self, cells):
+        return self.occupancy[cells]
+
+    # Performs actions[i] for agent agent_ids[i] (every agent when agent_ids is None, else distinct
+    # ids); agents that are not listed wait. Actions are indices into ACTIONS and anything else is invalid.
+    # Returns the agent ids that acted and their EVENT_* codes; the rewards are
+    # self.event_rewards[events]. EVENT_DELIVERED is set when an agent reaches a goal room with a
+    # package and EVENT_EMPTY when its fuel runs out, after which it stays parked on its cell.
+    def step(self, actions, agent_ids=None):
+        actions = np.asarray(actions, dtype=np.int64)
+        if agent_ids is None:
+            agent_ids = np.arange(self.num_agents)
+        agent_ids = np.asarray(agent_ids, dtype=np.int64)
+        events = np.full(len(agent_ids), EVENT_INVALID, dtype=np.int64)
+
+        # Agents without fuel cannot act
+        if self.fuel is not None:
+            actions = np.where(self.fuel_consumed[agent_ids] > 0, actions, -1)
+
+        # Moves
+        movers = np.flatnonzero((actions >= 0) & (actions < 4))
+        mover_ids = agent_ids[movers]
+        cells = self.agent_cells[mover_ids]
+        targets = self.next_cell[cells, actions[movers]]
+        events[movers] = EVENT_BLOCKED
+        if self.fuel is not None:
+            self.fuel_consumed[mover_ids] -= 1
+
+        # Only targets that were free at the start of the step can be claimed; sorting by
+        # (target, agent id) puts the winner first among the agents that want the same cell
+        moving = targets != cells
+        free = self.occupancy[targets] < 0
+        wants = np.flatnonzero(moving & free)
+        order = wants[np.lexsort((mover_ids[wants], targets[wants]))]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = targets[order[1:]] != targets[order[:-1]]
+        first |= self.is_goal[targets[order]]
+        winners = order[first]
+        collided = moving & ~free
+        collided[order[~first]] = True
+        events[movers[collided]] = EVENT_COLLIDED
+        self.num_collisions += int(np.count_nonzero(collided))
+
+        winner_ids = mover_ids[winners]
+        self.occupancy[cells[winners]] = -1
+        tracked = ~self.is_goal[targets[winners]]
+        self.occupancy[targets[winners][tracked]] = winner_ids[tracked]
+        self.agent_cells[winner_ids] = targets[winners]
+        events[movers[winners]] = EVENT_MOVED
+
+        # Pickups: one agent per cell, so no two agents can take the same package
+        pickers = np.flatnonzero(actions == 4)
+        picker_ids = agent_ids[pickers]
+        picker_cells = self.agent_cells[picker_ids]
+        packages = self.package_at[picker_cells]
+        picks = (packages >= 0) & (self.carrying[picker_ids] < 0)
+        self.carrying[picker_ids[picks]] = packages[picks]
+        self.package_at[picker_cells[picks]] = -1
+        events[pickers] = np.where(picks, EVENT_PICKED_UP, EVENT_NO_PICKUP)
+
+        droppers = np.flatnonzero(actions == 5)
+        dropper_ids = agent_ids[droppers]
+        drops = self.is_goal[self.agent_cells[dropper_ids]] & (self.carrying[dropper_ids] >= 0)
+        events[droppers] = np.where(drops, EVENT_DROPPED, EVENT_NO_DROP)
+
+        # Deliveries, as in PackageEnv: any agent on a goal room with a package delivers it
+        acted = np.flatnonzero(actions >= 0)
+        acted_ids = agent_ids[acted]
+        delivering = self.is_goal[self.agent_cells[acted_ids]] & (self.carrying[acted_ids] >= 0)
+        delivered_ids = acted_ids[delivering]
+        self.delivered[self.carrying[delivered_ids]] = True
+        self.carrying[delivered_ids] = -1
+        self.num_delivered += len(delivered_ids)
+        events[acted[delivering]] |= EVENT_DELIVERED
+
+        if self.fuel is not None:
+            empty = self.fuel_consumed[mover_ids] <= 0
+            events[movers[empty]] |= EVENT_EMPTY
+
+        return agent_ids, events
+
+    # True once every package has been delivered
+    def all_delivered(self):
+        return self.num_delivered == self.num_packages
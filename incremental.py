@@ -0,0 +1,215 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from convergence import ConvergenceMonitor
+from policy import compile_policy, write_policy
+from q_learning import num_states, q_learning_multi_agent
+from q_table import read_q_tables, write_q_tables
+from shortest_paths import path_cache
+from value_iteration import build_model, live_states, model_state_hashes
+
+# Incremental retraining after a change to a fixed obstacle layout (e.g. a closed road in the depot
+# map). Instead of training from scratch, the existing tables are loaded, only the rows of the
+# states around the changed cells are reseeded, and training continues from the old tables with
+# a low epsilon and episodes that start around the change, until the convergence monitor says the
+# policy has settled again.
+# A state touches a cell when the agent stands on it or next to it (its moves into the cell change)
+# or when the package lies on it. A reverse index from every cell to the states that touch it,
+# stored as CSR arrays, finds the affected rows without scanning the table: the states touching
+# any free cell within radius moves of a change.
+# Those rows are reseeded with backups of the trainer's own target (own max blended with the
+# shared value by alpha) on the new layout's deterministic model (see value_iteration.build_model),
+# so the episodes that follow start from their fixed point instead of pulling the rows elsewhere.
+# Only the affected rows are swept and the rest of the table is read as it is, so moves into new
+# obstacles lose their value, freed cells get one and the detours spread to the edge of the region.
+# Resetting the rows to the initial value instead throws away what the tables know: it sits far
+# below the trained values, so the agents avoid the area.
+# The update counts of the reseeded rows restart, so the episodes that follow take full steps there.
+
+# (dx, dy) of the PackageEnv moves UP, DOWN, LEFT, RIGHT, plus staying on the cell
+NEIGHBOURS = [(0, 0), (0, -1), (0, 1), (-1, 0), (1, 0)]
+
+# Agent cell, package cell and hash_state row of every model state (see value_iteration), all of
+# shape (cells, 2, cells) for (agent cell, picked, package cell)
+def state_grid(grid_size):
+    cells = grid_size * grid_size
+    agent, _, package = np.meshgrid(np.arange(cells), [0, 1], np.arange(cells), indexing='ij')
+    return agent, package, model_state_hashes(grid_size).reshape(cells, 2, cells)
+
+# Reverse index: the states touching cell c are states[offsets[c]:offsets[c + 1]]
+def build_reverse_index(grid_size):
+    agent, package, states = state_grid(grid_size)
+    agent, package, states = agent.ravel(), package.ravel(), states.ravel()
+    x, y = np.divmod(agent, grid_size)
+    touched_cells = [package]
+    touched_states = [states]
+    for dx, dy in NEIGHBOURS:
+        inside = (x + dx >= 0) & (x + dx < grid_size) & (y + dy >= 0) & (y + dy < grid_size)
+        touched_cells.append(((x + dx) * grid_size + y + dy)[inside])
+        touched_states.append(states[inside])
+    touched_cells = np.concatenate(touched_cells)
+    touched_states = np.concatenate(touched_states)
+
+    order = np.argsort(touched_cells, kind='stable')
+    offsets = np.zeros(grid_size * grid_size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(touched_cells, minlength=grid_size * grid_size), out=offsets[1:])
+    return offsets, touched_states[order]
+
+# Distinct states touching any of the (x, y) cells
+def affected_states(index, grid_size, cells):
+    offsets, states = index
+    rows = [states[offsets[x * grid_size + y]:offsets[x * grid_size + y + 1]] for x, y in cells]
+    return np.unique(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
+
+# Cells that became obstacles and cells that were freed
+def layout_diff(old_obstacles, new_obstacles):
+    old = {tuple(pos) for pos in old_obstacles}
+    new = {tuple(pos) for pos in new_obstacles}
+    return sorted(new - old), sorted(old - new)
+
+# Changed cells plus the free cells less than radius moves from one on the new layout
+def cells_near(grid_size, new_obstacles, changed, radius):
+    blocked = {tuple(pos) for pos in new_obstacles}
+    sources = set()
+    for x, y in changed:
+        for dx, dy in NEIGHBOURS:
+            if 0 <= x + dx < grid_size and 0 <= y + dy < grid_size and (x + dx, y + dy) not in blocked:
+                sources.add((x + dx) * grid_size + y + dy)
+    near = set(changed)
+    if sources:
+        dist = path_cache.get(grid_size, new_obstacles).dist[sorted(sources)]
+        near.update(divmod(int(cell), grid_size) for cell in np.flatnonzero(((dist >= 0) & (dist < radius)).any(axis=0)))
+    return sorted(near)
+
+# Reseeds the rows of states for every agent with backups on the new layout until they move less
+# than tol (see the top of the file), marks the live ones visited, restarts their update counts
+# and rebuilds the shared aggregate. Returns the number of sweeps.
+def reseed_rows(Q_table, grid_size, new_obstacles, states, gamma=0.99, alpha=0.5, tol=1e-3, max_sweeps=1000):
+    next_state, reward, terminal = build_model(grid_size, new_obstacles)
+    hashes = model_state_hashes(grid_size)
+    # Rows from state_grid map back to model states
+    model_states = (states - (grid_size * grid_size - 1)) // grid_size
+    model_states = model_states[live_states(grid_size, new_obstacles)[model_states]]
+    rows = hashes[model_states]
+    reward = reward[model_states]
+    continuing = gamma * ~terminal[model_states]
+
+    # The sweeps run on a compact copy of the rows. Each distinct next state's max is taken once
+    # per sweep; next states outside the rows keep their value and are read only once.
+    q_values = Q_table.q_values
+    current = q_values[:, rows]
+    next_rows, next_index = np.unique(hashes[next_state[model_states]], return_inverse=True)
+    next_index = next_index.reshape(len(rows), -1)
+    order = np.argsort(rows)
+    position = np.minimum(np.searchsorted(rows, next_rows, sorter=order), len(rows) - 1)
+    inside = rows[order[position]] == next_rows
+    inside_rows = order[position[inside]]
+    next_max = q_values[:, next_rows].max(axis=2)
+
+    sweep = 0
+    for sweep in range(1, max_sweeps + 1):
+        next_max[:, inside] = current[:, inside_rows].max(axis=2)
+        # Every agent has visited these rows, so the shared value is the mean over agents
+        backup = reward + continuing * ((1 - alpha) * next_max[:, next_index] + alpha * current.mean(axis=0))
+        delta = np.abs(backup - current).max(initial=0)
+        current = backup
+        if delta < tol:
+            break
+
+    q_values[:, rows] = current
+    Q_table.visited[:, rows] = True
+    Q_table.num_updates[:, states] = 0
+    Q_table.rebuild_shared()
+    return sweep
+
+# Default reseed radius. On 5x5 one move already covers about 80% of the visited rows around a
+# change (radius 0 leaves the detours stale and delivers about 60%); larger grids widen it.
+def default_radius(grid_size):
+    return max(1, grid_size // 5)
+
+# Adapts Q_table, trained on old_obstacles, to new_obstacles in place and continues training on
+# the new layout for at most max_episodes episodes, stopping once it converges again. Extra
+# keyword arguments go to q_learning_multi_agent. Returns the retrained tables and a summary.
+def retrain(Q_table, old_obstacles, new_obstacles, grid_size=5, radius=None, max_episodes=5000, gamma=0.99,
+            epsilon=0.3, decay_rate=0.999, epsilon_floor=0.1, alpha=0.5, convergence=None, seed=None, **kwargs):
+    if Q_table.num_states != num_states(grid_size):
+        raise ValueError(f"The Q-tables do not belong to a {grid_size}x{grid_size} grid")
+    if radius is None:
+        radius = default_radius(grid_size)
+    visited_rows = int(Q_table.visited.sum())
+    added, removed = layout_diff(old_obstacles, new_obstacles)
+    changed = added + removed
+    start = time.perf_counter()
+    region = cells_near(grid_size, new_obstacles, changed, radius)
+    states = affected_states(build_reverse_index(grid_size), grid_size, region)
+    # Rows holding learned values that the reseed replaces, counted before it marks the rest visited
+    reseeded_rows = int(Q_table.visited[:, states].sum()) if changed else 0
+    sweeps = reseed_rows(Q_table, grid_size, new_obstacles, states, gamma, alpha) if changed else 0
+    reseed_seconds = time.perf_counter() - start
+    if convergence is None:
+        convergence = ConvergenceMonitor(min_episodes=200, patience=200, reward_window=100)
+
+    if changed and max_episodes > 0:
+        Q_table = q_learning_multi_agent(max_episodes, Q_table.num_agents, gamma, epsilon, decay_rate,
+                                         epsilon_floor=epsilon_floor, plot=False, grid_size=grid_size,
+                                         obstacles=new_obstacles, convergence=convergence, seed=seed,
+                                         alpha=alpha, initial_table=Q_table, focus_cells=changed, **kwargs)
+    return Q_table, {
+        'added': added,
+        'removed': removed,
+        'radius': radius,
+        'reseeded_rows': reseeded_rows,
+        'visited_rows': visited_rows,
+        'sweeps': sweeps,
+        'reseed_seconds': reseed_seconds,
+        'episodes_run': convergence.episodes_run,
+        'stop_reason': convergence.stop_reason if changed and max_episodes > 0 else 'reseeded only' if changed else 'unchanged',
+        'seconds': time.perf_counter() - start
+    }
+
+def parse_cells(values):
+    return [tuple(int(v) for v in value.split(',')) for value in values]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrain Q-tables after obstacles are added or removed")
+    parser.add_argument('q_table', nargs='?', default='q_table.bin')
+    parser.add_argument('--layout', nargs='*', default=None,
+                        help="current obstacles as x,y (default: the layout saved with the tables)")
+    parser.add_argument('--add', nargs='*', default=[], help="new obstacles as x,y")
+    parser.add_argument('--remove', nargs='*', default=[], help="obstacles to remove as x,y")
+    parser.add_argument('--grid-size', type=int, default=5)
+    parser.add_argument('--radius', type=int, default=None,
+                        help="reseed the states within this many moves of a change (default: grid size // 5, at least 1)")
+    parser.add_argument('--episodes', type=int, default=5000, help="episode budget (0 only reseeds)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default=None, help="default: the input name with a _retrained suffix")
+    args = parser.parse_args()
+    # The input and its policy.npy are left alone; the compiled policy is written next to the output
+    output = args.output or os.path.splitext(args.q_table)[0] + '_retrained.bin'
+    policy_output = os.path.splitext(output)[0] + '_policy.npy'
+
+    Q_table, metadata = read_q_tables(args.q_table, mode=None)
+    if args.layout is not None:
+        old_obstacles = parse_cells(args.layout)
+    elif metadata.get('obstacles') is not None:
+        old_obstacles = [tuple(pos) for pos in metadata['obstacles']]
+    else:
+        parser.error(f"{args.q_table} has no saved obstacle layout: it was trained on re-sampled layouts, so there "
+                     f"is no layout to change. Train on a fixed one with q_learning.py --obstacles x,y ..., "
+                     f"or pass the layout the tables were trained on with --layout")
+    removed = set(parse_cells(args.remove))
+    new_obstacles = [pos for pos in old_obstacles if pos not in removed] + \
+        [pos for pos in parse_cells(args.add) if pos not in old_obstacles]
+
+    Q_table, summary = retrain(Q_table, old_obstacles, new_obstacles, args.grid_size, args.radius,
+                               args.episodes, seed=args.seed)
+    write_q_tables(Q_table, output, dict(summary, obstacles=new_obstacles))
+    write_policy(compile_policy(Q_table), policy_output)
+    print(f"Reseeded {summary['reseeded_rows']} of {summary['visited_rows']} visited rows "
+          f"({summary['reseeded_rows'] / max(summary['visited_rows'], 1):.0%}, radius {summary['radius']}) "
+          f"in {summary['sweeps']} sweeps ({summary['reseed_seconds'] * 1e3:.0f} ms), then "
+          f"{summary['episodes_run']} episodes ({summary['stop_reason']}) in {summary['seconds']:.1f}s")
+    print(f"Wrote {output} and {policy_output}")
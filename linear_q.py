@@ -0,0 +1,338 @@
+import argparse
+import time
+
+import numpy as np
+
+from environment import VecPackageEnv
+from q_table import read_arrays, write_arrays
+
+# Q-learning with a linear function of features, for grids too big for a hash_state table.
+# Q(s, a) is the fitted immediate reward of the action's outcome (blocked, toward, away, PICKUP
+# or delivery), plus the value of the afterstate, interpolated between knots on its Manhattan
+# moves left, with a weight for moving back onto a visited cell, plus a per-move weight for the
+# local context (direction to the target and the blocked mask of the eight neighbours).
+# A batch of states is a few small index arrays, so its Q-values are one gather and its TD update
+# one bincount per weight array, and the weights take the same memory on any grid size.
+
+NUM_ACTIONS = 6
+PICKUP = 4
+# Knots of the afterstate values; moves left beyond the last knot share its value
+KNOTS = np.concatenate([[0], np.unique(np.round(2 ** (np.arange(33) / 2)))]).astype(np.int64)
+NUM_CONTEXTS = 2 * 9 * 256
+# Outcomes, for each picked flag: blocked, toward, away, PICKUP on the package (searching) or
+# delivery (carrying), PICKUP elsewhere, DROP
+NUM_OUTCOMES = 6
+# PICKUP off the package and DROP change nothing, so they are left out of the greedy choice, the
+# exploration and the TD target's max rather than letting an agent wait out the episode
+USELESS = np.tile([False, False, False, False, True, True], 2)
+# Context weights move by the mean of their steps shrunk toward zero as if PRIOR_COUNT more
+# transitions had a TD error of 0, so the contexts seen once or twice in a batch take small steps
+PRIOR_COUNT = 8
+
+# (dx, dy) of the VecPackageEnv moves UP, DOWN, LEFT, RIGHT, then the diagonal neighbours
+MOVES = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+DIAGONALS = [(-1, -1), (1, -1), (-1, 1), (1, 1)]
+
+# Manhattan moves left for agents at (x, y) with packages at (px, py): to the package, one PICKUP
+# and on to the goal room, or only to the goal room once picked
+def moves_left(x, y, px, py, picked, goal_room):
+    gx, gy = goal_room
+    to_goal = np.abs(gx - x) + np.abs(gy - y)
+    via_package = np.abs(px - x) + np.abs(py - y) + 1 + np.abs(gx - px) + np.abs(gy - py)
+    return np.where(picked, to_goal, via_package)
+
+# Lower knot index and interpolation weight of the upper knot for every count of moves left
+def knot_weights(moves):
+    moves = np.minimum(moves, KNOTS[-1])
+    lower = np.minimum(np.searchsorted(KNOTS, moves, side='right') - 1, len(KNOTS) - 2)
+    return lower, (moves - KNOTS[lower]) / (KNOTS[lower + 1] - KNOTS[lower])
+
+# Whether (x, y) is outside the grid or an obstacle in each row of obstacles
+def is_blocked(grid_size, obstacles, x, y):
+    inside = (x >= 0) & (x < grid_size) & (y >= 0) & (y < grid_size)
+    blocked = ~inside
+    blocked[inside] = obstacles[np.flatnonzero(inside), x[inside] * grid_size + y[inside]]
+    return blocked
+
+class LinearQ:
+    NUM_KNOTS = len(KNOTS)
+
+    def __init__(self, learning_rate=0.1, value_weights=None, context_weights=None, outcome_weights=None):
+        self.learning_rate = learning_rate
+        # Knots, the offsets for searching and carrying, then the weights of a move back onto a cell
+        # visited while searching and while carrying
+        self.value_weights = np.zeros(self.NUM_KNOTS + 4) if value_weights is None else value_weights
+        self.context_weights = (np.zeros((NUM_CONTEXTS, 4)) if context_weights is None
+                                else context_weights)
+        self.outcome_weights = np.zeros(2 * NUM_OUTCOMES) if outcome_weights is None else outcome_weights
+        self.num_updates = 0
+
+    @property
+    def nbytes(self):
+        return self.value_weights.nbytes + self.context_weights.nbytes + self.outcome_weights.nbytes
+
+    # Features of n agents on a grid_size grid, obstacles being the (n, cells) obstacle mask of each
+    # agent's environment and visited, if given, the (n, cells) mask of the cells each agent has
+    # visited (see mark_visits): the value weights of every action's afterstate (two knots, the
+    # picked offset and the revisit weight) and their weights, shapes (n, NUM_ACTIONS, 4), the
+    # context of each agent, shape (n,), and the outcome of every action, shape (n, NUM_ACTIONS)
+    def features(self, grid_size, goal_room, agent_cells, package_cells, picked, obstacles, visited=None):
+        n = len(agent_cells)
+        x, y = np.divmod(agent_cells, grid_size)
+        px, py = np.divmod(package_cells, grid_size)
+        dx = np.where(picked, goal_room[0], px) - x
+        dy = np.where(picked, goal_room[1], py) - y
+        left = moves_left(x, y, px, py, picked, goal_room)
+
+        outcomes = np.empty((n, NUM_ACTIONS), dtype=np.int64)
+        revisits = np.zeros((n, NUM_ACTIONS))
+        after_left = np.repeat(left[:, None], NUM_ACTIONS, axis=1)
+        after_picked = np.repeat(picked[:, None], NUM_ACTIONS, axis=1)
+        blocked_mask = np.zeros(n, dtype=np.int64)
+        for move, (mx, my) in enumerate(MOVES):
+            blocked = is_blocked(grid_size, obstacles, x + mx, y + my)
+            blocked_mask |= blocked << move
+            toward = mx * dx + my * dy > 0
+            after_left[:, move] += np.where(blocked, 0, np.where(toward, -1, 1))
+            delivers = picked & ~blocked & (after_left[:, move] == 0)
+            outcomes[:, move] = np.where(blocked, 0, np.where(delivers, 3, np.where(toward, 1, 2)))
+            if visited is not None:
+                free = np.flatnonzero(~blocked)
+                revisits[free, move] = visited[free, (x[free] + mx) * grid_size + y[free] + my]
+        for corner, (mx, my) in enumerate(DIAGONALS):
+            blocked_mask |= is_blocked(grid_size, obstacles, x + mx, y + my) << (4 + corner)
+        on_package = (dx == 0) & (dy == 0) & ~picked
+        outcomes[:, PICKUP] = np.where(on_package, 3, 4)
+        after_left[:, PICKUP] -= on_package
+        after_picked[:, PICKUP] |= on_package
+        outcomes[:, 5] = 5
+        outcomes += picked[:, None] * NUM_OUTCOMES
+
+        lower, upper_weight = knot_weights(after_left)
+        knots = np.stack([lower, lower + 1, self.NUM_KNOTS + after_picked,
+                          np.broadcast_to(self.NUM_KNOTS + 2 + picked[:, None], lower.shape)], axis=2)
+        weights = np.stack([1 - upper_weight, upper_weight, np.ones_like(upper_weight), revisits], axis=2)
+        direction = (np.sign(dx) + 1) * 3 + np.sign(dy) + 1
+        contexts = (picked * 9 + direction) * 256 + blocked_mask
+        return knots, weights, contexts, outcomes
+
+    # Features of the agent_id of every environment in a VecPackageEnv
+    def env_features(self, env, agent_id=0, visited=None):
+        return self.features(env.grid_size, env.goal_room, env.agent_cells[:, agent_id],
+                             env.package_cells[:, agent_id], env.package_picked[:, agent_id], env.obstacles,
+                             visited)
+
+    # (n, NUM_ACTIONS) Q-values of a batch of features
+    def q_values(self, features):
+        knots, weights, contexts, outcomes = features
+        q_values = (self.value_weights[knots] * weights).sum(axis=2) + self.outcome_weights[outcomes]
+        q_values[:, :4] += self.context_weights[contexts]
+        return q_values
+
+    # Q-values with the actions that change nothing at -inf
+    def useful_q_values(self, features):
+        return np.where(USELESS[features[3]], -np.inf, self.q_values(features))
+
+    def greedy(self, features):
+        return self.useful_q_values(features).argmax(axis=1)
+
+    # One semi-gradient TD update for the whole batch. Each transition's TD error is split between
+    # its afterstate value and context weights, the outcome weights move toward the rewards, and a
+    # weight that several transitions share moves by the mean of their steps rather than the sum.
+    # The knots are then clipped so each is at least one reward per move below the one before:
+    # every extra move costs at least that, and a curve that falls everywhere keeps moves toward
+    # the target ahead of moves away even where the TD targets are still noise.
+    # Returns the TD errors.
+    def update(self, features, actions, rewards, next_features, dones, gamma):
+        knots, weights, contexts, outcomes = features
+        rows = np.arange(len(actions))
+        targets = rewards + np.where(dones, 0, gamma * self.useful_q_values(next_features).max(axis=1))
+        td_errors = targets - self.q_values(features)[rows, actions]
+        step = self.learning_rate / 2
+
+        knots, weights = knots[rows, actions], weights[rows, actions]
+        sums = np.bincount(knots.ravel(), (weights * td_errors[:, None]).ravel(), minlength=self.value_weights.size)
+        counts = np.bincount(knots.ravel(), weights.ravel(), minlength=self.value_weights.size)
+        self.value_weights += step * sums / np.maximum(counts, 1)
+        curve = self.value_weights[1:self.NUM_KNOTS] + KNOTS[1:]
+        self.value_weights[1:self.NUM_KNOTS] = np.minimum.accumulate(curve) - KNOTS[1:]
+
+        moved = actions < 4
+        flat = contexts[moved] * 4 + actions[moved]
+        sums = np.bincount(flat, td_errors[moved], minlength=self.context_weights.size)
+        counts = np.bincount(flat, minlength=self.context_weights.size)
+        self.context_weights += (step * sums / (counts + PRIOR_COUNT)).reshape(self.context_weights.shape)
+        self.context_weights -= self.context_weights.mean(axis=1, keepdims=True)
+
+        flat = outcomes[rows, actions]
+        sums = np.bincount(flat, rewards - self.outcome_weights[flat], minlength=self.outcome_weights.size)
+        counts = np.bincount(flat, minlength=self.outcome_weights.size)
+        self.outcome_weights += self.learning_rate * sums / np.maximum(counts, 1)
+        self.num_updates += len(actions)
+        return td_errors
+
+# A uniformly random useful action for every row of outcomes
+def random_useful_actions(rng, outcomes):
+    return np.where(USELESS[outcomes], -1, rng.random(outcomes.shape)).argmax(axis=1)
+
+# Marks the cell of the agent_id of every environment as visited. The cells visited on the way to a
+# package mean nothing on the way to the goal, so environments whose picked flag no longer matches
+# picked forget them first.
+def mark_visits(visited, env, picked=None, agent_id=0):
+    if picked is not None:
+        visited[env.package_picked[:, agent_id] != picked] = False
+    visited[np.arange(len(visited)), env.agent_cells[:, agent_id]] = True
+
+# Potential of every agent for reward shaping: minus its Manhattan moves left. Shortest routes
+# are unaffordable to tabulate on these grids (see shortest_paths), and with sparse obstacles the
+# Manhattan distance is rarely far off.
+def manhattan_potential(env, agent_id=0):
+    x, y = np.divmod(env.agent_cells[:, agent_id], env.grid_size)
+    px, py = np.divmod(env.package_cells[:, agent_id], env.grid_size)
+    return -moves_left(x, y, px, py, env.package_picked[:, agent_id], env.goal_room)
+
+# Trains on num_envs VecPackageEnv episodes at a time until num_episodes have finished, with
+# epsilon decaying by decay_rate per finished episode down to epsilon_floor. Layouts get
+# grid_size obstacles by default, and fuel defaults to 100 moves, or five times the grid size on
+# larger grids so a route across the grid fits. The learning rate falls linearly over the run to
+# 5% of learning_rate, so the weights returned have settled rather than following the last batches.
+# Every step of the batch is one update, so fewer environments learn in fewer episodes.
+# callback(episode, reward) is called for every finished episode.
+# Returns the learner and the finished episodes' rewards and lengths.
+def train_linear(num_episodes, grid_size=200, num_envs=32, num_obstacles=None, fuel=None, gamma=0.99,
+                 epsilon=1.0, decay_rate=0.999, epsilon_floor=0.05, learning_rate=0.1, shaping=20.0, seed=None,
+                 learner=None, callback=None):
+    if num_obstacles is None:
+        num_obstacles = grid_size
+    if fuel is None:
+        fuel = max(100, 5 * grid_size)
+    rng = np.random.default_rng(seed)
+    env = VecPackageEnv(num_envs, grid_size=grid_size, num_obstacles=num_obstacles, fuel=fuel,
+                        seed=None if seed is None else seed + 1)
+    if learner is None:
+        learner = LinearQ(learning_rate)
+
+    episode_rewards = np.zeros(num_envs)
+    episode_steps = np.zeros(num_envs, dtype=np.int64)
+    rewards_log = []
+    steps_log = []
+    rows = np.arange(num_envs)
+    visited = np.zeros((num_envs, grid_size * grid_size), dtype=bool)
+    mark_visits(visited, env)
+    features = learner.env_features(env, visited=visited)
+    potential = manhattan_potential(env)
+    while len(rewards_log) < num_episodes:
+        actions = learner.greedy(features)
+        explore = rng.random(num_envs) < epsilon
+        actions[explore] = random_useful_actions(rng, features[3][explore])
+
+        picked = env.package_picked[:, 0].copy()
+        _, rewards, dones, _ = env.step(actions)
+        mark_visits(visited, env, picked)
+        next_features = learner.env_features(env, visited=visited)
+        learned_rewards = rewards
+        if shaping:
+            # Terminal states have potential 0
+            next_potential = np.where(dones, 0, manhattan_potential(env))
+            learned_rewards = rewards + shaping * (gamma * next_potential - potential)
+            potential = next_potential
+        learner.update(features, actions, learned_rewards, next_features, dones, gamma)
+        episode_rewards += rewards
+        episode_steps += 1
+
+        finished = rows[dones]
+        if len(finished):
+            for env_id in finished:
+                rewards_log.append(episode_rewards[env_id])
+                steps_log.append(episode_steps[env_id])
+                if callback is not None:
+                    callback(len(rewards_log), episode_rewards[env_id])
+            episode_rewards[finished] = 0
+            episode_steps[finished] = 0
+            epsilon = max(epsilon_floor, epsilon * decay_rate ** len(finished))
+            learner.learning_rate = learning_rate * max(0.05, 1 - len(rewards_log) / num_episodes)
+            env.reset(finished)
+            visited[finished] = False
+            mark_visits(visited, env)
+            if shaping:
+                potential[finished] = manhattan_potential(env)[finished]
+            reset_features = learner.env_features(env, visited=visited)
+            for array, reset in zip(next_features, reset_features):
+                array[finished] = reset[finished]
+        features = next_features
+    return learner, np.array(rewards_log[:num_episodes]), np.array(steps_log[:num_episodes])
+
+# Plays num_episodes greedy episodes at once, like policy.evaluate_policy, taking a random useful
+# action with probability epsilon (a little randomness breaks the loops between two cells), and
+# reports the delivery rate, the mean steps (counted up to the end of each episode) and the mean reward
+def evaluate_linear(learner, num_episodes=1000, max_steps=None, grid_size=200, num_obstacles=None, fuel=None,
+                    epsilon=0.0, seed=0):
+    if num_obstacles is None:
+        num_obstacles = grid_size
+    if fuel is None:
+        fuel = max(100, 5 * grid_size)
+    if max_steps is None:
+        max_steps = fuel
+    env = VecPackageEnv(num_episodes, grid_size=grid_size, num_obstacles=num_obstacles, fuel=fuel, seed=seed)
+    rng = np.random.default_rng(seed)
+    running = np.ones(num_episodes, dtype=bool)
+    delivered = np.zeros(num_episodes, dtype=bool)
+    steps = np.zeros(num_episodes, dtype=np.int64)
+    total_reward = np.zeros(num_episodes)
+    visited = np.zeros((num_episodes, env.grid_size * env.grid_size), dtype=bool)
+    mark_visits(visited, env)
+    for _ in range(max_steps):
+        features = learner.env_features(env, visited=visited)
+        actions = learner.greedy(features)
+        explore = rng.random(num_episodes) < epsilon
+        actions[explore] = random_useful_actions(rng, features[3][explore])
+        picked = env.package_picked[:, 0].copy()
+        _, rewards, dones, _ = env.step(actions)
+        mark_visits(visited, env, picked)
+        total_reward += np.where(running, rewards, 0)
+        steps += running
+        arrived = env.package_picked[:, 0] & (env.agent_cells[:, 0] == env.goal_cell)
+        delivered |= running & dones & arrived
+        running &= ~dones
+        if not running.any():
+            break
+    return {'episodes': num_episodes, 'delivery_rate': delivered.mean(),
+            'mean_steps': steps.mean(), 'mean_reward': total_reward.mean()}
+
+# Writes the weights in the binary container of q_table.write_arrays
+def write_linear(learner, path, metadata=None):
+    write_arrays(path, [('value_weights', learner.value_weights), ('context_weights', learner.context_weights),
+                        ('outcome_weights', learner.outcome_weights)], {
+        'kind': 'linear',
+        'knots': KNOTS.tolist(),
+        'num_actions': NUM_ACTIONS,
+        'learning_rate': learner.learning_rate
+    }, metadata)
+
+def read_linear(path):
+    header, arrays = read_arrays(path, mode=None)
+    if header.get('kind') != 'linear':
+        raise ValueError(f"{path} does not hold linear Q-weights")
+    if header['knots'] != KNOTS.tolist():
+        raise ValueError(f"{path} was written with a different feature set")
+    learner = LinearQ(header['learning_rate'], arrays['value_weights'], arrays['context_weights'],
+                      arrays['outcome_weights'])
+    return learner, header['metadata']
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a linear Q-function on large grids")
+    parser.add_argument('--grid-size', type=int, default=200)
+    parser.add_argument('--episodes', type=int, default=2000)
+    parser.add_argument('--envs', type=int, default=32, help="episodes stepped together")
+    parser.add_argument('--obstacles', type=int, default=None, help="obstacles per layout (default: the grid size)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='linear_q.bin')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    learner, rewards, steps = train_linear(args.episodes, args.grid_size, args.envs, args.obstacles, seed=args.seed)
+    seconds = time.perf_counter() - start
+    write_linear(learner, args.output, {'grid_size': args.grid_size, 'episodes': args.episodes})
+    print(f"Trained {args.episodes} episodes on a {args.grid_size}x{args.grid_size} grid in {seconds:.1f}s "
+          f"({learner.nbytes / 1024:.0f} KiB of weights), last 100 episodes' mean reward {rewards[-100:].mean():.0f}")
+    print(evaluate_linear(learner, grid_size=args.grid_size, num_obstacles=args.obstacles, seed=args.seed + 1000))
@@ -0,0 +1,106 @@
+import os
+import numpy as np
+import matplotlib.pyplot as plt
+
+# Streaming training metrics: every episode of every agent is recorded, the rolling
+# statistics are updated in constant time, and rows are appended to a CSV log as training
+# runs, so long runs can be followed live (e.g. with `tail -f training_log.csv`).
+
+LOG_COLUMNS = ['episode', 'agent', 'reward', 'length', 'fuel_used',
+               'reward_mean', 'reward_std', 'length_mean', 'fuel_used_mean']
+
+# Rolling mean and variance over the last window_size values, O(1) per value
+class RollingWindow:
+    def __init__(self, window_size):
+        self.window_size = window_size
+        self.values = [0.0] * window_size
+        self.count = 0
+        self.index = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def add(self, value):
+        if self.count == self.window_size:
+            old = self.values[self.index]
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.count += 1
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.window_size
+        self.total += value
+        self.total_sq += value * value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def variance(self):
+        if not self.count:
+            return 0.0
+        mean = self.total / self.count
+        # Running sums can drift slightly below zero through rounding
+        return max(0.0, self.total_sq / self.count - mean * mean)
+
+# Per-agent rolling reward, episode length and fuel usage, appended to log_path as CSV.
+# Resuming a run appends to the existing log; the rolling windows start empty again.
+class MetricsRecorder:
+    def __init__(self, num_agents, log_path='training_log.csv', window_size=50, append=False):
+        self.num_agents = num_agents
+        self.log_path = log_path
+        self.window_size = window_size
+        self.rewards = [RollingWindow(window_size) for _ in range(num_agents)]
+        self.lengths = [RollingWindow(window_size) for _ in range(num_agents)]
+        self.fuel_used = [RollingWindow(window_size) for _ in range(num_agents)]
+
+        write_header = not (append and os.path.exists(log_path))
+        self.log = open(log_path, 'a' if append else 'w')
+        if write_header:
+            self.log.write(','.join(LOG_COLUMNS) + '\n')
+
+    def record(self, episode, agent_id, reward, length, fuel_used):
+        rewards = self.rewards[agent_id]
+        lengths = self.lengths[agent_id]
+        fuel = self.fuel_used[agent_id]
+        rewards.add(reward)
+        lengths.add(length)
+        fuel.add(fuel_used)
+        self.log.write(f"{episode},{agent_id},{reward},{length},{fuel_used},"
+                       f"{rewards.mean():.3f},{rewards.variance() ** 0.5:.3f},"
+                       f"{lengths.mean():.3f},{fuel.mean():.3f}\n")
+
+    # Records one training round: chunk_results[agent_id][i] is (reward, length, fuel_used)
+    # for episodes[i]. The log is flushed once per round.
+    def record_round(self, episodes, chunk_results):
+        for i, episode in enumerate(episodes):
+            for agent_id, results in enumerate(chunk_results):
+                self.record(episode, agent_id, *results[i])
+        self.log.flush()
+
+    # Latest rolling mean reward of every agent
+    def mean_rewards(self):
+        return [window.mean() for window in self.rewards]
+
+    def close(self):
+        if not self.log.closed:
+            self.log.close()
+
+# Reads a metrics log into a structured array with one field per LOG_COLUMNS entry
+def read_metrics_log(log_path):
+    return np.genfromtxt(log_path, delimiter=',', names=True, dtype=None, encoding='utf-8')
+
+# Renders the per-agent rolling mean reward straight from the log; the moving average was
+# already computed while training, so nothing is re-scanned here
+def plot_metrics_log(log_path='training_log.csv', output_path='agent_rewards.png'):
+    log = np.atleast_1d(read_metrics_log(log_path))
+    plt.figure(figsize=(10, 6))
+    for agent_id in np.unique(log['agent']):
+        rows = log[log['agent'] == agent_id]
+        plt.plot(rows['episode'], rows['reward_mean'], label=f'Agent {agent_id + 1}')
+
+    plt.xlabel('Episode')
+    plt.ylabel('Reward')
+    plt.title('Agent Rewards over Episodes')
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(output_path)
+    plt.close()
@@ -0,0 +1,368 @@
+import argparse
+import time
+
+import numpy as np
+
+from environment import (build_next_cell_table, EVENT_MOVED, EVENT_BLOCKED, EVENT_PICKED_UP, EVENT_NO_PICKUP,
+                         EVENT_DROPPED, EVENT_NO_DROP, EVENT_INVALID, EVENT_DELIVERED, EVENT_EMPTY)
+from q_table import QTableStore
+from shortest_paths import path_cache
+
+# Multi-parcel routes: every agent gets a batch of parcels, each with its own pickup and drop-off
+# cell, and carries any number of them at once. The order of the stops is planned at the start
+# of an episode over the layout's cached distance matrix (shortest_paths), first greedily by
+# nearest neighbour and then improved with 2-opt and or-opt moves that keep every pickup before
+# its drop-off. A tabular learner handles the movement between consecutive stops.
+#
+# Stop node ids used by the planner: 0 is the agent's start cell, 1..n the pickups of parcels
+# 0..n-1, n+1..2n their drop-offs and 2n+1 a virtual end at distance 0 from everything, so an
+# open route can be scored like a closed one.
+
+# Distance used for stops that cannot reach each other, large enough that no route uses it
+UNREACHABLE = 10 ** 6
+
+# Stop-to-stop distance matrix, including the start node and the virtual end
+def stop_distances(paths, start_cell, pickup_cells, drop_cells):
+    cells = np.concatenate(([start_cell], pickup_cells, drop_cells)).astype(np.int64)
+    size = len(cells) + 1
+    dist = np.zeros((size, size), dtype=np.int64)
+    dist[:-1, :-1] = paths.dist[np.ix_(cells, cells)]
+    dist[dist < 0] = UNREACHABLE
+    return dist
+
+def route_length(dist, route):
+    nodes = np.concatenate(([0], route))
+    return int(dist[nodes[:-1], nodes[1:]].sum())
+
+# Greedy construction: from the current stop, go to the nearest pickup left or to the drop-off
+# of a parcel already on board
+def nearest_neighbour_route(dist, num_parcels):
+    num_stops = 2 * num_parcels
+    available = np.zeros(num_stops + 1, dtype=bool)
+    available[1:num_parcels + 1] = True
+    route = np.empty(num_stops, dtype=np.int64)
+    current = 0
+    for position in range(num_stops):
+        candidates = np.flatnonzero(available)
+        current = candidates[np.argmin(dist[current, candidates])]
+        route[position] = current
+        available[current] = False
+        if current <= num_parcels:
+            available[current + num_parcels] = True
+    return route
+
+# Position in the route of every stop's partner (the drop-off of a pickup and the other way round)
+def _partner_positions(route, num_parcels):
+    positions = np.empty(2 * num_parcels + 1, dtype=np.int64)
+    positions[route] = np.arange(1, len(route) + 1)
+    partners = np.where(route <= num_parcels, route + num_parcels, route - num_parcels)
+    return positions[partners]
+
+# Best 2-opt move: reverse route positions i..j (1-based, the start sits at 0). Reversing flips
+# the order of any parcel with both stops inside the segment, so for each i only the j before the
+# nearest such drop-off are allowed: j < first_drop[i], the suffix minimum of drop-off positions
+# over pickups at i or later.
+# ordered is the distance matrix in route order (start, stops, virtual end), so every term is a slice.
+def _best_two_opt(ordered, route, partner, num_parcels):
+    m = len(route)
+    drop_at = np.full(m + 2, m + 1)
+    pickups = np.flatnonzero(route <= num_parcels) + 1
+    drop_at[pickups] = partner[pickups - 1]
+    first_drop = np.minimum.accumulate(drop_at[::-1])[::-1]
+
+    edges = np.diagonal(ordered, 1)
+    delta = ordered[:m, 1:m + 1] + ordered[1:m + 1, 2:] - edges[:m, None] - edges[None, 1:]
+    i = np.arange(1, m + 1)[:, None]
+    j = np.arange(1, m + 1)[None, :]
+    delta = np.where((j > i) & (j < first_drop[1:m + 1, None]), delta, 0)
+    best = np.argmin(delta)
+    return delta.flat[best], best // m + 1, best % m + 1
+
+# Best or-opt move: take the segment at positions i..i+length-1 out and put it back between the
+# stops at positions k and k+1. Moving it later past a drop-off of one of its pickups, or earlier
+# past a pickup of one of its drop-offs, is not allowed, so every segment has a window of k.
+# Distances are symmetric, so the segment's first stop can be measured from either side.
+def _best_or_opt(ordered, route, partner, num_parcels, length):
+    m = len(route)
+    if length >= m:
+        return 0, 0, 0
+    starts = np.arange(1, m - length + 2)
+    ends = starts + length - 1
+    lowest = np.zeros(len(starts), dtype=np.int64)
+    highest = np.full(len(starts), m + 1)
+    for offset in range(length):
+        position = starts + offset
+        is_pickup = route[position - 1] <= num_parcels
+        other = partner[position - 1]
+        highest = np.where(is_pickup & (other > ends), np.minimum(highest, other), highest)
+        lowest = np.where(~is_pickup & (other < starts), np.maximum(lowest, other), lowest)
+
+    edges = np.diagonal(ordered, 1)
+    removed = edges[starts - 1] + edges[ends] - ordered[starts - 1, ends + 1]
+    inserted = ordered[starts, :m + 1] + ordered[ends, 1:] - edges[None, :]
+    k = np.arange(m + 1)[None, :]
+    allowed = (((k < starts[:, None] - 1) & (k >= lowest[:, None])) |
+               ((k > ends[:, None]) & (k < highest[:, None])))
+    delta = np.where(allowed, inserted - removed[:, None], 0)
+    best = np.argmin(delta)
+    return delta.flat[best], starts[best // (m + 1)], best % (m + 1)
+
+# Improves a route with the best 2-opt or or-opt (segments of 1 to 3 stops) move until none
+# shortens it
+def improve_route(dist, route, num_parcels, max_moves=10000):
+    route = np.array(route, dtype=np.int64)
+    end = len(dist) - 1
+    for _ in range(max_moves):
+        nodes = np.concatenate(([0], route, [end]))
+        ordered = dist[np.ix_(nodes, nodes)]
+        partner = _partner_positions(route, num_parcels)
+        best_delta, best_move = 0, None
+        delta, i, j = _best_two_opt(ordered, route, partner, num_parcels)
+        if delta < best_delta:
+            best_delta, best_move = delta, ('two_opt', i, j)
+        for length in (1, 2, 3):
+            delta, i, k = _best_or_opt(ordered, route, partner, num_parcels, length)
+            if delta < best_delta:
+                best_delta, best_move = delta, ('or_opt', i, k, length)
+        if best_move is None:
+            break
+        if best_move[0] == 'two_opt':
+            _, i, j = best_move
+            route[i - 1:j] = route[i - 1:j][::-1].copy()
+        else:
+            _, i, k, length = best_move
+            segment = route[i - 1:i - 1 + length]
+            rest = np.concatenate((route[:i - 1], route[i - 1 + length:]))
+            # k counts positions in the old route; past the segment it shifts left by its length
+            insert_at = k if k < i else k - length
+            route = np.concatenate((rest[:insert_at], segment, rest[insert_at:]))
+    return route
+
+# Plans the stop order of one agent. Returns the route as stop node ids and its length in moves.
+def plan_route(paths, start_cell, pickup_cells, drop_cells, improve=True):
+    num_parcels = len(pickup_cells)
+    dist = stop_distances(paths, start_cell, pickup_cells, drop_cells)
+    route = nearest_neighbour_route(dist, num_parcels)
+    if improve:
+        route = improve_route(dist, route, num_parcels)
+    return route, route_length(dist, route)
+
+# Grid with num_parcels parcels per agent. Agents do not interact; each works through its own batch.
+# PICKUP loads every parcel of the agent waiting on its cell and DROP unloads every parcel on board
+# that is addressed to the cell. An agent is done once all its parcels are delivered.
+class MultiStopEnv:
+    ACTIONS = ['UP', 'DOWN', 'LEFT', 'RIGHT', 'PICKUP', 'DROP']
+
+    # obstacles: fixed list of (x, y) obstacle cells; when None, num_obstacles cells are sampled once,
+    # since the leg learner's table belongs to one street layout. Parcels are re-sampled on every reset.
+    def __init__(self, num_agents=1, num_parcels=50, grid_size=20, num_obstacles=8, obstacles=None, fuel=None,
+                 seed=None):
+        self.num_agents = num_agents
+        self.num_parcels = num_parcels
+        self.grid_size = grid_size
+        self.num_cells = grid_size * grid_size
+        self.fuel = fuel
+        self.rng = np.random.default_rng(seed)
+        self.fixed_obstacles = [tuple(pos) for pos in obstacles] if obstacles is not None else None
+        self.num_obstacles = len(self.fixed_obstacles) if obstacles is not None else num_obstacles
+        if self.num_obstacles + num_agents > self.num_cells:
+            raise ValueError("Not enough free cells for the requested agents and obstacles.")
+        self.rewards = {'MOVE': -1, 'PICKUP': 5000, 'DROP': 10000, 'EMPTY': -10000}
+        self.obstacle_grid = np.zeros((grid_size, grid_size), dtype=bool)
+        if self.fixed_obstacles is None:
+            cells = self.rng.choice(self.num_cells, self.num_obstacles, replace=False)
+            self.fixed_obstacles = [divmod(int(cell), self.grid_size) for cell in cells]
+        self.set_obstacles(self.fixed_obstacles)
+        self.paths = path_cache.get(self.grid_size, self.obstacles)
+        self.reset()
+
+    def set_obstacles(self, obstacles):
+        self.obstacles = list(obstacles)
+        self.obstacle_grid[:] = False
+        for x, y in self.obstacles:
+            self.obstacle_grid[x, y] = True
+        self.next_cell_rows = build_next_cell_table(self.grid_size, self.obstacle_grid).tolist()
+
+    def reset(self):
+        free = np.flatnonzero(~self.obstacle_grid.ravel())
+        self.agent_cells = self.rng.choice(free, self.num_agents, replace=False).tolist()
+        # Stops of one agent are distinct cells while the grid has room for them
+        stops = 2 * self.num_parcels
+        self.pickup_cells = np.empty((self.num_agents, self.num_parcels), dtype=np.int64)
+        self.drop_cells = np.empty((self.num_agents, self.num_parcels), dtype=np.int64)
+        for agent_id in range(self.num_agents):
+            cells = self.rng.choice(free, stops, replace=stops > len(free))
+            self.pickup_cells[agent_id] = cells[:self.num_parcels]
+            self.drop_cells[agent_id] = cells[self.num_parcels:]
+        # 0 waiting, 1 on board, 2 delivered
+        self.parcel_status = np.zeros((self.num_agents, self.num_parcels), dtype=np.int8)
+        self.num_delivered = [0] * self.num_agents
+        self.fuel_consumed = [self.fuel] * self.num_agents
+        return self.agent_cells
+
+    # Plans every agent's stop order; returns one (route of stop node ids, length) per agent
+    def plan(self, improve=True):
+        return [plan_route(self.paths, self.agent_cells[agent_id], self.pickup_cells[agent_id],
+                           self.drop_cells[agent_id], improve) for agent_id in range(self.num_agents)]
+
+    # Cell of a planner stop node of an agent
+    def stop_cell(self, agent_id, node):
+        if node <= self.num_parcels:
+            return int(self.pickup_cells[agent_id, node - 1])
+        return int(self.drop_cells[agent_id, node - self.num_parcels - 1])
+
+    # Same event codes as PackageEnv.fast_step; returns (event, reward) because one PICKUP or DROP
+    # can handle several parcels. EVENT_DELIVERED is set once the agent's last parcel is delivered.
+    def step(self, action_idx, agent_id):
+        cell = self.agent_cells[agent_id]
+        reward = 0
+        if 0 <= action_idx < 4:
+            new_cell = self.next_cell_rows[cell][action_idx]
+            reward = self.rewards['MOVE']
+            if self.fuel is not None:
+                self.fuel_consumed[agent_id] -= 1
+            if new_cell != cell:
+                self.agent_cells[agent_id] = new_cell
+                event = EVENT_MOVED
+            else:
+                event = EVENT_BLOCKED
+        elif action_idx == 4:
+            waiting = (self.pickup_cells[agent_id] == cell) & (self.parcel_status[agent_id] == 0)
+            count = int(np.count_nonzero(waiting))
+            self.parcel_status[agent_id, waiting] = 1
+            reward = count * self.rewards['PICKUP']
+            event = EVENT_PICKED_UP if count else EVENT_NO_PICKUP
+        elif action_idx == 5:
+            arrived = (self.drop_cells[agent_id] == cell) & (self.parcel_status[agent_id] == 1)
+            count = int(np.count_nonzero(arrived))
+            self.parcel_status[agent_id, arrived] = 2
+            self.num_delivered[agent_id] += count
+            reward = count * self.rewards['DROP']
+            event = EVENT_DROPPED if count else EVENT_NO_DROP
+        else:
+            event = EVENT_INVALID
+
+        if self.num_delivered[agent_id] == self.num_parcels:
+            event |= EVENT_DELIVERED
+        elif self.fuel is not None and self.fuel_consumed[agent_id] <= 0:
+            event |= EVENT_EMPTY
+            reward += self.rewards['EMPTY']
+        return event, reward
+
+# Tabular Q-learning of the moves between stops, shared by every agent and leg. The state is the
+# (target, cell) pair, reaching the target ends the leg and every move costs 1, so the learned
+# values converge to minus the shortest distances. Rows start at minus one plus the Manhattan
+# distance left after the move: never below the true value, so greedy legs explore the detours
+# around obstacles by themselves (learning real-time A*), and exact on open ground.
+# The environment is deterministic, so the default step size of 1 applies each update in full.
+class LegLearner:
+    def __init__(self, grid_size, gamma=1.0, learning_rate=1.0):
+        self.grid_size = grid_size
+        self.num_cells = grid_size * grid_size
+        self.gamma = gamma
+        self.learning_rate = learning_rate
+        self.Q_table = QTableStore(1, self.num_cells * self.num_cells, num_actions=4, initial_value=0)
+        self.q_values = self.Q_table.q_values[0]
+
+        # Cell reached by every move on an empty grid, then its Manhattan distance to every target
+        moved = build_next_cell_table(grid_size, np.zeros((grid_size, grid_size), dtype=bool))
+        x, y = np.divmod(moved, grid_size)
+        for target in range(self.num_cells):
+            tx, ty = divmod(target, grid_size)
+            rows = self.q_values[target * self.num_cells:(target + 1) * self.num_cells]
+            rows[:] = -1 - (np.abs(x - tx) + np.abs(y - ty))
+
+    def leg_state(self, cell, target):
+        return target * self.num_cells + cell
+
+    # Walks the agent of env to target with epsilon-greedy moves, learning from every move.
+    # Returns the moves made, their reward and whether the target was reached within max_moves.
+    def run_leg(self, env, agent_id, target, epsilon=0.0, rng=None, max_moves=None, learn=True):
+        if max_moves is None:
+            max_moves = 10 * self.num_cells
+        q_values = self.q_values
+        cell = env.agent_cells[agent_id]
+        state = self.leg_state(cell, target)
+        moves = 0
+        reward = 0
+        while cell != target and moves < max_moves:
+            if rng is not None and rng.random() < epsilon:
+                action_idx = int(rng.integers(4))
+            else:
+                action_idx = int(np.argmax(q_values[state]))
+            event, step_reward = env.step(action_idx, agent_id)
+            reward += step_reward
+            cell = env.agent_cells[agent_id]
+            next_state = self.leg_state(cell, target)
+            moves += 1
+            if learn:
+                done = cell == target
+                value = -1 + (0 if done else self.gamma * q_values[next_state].max())
+                q_values[state, action_idx] += self.learning_rate * (value - q_values[state, action_idx])
+                self.Q_table.num_updates[0, state, action_idx] += 1
+            state = next_state
+            if event & EVENT_EMPTY:
+                break
+        return moves, reward, cell == target
+
+# Plays one episode of every agent: plan the stops, then drive each leg with the learner and
+# PICKUP or DROP on arrival. Returns one dict per agent with the reward, the moves made, the
+# planned route length and whether every parcel was delivered.
+def run_episode(env, learner, epsilon=0.0, rng=None, learn=True, improve=True):
+    env.reset()
+    results = []
+    for agent_id, (route, planned) in enumerate(env.plan(improve)):
+        reward = 0
+        total_moves = 0
+        for node in route:
+            moves, leg_reward, arrived = learner.run_leg(env, agent_id, env.stop_cell(agent_id, node), epsilon,
+                                                         rng, learn=learn)
+            total_moves += moves
+            reward += leg_reward
+            if not arrived:
+                break
+            event, step_reward = env.step(4 if node <= env.num_parcels else 5, agent_id)
+            reward += step_reward
+        results.append({'reward': reward, 'moves': total_moves, 'planned': planned,
+                        'delivered': env.num_delivered[agent_id] == env.num_parcels})
+    return results
+
+# Trains the leg learner on num_episodes episodes with epsilon decaying to epsilon_floor. Its start
+# values already make it explore, so random moves are off by default.
+def train_multi_stop(num_episodes, num_agents=1, num_parcels=50, grid_size=20, num_obstacles=8, obstacles=None,
+                     epsilon=0.0, decay_rate=0.99, epsilon_floor=0.0, learning_rate=1.0, seed=None):
+    rng = np.random.default_rng(seed)
+    env = MultiStopEnv(num_agents, num_parcels, grid_size, num_obstacles, obstacles, seed=seed)
+    learner = LegLearner(grid_size, learning_rate=learning_rate)
+    history = []
+    for _ in range(num_episodes):
+        history.append(run_episode(env, learner, epsilon, rng))
+        epsilon = max(epsilon_floor, epsilon * decay_rate)
+    return learner, history
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan multi-parcel routes and learn the moves between stops")
+    parser.add_argument('--parcels', type=int, default=50)
+    parser.add_argument('--agents', type=int, default=1)
+    parser.add_argument('--grid-size', type=int, default=20)
+    parser.add_argument('--episodes', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    env = MultiStopEnv(args.agents, args.parcels, args.grid_size, seed=args.seed)
+    start = time.perf_counter()
+    greedy = env.plan(improve=False)
+    greedy_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    improved = env.plan()
+    improved_seconds = time.perf_counter() - start
+    for agent_id, ((_, greedy_length), (_, length)) in enumerate(zip(greedy, improved)):
+        print(f"Agent {agent_id + 1}: {2 * args.parcels} stops, nearest neighbour {greedy_length} moves "
+              f"({greedy_seconds / args.agents * 1e3:.1f} ms), improved {length} moves "
+              f"({improved_seconds / args.agents * 1e3:.1f} ms)")
+
+    learner, history = train_multi_stop(args.episodes, args.agents, args.parcels, args.grid_size, seed=args.seed)
+    last = [result for results in history[-10:] for result in results]
+    print(f"Last 10 episodes: {np.mean([r['moves'] for r in last]):.1f} moves per route against "
+          f"{np.mean([r['planned'] for r in last]):.1f} planned, "
+          f"{np.mean([r['delivered'] for r in last]):.0%} of routes fully delivered")
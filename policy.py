@@ -0,0 +1,62 @@
+import argparse
+import numpy as np
+from environment import PackageEnv, EVENT_DELIVERED
+from q_learning import hash_state
+from q_table import read_q_tables
+
+# Greedy policy compiled from trained Q-tables: policy[agent_id, hash_state(...)] is the action
+# index with the highest Q-value, or UNSEEN for states the agent never visited while training.
+# Looking an action up is one array index, with no argmax or allocation per tick.
+
+UNSEEN = -1
+
+def compile_policy(Q_table):
+    policy = np.argmax(Q_table.q_values, axis=2).astype(np.int8)
+    policy[~np.asarray(Q_table.visited)] = UNSEEN
+    return policy
+
+def write_policy(policy, path):
+    np.save(path, policy)
+
+# Memory-maps a compiled policy, so loading is instant for any table size
+def read_policy(path):
+    return np.load(path, mmap_mode='r')
+
+# Runs greedy episodes of every agent on PackageEnv and reports how often the package is delivered.
+# Layouts and the random actions of unseen states are drawn from seed. PICKUP/DROP burn no fuel,
+# so a greedy policy can repeat them forever; episodes are cut off after max_steps.
+def evaluate_policy(policy, num_episodes=1000, max_steps=200, seed=0, **env_kwargs):
+    rng = np.random.default_rng(seed)
+    num_agents = policy.shape[0]
+    env = PackageEnv(num_agents=num_agents, rng=rng, **env_kwargs)
+    delivered = 0
+    steps = 0
+    total_reward = 0
+    for episode in range(num_episodes):
+        agent_id = episode % num_agents
+        state, _, _ = env.reset()
+        event = 0
+        for _ in range(max_steps):
+            action_idx = policy[agent_id, hash_state(state, agent_id, env)]
+            if action_idx == UNSEEN:
+                action_idx = rng.integers(len(env.actions))
+            event = env.fast_step(action_idx, agent_id)
+            total_reward += env.event_rewards[event]
+            steps += 1
+            if event >= EVENT_DELIVERED:
+                break
+        delivered += bool(event & EVENT_DELIVERED)
+    return {'episodes': num_episodes, 'delivery_rate': delivered / num_episodes,
+            'mean_steps': steps / num_episodes, 'mean_reward': total_reward / num_episodes}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the greedy policy from trained Q-tables")
+    parser.add_argument('q_table', nargs='?', default='q_table.bin')
+    parser.add_argument('output', nargs='?', default='policy.npy')
+    args = parser.parse_args()
+
+    Q_table, _ = read_q_tables(args.q_table)
+    policy = compile_policy(Q_table)
+    write_policy(policy, args.output)
+    print(f"Wrote {args.output}: {policy.shape[0]} agents x {policy.shape[1]} states")
+    print(evaluate_policy(policy))
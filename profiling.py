@@ -0,0 +1,125 @@
+import cProfile
+import io
+import pstats
+import threading
+
+# Opt-in instrumentation for the trainer. Q_learning stamps the clock between the phases of
+# every step and the trainer reports each agent's task time and each round's wall time, so a
+# slow run can be split into environment stepping, hashing, Q-row bookkeeping, the shared-Q
+# lookup, the update itself and time lost to scheduling. Passing no profiler costs one local
+# bool check per phase. cProfile can also be switched on for a range of episodes.
+# Phase times are wall-clock: with several agent threads they include the time a phase waited
+# for the GIL while other agents ran, which is where thread scheduling costs show up.
+
+PHASES = ['q_row', 'select', 'env_step', 'hash_state', 'shared_q', 'update', 'replay']
+
+class Profiler:
+    # profile_episodes: (start, stop) episode range of agent 0 to run under cProfile, or None
+    def __init__(self, num_agents, profile_episodes=None):
+        self.num_agents = num_agents
+        self.profile_episodes = profile_episodes
+        # Nanoseconds per phase, one list per agent so threads never share a counter
+        self.phase_ns = [[0] * len(PHASES) for _ in range(num_agents)]
+        self.steps = [0] * num_agents
+        self.episodes = [0] * num_agents
+        self.task_seconds = [0.0] * num_agents
+        self.rounds = 0
+        self.round_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.overhead_seconds = 0.0
+        self.slowest_task = 0.0
+        self.task_lock = threading.Lock()
+        self.profiles = []
+        self.profiles_lock = threading.Lock()
+
+    # Called by Q_learning with the clock readings taken around every phase of one step
+    def record_step(self, agent_id, t0, t1, t2, t3, t4, t5, t6, t7, t8):
+        phase_ns = self.phase_ns[agent_id]
+        phase_ns[0] += (t1 - t0) + (t5 - t4)
+        phase_ns[1] += t2 - t1
+        phase_ns[2] += t3 - t2
+        phase_ns[3] += t4 - t3
+        phase_ns[4] += t6 - t5
+        phase_ns[5] += t7 - t6
+        phase_ns[6] += t8 - t7
+        self.steps[agent_id] += 1
+
+    # Time one agent spent on its share of a round, measured inside the worker
+    def record_task(self, agent_id, num_episodes, seconds):
+        self.episodes[agent_id] += num_episodes
+        self.task_seconds[agent_id] += seconds
+        with self.task_lock:
+            self.slowest_task = max(self.slowest_task, seconds)
+
+    # Wall time of a whole round, and the part of it the trainer spent waiting for the workers.
+    # Whatever the slowest agent's task does not cover went to dispatch and the GIL.
+    def record_round(self, seconds, wait_seconds):
+        self.rounds += 1
+        self.round_seconds += seconds
+        self.wait_seconds += wait_seconds
+        self.overhead_seconds += max(0.0, seconds - self.slowest_task)
+        self.slowest_task = 0.0
+
+    # A cProfile.Profile if agent_id's task covers any of the episodes to profile, else None.
+    # Only agent 0's tasks are profiled: before Python 3.12 a profile only sees the thread it is
+    # enabled in, and from 3.12 it sees every thread but only one can be enabled at a time.
+    # If another profiler is already active the run keeps the timer breakdown alone.
+    def start_profile(self, episodes, agent_id=0):
+        if self.profile_episodes is None or agent_id != 0:
+            return None
+        start, stop = self.profile_episodes
+        if episodes.stop <= start or episodes.start >= stop:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None
+        return profile
+
+    def stop_profile(self, profile):
+        if profile is None:
+            return
+        profile.disable()
+        with self.profiles_lock:
+            self.profiles.append(profile)
+
+    def summary(self):
+        agents = []
+        for agent_id in range(self.num_agents):
+            steps = self.steps[agent_id]
+            agents.append({
+                'agent': agent_id,
+                'episodes': self.episodes[agent_id],
+                'steps': steps,
+                'task_seconds': self.task_seconds[agent_id],
+                'phase_seconds': {name: ns / 1e9 for name, ns in zip(PHASES, self.phase_ns[agent_id])},
+                'phase_ns_per_step': {name: ns / steps if steps else 0.0
+                                      for name, ns in zip(PHASES, self.phase_ns[agent_id])}
+            })
+        return {
+            'rounds': self.rounds,
+            'round_seconds': self.round_seconds,
+            'wait_seconds': self.wait_seconds,
+            'overhead_seconds': self.overhead_seconds,
+            'agents': agents
+        }
+
+    # Plain-text report of the phase breakdown and, if captured, the top cProfile entries
+    def report(self, top=20):
+        summary = self.summary()
+        lines = [f"Rounds: {summary['rounds']}, wall {summary['round_seconds']:.2f}s, "
+                 f"waiting on workers {summary['wait_seconds']:.2f}s, "
+                 f"outside the slowest agent {summary['overhead_seconds']:.2f}s"]
+        lines.append(f"{'agent':>5} {'steps':>9} {'task s':>8} " + ' '.join(f"{name:>11}" for name in PHASES))
+        for agent in summary['agents']:
+            lines.append(f"{agent['agent']:>5} {agent['steps']:>9} {agent['task_seconds']:>8.2f} " +
+                         ' '.join(f"{agent['phase_ns_per_step'][name]:>9.0f}ns" for name in PHASES))
+        if self.profiles:
+            stream = io.StringIO()
+            stats = pstats.Stats(self.profiles[0], stream=stream)
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+            stats.sort_stats('cumulative').print_stats(top)
+            lines.append(stream.getvalue())
+        return '\n'.join(lines)
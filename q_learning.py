@@ -1,8 +1,18 @@
 import numpy as np
 import random
-from concurrent.futures import ThreadPoolExecutor
-from environment import PackageEnv
-import pickle
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from environment import PackageEnv, EVENT_DELIVERED
+from q_table import LOCK_STRIPES, QTableStore, SharedSnapshot, read_q_tables, write_q_tables
+from random_streams import task_replay_seed, task_stream
+from replay_buffer import ReplayBuffer, replay_update
+from metrics import MetricsRecorder, plot_metrics_log
+from convergence import ConvergenceMonitor
+from shortest_paths import layout_paths
+import argparse
+import os
+import time
 import matplotlib.pyplot as plt
 
 # GenAI was used for this file for code debugging and general assistance
@@ -10,82 +20,178 @@ import matplotlib.pyplot as plt
 env = PackageEnv(num_agents=3)
 
 # Creating unique hash states based on agent position, packages, and other agent states.
-def hash_state(state, agent_id):
+# state_env supplies the grid size and goal room; it defaults to the module's 5x5 environment.
+def hash_state(state, agent_id, state_env=env):
     x, y = state['agent_positions'][agent_id]
     package_picked = int(state['package_picked'][agent_id])
     px, py = state['package_positions'][agent_id]
-    gx, gy = env.goal_room
+    gx, gy = state_env.goal_room
+    grid_size = state_env.grid_size
 
-    return (x * env.grid_size * 2 * env.grid_size * env.grid_size +
-            y * 2 * env.grid_size * env.grid_size +
-            package_picked * env.grid_size * env.grid_size +
-            px * env.grid_size + py) * env.grid_size + gx * env.grid_size + gy #ChatGPT helped with this formula
+    return (x * grid_size * 2 * grid_size * grid_size +
+            y * 2 * grid_size * grid_size +
+            package_picked * grid_size * grid_size +
+            px * grid_size + py) * grid_size + gx * grid_size + gy #ChatGPT helped with this formula
+
+# Number of distinct values hash_state can return, i.e. the row count of a dense Q-table
+def num_states(grid_size):
+    return 2 * grid_size ** 5 + grid_size * grid_size - grid_size
 
 # Calculating the ETA for Q-Learning formula
-def calculate_eta(num_updates, state, action):
-    base_learning_rate = 0.2
-    return base_learning_rate / (1 + num_updates[state][action] * 0.1) # ChatGPT helped me with this function
+def calculate_eta(num_updates, state, action, base_learning_rate=0.2):
+    return base_learning_rate / (1 + num_updates[state, action] * 0.1) # ChatGPT helped me with this function
 
 # Calculating shared value for each individual agent.
-def calculate_shared_q_value(Q_table, state, action, num_agents):
-    shared_q = 0
-    count = 0
-    for agent_id in range(num_agents):
-        if state in Q_table[agent_id] and len(Q_table[agent_id][state]) > action:
-            shared_q += Q_table[agent_id][state][action]
-            count += 1
-    return shared_q / count if count > 0 else 0 #ChatGPT helped with this
+# Average over the agents that have already seen the state; the store keeps the running
+# sum and count up to date on every write, so this is a single lookup.
+def calculate_shared_q_value(Q_table, state, action):
+    return Q_table.shared_value(state, action) #ChatGPT helped with this
 
 # Individual Q-learning for a single agent
-def Q_learning(agent_id, Q_table, num_updates, epsilon, gamma, learning_rate): #ChatGPT helped with this function
-    q_learning_env = PackageEnv(num_agents=3)
+# Pass q_learning_env to reuse one environment across episodes instead of building a new one
+# With a replay_buffer.ReplayBuffer as replay, every transition is also stored there and a
+# minibatch is replayed every replay.update_every steps
+# learning_rate is the base step size that decays with each state-action's update count, and
+# alpha weighs the shared Q-value against the agent's own estimate in the target
+# profiler (a profiling.Profiler) receives the time spent in every phase of every step
+# stream (a random_streams.RandomStream) replaces the global random module for exploration, and
+# shared (e.g. a q_table.SharedSnapshot) is read for the shared Q-values instead of Q_table
+# shaping > 0 adds shaping * (gamma * phi(s') - phi(s)) to the reward the agent learns from, where
+# phi is minus the steps left on the layout's shortest route (see shortest_paths). Being
+# potential-based it leaves the optimal policy unchanged; the returned reward stays unshaped.
+def Q_learning(agent_id, Q_table, epsilon, gamma, learning_rate, q_learning_env=None, replay=None,
+               alpha=0.5, profiler=None, stream=None, shared=None, shaping=0.0): #ChatGPT helped with this function
+    if q_learning_env is None:
+        q_learning_env = PackageEnv(num_agents=Q_table.num_agents)
     state, _, _ = q_learning_env.reset()
-    prev_state = hash_state(state, agent_id)
+    prev_state = hash_state(state, agent_id, q_learning_env)
     done = False
     total_reward = 0
-    actions = ['UP', 'DOWN', 'LEFT', 'RIGHT', 'PICKUP', 'DROP']
+    num_steps = 0
+    event_rewards = q_learning_env.event_rewards
+    q_values = Q_table.q_values[agent_id]
+    num_updates = Q_table.num_updates[agent_id]
+    timed = profiler is not None
+    clock = time.perf_counter_ns
+    # Replay reads the same snapshot
+    replay_shared = shared
+    if shared is None:
+        shared = Q_table
+    if stream is not None:
+        draw = stream.index
+        uniforms = stream.uniforms
+        random_actions = stream.actions
+    if shaping:
+        paths = layout_paths(q_learning_env)
+        grid_size = q_learning_env.grid_size
+        goal_cell = paths.cell(q_learning_env.goal_room)
+        package_cell = paths.cell(state['package_positions'][agent_id])
+        potential = paths.potential(paths.cell(state['agent_positions'][agent_id]), package_cell,
+                                    state['package_picked'][agent_id], goal_cell)
 
     while not done:
-        if prev_state not in Q_table[agent_id]:
-            Q_table[agent_id][prev_state] = np.ones(len(actions)) * 1000
-            num_updates[agent_id][prev_state] = np.zeros(len(actions))
+        if timed: t0 = clock()
+        Q_table.visit(agent_id, prev_state)
+        if timed: t1 = clock()
 
-        if random.random() < epsilon:
-            action_idx = random.randrange(len(actions))
+        if stream is None:
+            if random.random() < epsilon:
+                action_idx = random.randrange(len(q_learning_env.actions))
+            else:
+                action_idx = np.argmax(q_values[prev_state])
         else:
-            Q_values = Q_table[agent_id][prev_state]
-            action_idx = np.argmax(Q_values)
+            if draw == stream.block_size:
+                stream.refill()
+                draw = 0
+                uniforms = stream.uniforms
+                random_actions = stream.actions
+            if uniforms[draw] < epsilon:
+                action_idx = random_actions[draw]
+            else:
+                action_idx = np.argmax(q_values[prev_state])
+            draw += 1
+        if timed: t2 = clock()
 
-        next_state, reward, done, _ = q_learning_env.step(actions[action_idx], agent_id)
-        curr_state = hash_state(next_state, agent_id)
+        # Fast path: same transition as step() without building messages or info dicts
+        event = q_learning_env.fast_step(action_idx, agent_id)
+        reward = event_rewards[event]
+        done = event >= EVENT_DELIVERED
+        next_state = q_learning_env.current_state
+        if timed: t3 = clock()
+        curr_state = hash_state(next_state, agent_id, q_learning_env)
+        if timed: t4 = clock()
         
         total_reward += reward
+        num_steps += 1
 
-        if curr_state not in Q_table[agent_id]:
-            Q_table[agent_id][curr_state] = np.ones(6) * 1000
-            num_updates[agent_id][curr_state] = np.zeros(6)
+        Q_table.visit(agent_id, curr_state)
+        if timed: t5 = clock()
 
-        next_best_action = np.argmax(Q_table[agent_id][curr_state])
-        eta = calculate_eta(num_updates[agent_id], prev_state, action_idx)
-        shared_q = calculate_shared_q_value(Q_table, prev_state, action_idx, q_learning_env.num_agents)
-        alpha = 0.5 
-        target = reward + (0 if done else gamma * ((1-alpha) * Q_table[agent_id][curr_state][next_best_action] + 
+        shared_q = calculate_shared_q_value(shared, prev_state, action_idx)
+        if timed: t6 = clock()
+        learned_reward = reward
+        if shaping:
+            # Terminal states have potential 0
+            next_potential = 0
+            if not done:
+                x, y = next_state['agent_positions'][agent_id]
+                next_potential = paths.potential(x * grid_size + y, package_cell,
+                                                 next_state['package_picked'][agent_id], goal_cell)
+            learned_reward = reward + shaping * (gamma * next_potential - potential)
+            potential = next_potential
+        next_best_action = np.argmax(q_values[curr_state])
+        eta = calculate_eta(num_updates, prev_state, action_idx, learning_rate)
+        target = learned_reward + (0 if done else gamma * ((1-alpha) * q_values[curr_state, next_best_action] + 
                                                  alpha * shared_q)) #ChatGPT helped with this
-        current_q = Q_table[agent_id][prev_state][action_idx]
-        Q_table[agent_id][prev_state][action_idx] = current_q + eta * (target - current_q)
+        current_q = q_values[prev_state, action_idx]
+        Q_table.update(agent_id, prev_state, action_idx, current_q + eta * (target - current_q))
         
-        num_updates[agent_id][prev_state][action_idx] += 1
+        num_updates[prev_state, action_idx] += 1
+        if timed: t7 = clock()
+
+        if replay is not None:
+            replay.add(prev_state, action_idx, learned_reward, curr_state, done)
+            if num_steps % replay.update_every == 0 and len(replay) >= replay.batch_size:
+                replay_update(Q_table, agent_id, replay, gamma, alpha, learning_rate, replay_shared)
+        if timed: profiler.record_step(agent_id, t0, t1, t2, t3, t4, t5, t6, t7, clock())
         prev_state = curr_state
         state = next_state
 
-    return Q_table[agent_id], total_reward
+    if stream is not None:
+        stream.index = draw
+    return q_values, total_reward, num_steps
+
+# Runs one episode per epsilon for an agent on its own environment and returns
+# (reward, episode length, fuel used) for every episode.
+# With a profiler, episodes is the range of episode numbers being run (for cProfile capture).
+# With a stream, the environment's layouts are drawn from the same stream as the exploration.
+def run_episodes(agent_id, Q_table, q_learning_env, epsilons, gamma, learning_rate, replay=None, alpha=0.5,
+                 profiler=None, episodes=None, stream=None, shared=None, shaping=0.0):
+    if stream is not None:
+        q_learning_env.rng = stream.generator
+    if profiler is not None:
+        start = time.perf_counter()
+        profile = profiler.start_profile(episodes, agent_id)
+    results = []
+    for epsilon in epsilons:
+        _, reward, num_steps = Q_learning(agent_id, Q_table, epsilon, gamma, learning_rate, q_learning_env,
+                                          replay, alpha, profiler, stream, shared, shaping)
+        fuel_used = q_learning_env.fuel - q_learning_env.fuel_consumed[agent_id]
+        results.append((reward, num_steps, fuel_used))
+    if profiler is not None:
+        profiler.stop_profile(profile)
+        profiler.record_task(agent_id, len(epsilons), time.perf_counter() - start)
+    return results
 
 def plot_rewards(agent_rewards, episode_numbers, window_size=50): #ChatGPT helped with this
     plt.figure(figsize=(10, 6))
     for agent_id, rewards in enumerate(agent_rewards):
         if len(rewards) > window_size:
-            moving_avg = [np.mean(rewards[max(0, i-window_size):i]) 
-                        for i in range(1, len(rewards)+1)]
+            # Trailing mean over the last window_size values, from one cumulative sum
+            totals = np.cumsum(np.concatenate(([0], rewards)))
+            ends = np.arange(1, len(rewards) + 1)
+            starts = np.maximum(0, ends - window_size)
+            moving_avg = (totals[ends] - totals[starts]) / (ends - starts)
         else:
             moving_avg = rewards
         plt.plot(episode_numbers[:len(moving_avg)], moving_avg, label=f'Agent {agent_id + 1}')
@@ -98,51 +204,280 @@ def plot_rewards(agent_rewards, episode_numbers, window_size=50): #ChatGPT helpe
     plt.savefig('agent_rewards.png')
     plt.close()
 
+# Replay buffer of one task of a seeded run: it starts empty and samples from the task's own seed,
+# so what it replays does not depend on which thread or process ran the agent's earlier rounds
+def task_replay(replay_kwargs, seed, agent_id, first_episode):
+    return ReplayBuffer(**dict(replay_kwargs, seed=task_replay_seed(seed, agent_id, first_episode)))
+
+# Shared-memory store and environment of the current worker process, set up once by _init_process_worker
+worker_Q_table = None
+worker_env = None
+# Replay buffers of the current worker process, one per agent it has run episodes for (unseeded runs)
+worker_replays = {}
+worker_replay_kwargs = None
+# Shared-Q snapshot of seeded runs
+worker_snapshot = None
+
+def _init_process_worker(shm_name, num_agents, num_states, lock, env_kwargs, replay_kwargs=None,
+                         snapshot_name=None):
+    global worker_Q_table, worker_env, worker_replay_kwargs, worker_snapshot
+    worker_Q_table = QTableStore.attach_shared(shm_name, num_agents, num_states, lock=lock)
+    worker_env = PackageEnv(num_agents=num_agents, **env_kwargs)
+    worker_replay_kwargs = replay_kwargs
+    if snapshot_name is not None:
+        worker_snapshot = SharedSnapshot.attach_shared(snapshot_name, num_states)
+        worker_Q_table.track_shared = False
+    # Forked workers inherit the parent's random state, so give each one its own
+    random.seed()
+
+def _process_run_episodes(agent_id, epsilons, gamma, learning_rate, alpha, seed=None, first_episode=0,
+                          shaping=0.0):
+    stream = None
+    if seed is not None:
+        stream = task_stream(seed, agent_id, first_episode)
+    replay = None
+    if worker_replay_kwargs is not None and seed is not None:
+        replay = task_replay(worker_replay_kwargs, seed, agent_id, first_episode)
+    elif worker_replay_kwargs is not None:
+        if agent_id not in worker_replays:
+            worker_replays[agent_id] = ReplayBuffer(**worker_replay_kwargs)
+        replay = worker_replays[agent_id]
+    return run_episodes(agent_id, worker_Q_table, worker_env, epsilons, gamma, learning_rate, replay, alpha,
+                        stream=stream, shared=worker_snapshot if seed is not None else None, shaping=shaping)
+
 # Multi-agent Q-learning that runs q-learning for each individual agent concurrently
+# learning_rate is the base step size, alpha the weight of the shared Q-value in the target and
+# epsilon decays by decay_rate after every episode down to epsilon_floor.
+# backend='thread' runs the agents in threads, backend='process' in separate processes whose
+# Q-tables live in shared memory. The workers live for the whole run and each dispatch hands
+# every agent episodes_per_task episodes, so pool and environment setup is paid once.
+# Writes to the shared aggregate take one of LOCK_STRIPES locks picked by the state, and seeded
+# runs take none (see QTableStore.track_shared), so workers do not queue on one lock per step.
+# callback(episodes, chunk_rewards) is called after every round with the episode range and each
+# agent's rewards for it; returning True stops training early.
+# grid_size, num_obstacles and obstacles are passed on to every worker's PackageEnv.
+# With checkpoint_path set, the tables and training progress are written there every
+# checkpoint_every episodes and at the end; resume=True continues from that file if it exists.
+# metrics (a metrics.MetricsRecorder) records every episode of every agent as training runs;
+# the chart is then rendered from its log.
+# replay (a dict of replay_buffer.ReplayBuffer arguments, e.g. {'capacity': 50000}) gives every
+# agent an experience replay buffer; with the process backend each worker keeps its own buffers.
+# In seeded runs every task gets a fresh buffer instead (see task_replay), so replay only reaches
+# back to the start of the round.
+# convergence (a convergence.ConvergenceMonitor) checks the policy change rate, Q-value updates and
+# rolling reward after every round and stops training once they settle; its stop_reason and
+# episodes_run are set when training ends and saved with the final checkpoint.
+# profiler (a profiling.Profiler, thread backend only) times every phase of every step, each
+# agent's tasks and each round, and its report is printed when training ends.
+# With a seed, runs are bit-reproducible whatever the backend or scheduling: every agent's round
+# draws from its own random_streams stream, and shared Q-values are read from a snapshot taken
+# at the start of the round, with the aggregate rebuilt at every round barrier. Replayed
+# minibatches read the same snapshot and come from per-task buffers seeded from the run's seed.
+# shaping is the weight of the shortest-route reward shaping term (see Q_learning); 0 turns it off.
+# Against the 5000/10000 pickup and delivery rewards, weights in the tens make a difference.
+# initial_table (a QTableStore of the same shape) warm-starts training from its tables instead of
+# the optimistic initial values, and focus_cells (with fixed obstacles) starts about half of the
+# episodes next to those cells; see incremental.py.
 def q_learning_multi_agent(num_episodes, num_agents, gamma=0.99, epsilon=1.0, 
-                          decay_rate=0.9995, learning_rate=0.1): #ChatGPT helped with this function
-    Q_table = [{} for _ in range(num_agents)]
-    num_updates = [{} for _ in range(num_agents)]
+                          decay_rate=0.9995, learning_rate=0.2, backend='thread',
+                          episodes_per_task=10, callback=None, plot=True,
+                          grid_size=5, num_obstacles=2, obstacles=None,
+                          checkpoint_path=None, checkpoint_every=1000, resume=False,
+                          metrics=None, replay=None, convergence=None, alpha=0.5,
+                          epsilon_floor=0.25, profiler=None, seed=None, shaping=0.0,
+                          initial_table=None, focus_cells=None): #ChatGPT helped with this function
+    env_kwargs = {'grid_size': grid_size, 'num_obstacles': num_obstacles, 'obstacles': obstacles,
+                  'focus_cells': focus_cells}
+    snapshot = None
+    if backend == 'thread':
+        Q_table = QTableStore(num_agents, num_states(grid_size),
+                              lock=[threading.Lock() for _ in range(LOCK_STRIPES)])
+        agent_envs = [PackageEnv(num_agents=num_agents, **env_kwargs) for _ in range(num_agents)]
+        agent_replays = [ReplayBuffer(**replay) if replay is not None else None for _ in range(num_agents)]
+        executor = ThreadPoolExecutor(max_workers=num_agents)
+        if seed is not None:
+            snapshot = SharedSnapshot(Q_table.num_states)
+
+        def submit(agent_id, episodes, epsilons):
+            stream = task_stream(seed, agent_id, episodes.start) if seed is not None else None
+            agent_replay = agent_replays[agent_id]
+            if replay is not None and seed is not None:
+                agent_replay = task_replay(replay, seed, agent_id, episodes.start)
+            return executor.submit(run_episodes, agent_id, Q_table, agent_envs[agent_id],
+                                   epsilons, gamma, learning_rate, agent_replay, alpha,
+                                   profiler, episodes, stream, snapshot, shaping)
+    elif backend == 'process':
+        if profiler is not None:
+            raise ValueError("The profiler only supports the thread backend")
+        lock = [multiprocessing.Lock() for _ in range(LOCK_STRIPES)]
+        shared_table = QTableStore.create_shared(num_agents, num_states(grid_size), lock=lock)
+        if seed is not None:
+            snapshot = SharedSnapshot.create_shared(shared_table.num_states)
+        executor = ProcessPoolExecutor(max_workers=num_agents, initializer=_init_process_worker,
+                                       initargs=(shared_table.shm.name, num_agents, shared_table.num_states,
+                                                 lock, env_kwargs, replay,
+                                                 snapshot.shm.name if snapshot is not None else None))
+
+        def submit(agent_id, episodes, epsilons):
+            return executor.submit(_process_run_episodes, agent_id, epsilons, gamma, learning_rate, alpha,
+                                   seed, episodes.start, shaping)
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+    training_table = Q_table if backend == 'thread' else shared_table
+    if snapshot is not None:
+        training_table.track_shared = False
+
     agent_rewards = [[] for _ in range(num_agents)]
     episode_numbers = []
-    
-    for episode in range(num_episodes):
-        if episode % 10 == 0:
-            print(f"Episode {episode}")
-            episode_numbers.append(episode)
-            
-        with ThreadPoolExecutor(max_workers=num_agents) as executor:
-            futures = [
-                executor.submit(Q_learning, agent_id, Q_table, num_updates, 
-                              epsilon, gamma, learning_rate)
-                for agent_id in range(num_agents)
-            ] #ChatGPT helped with this
-
-        for agent_id, future in enumerate(futures):
-            updated_q_table, reward = future.result()
-            Q_table[agent_id].update(updated_q_table)
-            if episode % 10 == 0:
-                agent_rewards[agent_id].append(reward)
-
-        if episode % 10 == 0:
-            avg_reward = sum(reward for _, reward in [f.result() for f in futures]) / len(futures) #ChatGPT helped with this
-            print(f"Average reward: {avg_reward:.2f}")
-            print(f"Epsilon: {epsilon:.3f}")
-
-        epsilon = max(0.25, epsilon * decay_rate)
-
-    plot_rewards(agent_rewards, episode_numbers)
+    first_episode = 0
+
+    if initial_table is not None:
+        if initial_table.q_values.shape != training_table.q_values.shape:
+            raise ValueError(f"The initial table does not match {num_agents} agents on a {grid_size}x{grid_size} grid")
+        training_table.copy_from(initial_table)
+
+    if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+        checkpoint, progress = read_q_tables(checkpoint_path, mode=None)
+        if checkpoint.q_values.shape != training_table.q_values.shape:
+            raise ValueError(f"Checkpoint {checkpoint_path} does not match {num_agents} agents on a {grid_size}x{grid_size} grid")
+        training_table.copy_from(checkpoint)
+        first_episode = progress['episode']
+        epsilon = progress['epsilon']
+        agent_rewards = progress['agent_rewards']
+        episode_numbers = progress['episode_numbers']
+        print(f"Resuming from episode {first_episode}")
+
+    def save_checkpoint(next_episode, stop_reason=None):
+        write_q_tables(training_table, checkpoint_path, {
+            'episode': next_episode,
+            'epsilon': epsilon,
+            'num_episodes': num_episodes,
+            'agent_rewards': agent_rewards,
+            'episode_numbers': episode_numbers,
+            'stop_reason': stop_reason,
+            'episodes_run': next_episode - first_episode,
+            'obstacles': obstacles
+        })
+
+    next_checkpoint = first_episode + checkpoint_every
+    next_episode = first_episode
+    stop_reason = 'max_episodes'
+
+    try:
+        if snapshot is not None:
+            snapshot.refresh(training_table)
+        with executor:
+            for start in range(first_episode, num_episodes, episodes_per_task):
+                episodes = range(start, min(start + episodes_per_task, num_episodes))
+                epsilons = []
+                for _ in episodes:
+                    epsilons.append(epsilon)
+                    epsilon = max(epsilon_floor, epsilon * decay_rate)
+
+                if profiler is not None:
+                    round_start = time.perf_counter()
+                futures = [submit(agent_id, episodes, epsilons) for agent_id in range(num_agents)] #ChatGPT helped with this
+                if profiler is not None:
+                    wait_start = time.perf_counter()
+                chunk_results = [future.result() for future in futures]
+                if snapshot is not None:
+                    # Round barrier: every agent's updates are in, so the next round's snapshot
+                    # is the same however the round was scheduled
+                    snapshot.refresh(training_table)
+                if profiler is not None:
+                    profiler.record_round(time.perf_counter() - round_start, time.perf_counter() - wait_start)
+                chunk_rewards = [[reward for reward, _, _ in results] for results in chunk_results]
+                if metrics is not None:
+                    metrics.record_round(episodes, chunk_results)
+
+                # Charts keep sampling every 10th episode
+                for i, episode in enumerate(episodes):
+                    if episode % 10 == 0:
+                        episode_numbers.append(episode)
+                        for agent_id, rewards in enumerate(chunk_rewards):
+                            agent_rewards[agent_id].append(rewards[i])
+
+                avg_reward = sum(map(sum, chunk_rewards)) / (num_agents * len(episodes))
+                print(f"Episode {start}")
+                print(f"Average reward: {avg_reward:.2f}")
+                print(f"Epsilon: {epsilons[-1]:.3f}")
+                converged = convergence is not None and convergence.update(training_table, episodes, chunk_rewards)
+                if convergence is not None and convergence.max_q_delta is not None:
+                    print(f"Policy change rate: {convergence.policy_change_rate:.4f}, mean Q change: {convergence.mean_q_delta:.2f}")
+
+                next_episode = episodes.stop
+                if checkpoint_path is not None and next_episode >= next_checkpoint:
+                    save_checkpoint(next_episode)
+                    next_checkpoint = next_episode + checkpoint_every
+
+                if callback is not None and callback(episodes, chunk_rewards):
+                    stop_reason = 'callback'
+                    break
+                if converged:
+                    stop_reason = 'converged'
+                    print(f"Converged after {next_episode} episodes")
+                    break
+
+        if convergence is not None:
+            convergence.finish(stop_reason, next_episode - first_episode)
+        if checkpoint_path is not None:
+            save_checkpoint(next_episode, stop_reason)
+        training_table.track_shared = True
+        if backend == 'process':
+            Q_table = shared_table.copy()
+    finally:
+        if backend == 'process':
+            shared_table.close(unlink=True)
+            if snapshot is not None:
+                snapshot.close(unlink=True)
+
+    if profiler is not None:
+        print(profiler.report())
+    if plot and metrics is not None:
+        plot_metrics_log(metrics.log_path)
+    elif plot:
+        plot_rewards(agent_rewards, episode_numbers)
     return Q_table
 
 if __name__ == "__main__":
+    from policy import compile_policy, write_policy
+
+    parser = argparse.ArgumentParser(description="Train the multi-agent Q-tables")
+    parser.add_argument('--resume', action='store_true', help="continue from q_table_checkpoint.bin")
+    parser.add_argument('--no-early-stop', action='store_true',
+                        help="run every episode even after convergence is detected")
+    parser.add_argument('--shaping', type=float, default=0.0,
+                        help="weight of the shortest-route reward shaping term (0 turns it off)")
+    parser.add_argument('--seed', type=int, default=None, help="seed for a reproducible run")
+    parser.add_argument('--obstacles', nargs='*', default=None,
+                        help="fixed obstacle layout as x,y cells (default: re-sampled every episode)")
+    parser.add_argument('--output', default='q_table.bin')
+    parser.add_argument('--policy-output', default='policy.npy')
+    args = parser.parse_args()
+    # Saved with the tables, so incremental.py can retrain them after the layout changes
+    obstacles = None
+    if args.obstacles is not None:
+        obstacles = [tuple(int(v) for v in cell.split(',')) for cell in args.obstacles]
+
+    convergence = ConvergenceMonitor(stop=not args.no_early_stop)
+
+    metrics = MetricsRecorder(num_agents=3, log_path='training_log.csv', append=args.resume)
     Q_table = q_learning_multi_agent(
         num_episodes=10000,
         num_agents=3,
         gamma=0.99,
         epsilon=1.0,
         decay_rate=0.9995,
-        learning_rate=0.1
+        learning_rate=0.2,
+        checkpoint_path='q_table_checkpoint.bin',
+        resume=args.resume,
+        metrics=metrics,
+        convergence=convergence,
+        shaping=args.shaping,
+        seed=args.seed,
+        obstacles=obstacles
     )
+    metrics.close()
 
-    with open('q_table.pickle', 'wb') as handle:
-        pickle.dump(Q_table, handle, protocol=pickle.HIGHEST_PROTOCOL) 
+    write_q_tables(Q_table, args.output, dict(convergence.summary(), seed=args.seed, obstacles=obstacles))
+    write_policy(compile_policy(Q_table), args.policy_output) 
@@ -0,0 +1,364 @@
+import json
+import os
+import struct
+import numpy as np
+from contextlib import ExitStack, contextmanager, nullcontext
+from multiprocessing import shared_memory
+
+# Binary Q-table file: 8-byte magic, uint32 format version, uint32 header length, a JSON header
+# describing every array (dtype, shape, byte offset) plus free-form metadata, then the arrays
+# themselves, each aligned to ALIGNMENT bytes so they can be memory-mapped in place.
+MAGIC = b'PDQTABLE'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# States scanned per block when looking for the rows that differ from a fresh store
+SCAN_STATES = 1 << 16
+# Locks the trainers stripe the shared aggregate over, so workers on different states rarely wait
+LOCK_STRIPES = 64
+
+# Dense storage for every agent's Q-table, indexed directly by hash_state.
+# Rows start at the same optimistic 1000 value the dict tables used; `visited` marks the
+# rows that the dict version would have created, so the shared-Q average keeps its meaning.
+# shared_sum/shared_count hold the running sum of the visited agents' Q-values and the number
+# of agents that visited each state, so the shared-Q average is a single lookup.
+# The arrays can live in one shared memory block so worker processes update them in place.
+# This trades memory for speed: every state hash_state can return gets a row whether or not it
+# is ever visited, so the store takes 73 bytes per agent and state plus 52 per state, and the
+# number of states grows as grid_size ** 5. Three agents need 1.6 MiB on the 5x5 grid, 52 MiB on
+# 10x10 and 1.6 GiB on 20x20, far more than the dict tables on small grids where few states are
+# ever seen. Files only pay for what was learned: write_q_tables keeps the touched rows by default.
+# compact_q_table also quantizes them for deployment, and linear_q learns on grids too large for
+# any table.
+class QTableStore:
+    # arrays: existing arrays to wrap without copying (e.g. memory-mapped from a file)
+    def __init__(self, num_agents, num_states, num_actions=6, initial_value=1000, buffer=None, lock=None,
+                 arrays=None):
+        self.num_agents = num_agents
+        self.num_states = num_states
+        self.num_actions = num_actions
+        self.initial_value = initial_value
+        self.shm = None
+        # Guard the read-modify-write of shared_sum when several workers update the store: one
+        # lock, or a list of locks where state s takes locks[s % len(locks)]
+        if lock is None:
+            lock = nullcontext()
+        self.locks = list(lock) if isinstance(lock, (list, tuple)) else [lock]
+        # With track_shared False, visit and update leave shared_sum and shared_count alone and
+        # take no lock; they are stale until rebuild_shared. Seeded training reads the shared
+        # values from a SharedSnapshot rebuilt at every round barrier, so its workers only ever
+        # write their own agent's rows.
+        self.track_shared = True
+
+        wrapped = arrays is not None
+        arrays = dict(arrays or {})
+        offset = 0
+        for name, shape, dtype in self.layout(num_agents, num_states, num_actions):
+            if wrapped:
+                continue
+            if buffer is None:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+                offset += arrays[name].nbytes
+
+        self.q_values = arrays['q_values']
+        self.shared_sum = arrays['shared_sum']
+        self.num_updates = arrays['num_updates']
+        self.shared_count = arrays['shared_count']
+        self.visited = arrays['visited']
+        if buffer is None and not wrapped:
+            self.q_values.fill(initial_value)
+
+    # Names, shapes and dtypes of the arrays, in the order they are packed into a shared block
+    @staticmethod
+    def layout(num_agents, num_states, num_actions=6):
+        return [
+            ('q_values', (num_agents, num_states, num_actions), np.float64),
+            ('shared_sum', (num_states, num_actions), np.float64),
+            ('num_updates', (num_agents, num_states, num_actions), np.int32),
+            ('shared_count', (num_states,), np.int32),
+            ('visited', (num_agents, num_states), np.bool_)
+        ]
+
+    @classmethod
+    def buffer_size(cls, num_agents, num_states, num_actions=6):
+        return sum(int(np.prod(shape)) * np.dtype(dtype).itemsize
+                   for _, shape, dtype in cls.layout(num_agents, num_states, num_actions))
+
+    # Allocates a store backed by a new shared memory block
+    @classmethod
+    def create_shared(cls, num_agents, num_states, num_actions=6, initial_value=1000, lock=None):
+        shm = shared_memory.SharedMemory(create=True, size=cls.buffer_size(num_agents, num_states, num_actions))
+        store = cls(num_agents, num_states, num_actions, initial_value, buffer=shm.buf, lock=lock)
+        store.shm = shm
+        store.q_values.fill(initial_value)
+        for array in (store.shared_sum, store.num_updates, store.shared_count, store.visited):
+            array.fill(0)
+        return store
+
+    # Maps an existing shared memory block created by create_shared (used by worker processes)
+    @classmethod
+    def attach_shared(cls, name, num_agents, num_states, num_actions=6, initial_value=1000, lock=None):
+        shm = shared_memory.SharedMemory(name=name)
+        store = cls(num_agents, num_states, num_actions, initial_value, buffer=shm.buf, lock=lock)
+        store.shm = shm
+        return store
+
+    # Releases the shared memory block; unlink=True destroys it (only the creator should do this)
+    def close(self, unlink=False):
+        if self.shm is None:
+            return
+        # Drop the array views first, the block cannot be closed while they export its buffer
+        self.q_values = self.shared_sum = self.num_updates = self.shared_count = self.visited = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+        self.shm = None
+
+    # Private (non-shared) copy of the store
+    def copy(self):
+        return QTableStore.from_dict(self.to_dict())
+
+    # Overwrites this store's arrays in place with another store's contents (e.g. a checkpoint)
+    def copy_from(self, other):
+        for name, _, _ in self.layout(self.num_agents, self.num_states, self.num_actions):
+            getattr(self, name)[:] = getattr(other, name)
+
+    # Marks a state as seen by the agent (replaces the lazy row creation of the dict tables)
+    # and adds the agent's row to the shared aggregate the first time
+    def visit(self, agent_id, state):
+        if self.visited[agent_id, state]:
+            return
+        if not self.track_shared:
+            self.visited[agent_id, state] = True
+            return
+        with self.locks[state % len(self.locks)]:
+            self.visited[agent_id, state] = True
+            self.shared_sum[state] += self.q_values[agent_id, state]
+            self.shared_count[state] += 1
+
+    # Writes one Q-value and keeps the shared aggregate in step with it
+    def update(self, agent_id, state, action, value):
+        if not self.track_shared:
+            self.q_values[agent_id, state, action] = value
+            return
+        with self.locks[state % len(self.locks)]:
+            if self.visited[agent_id, state]:
+                self.shared_sum[state, action] += value - self.q_values[agent_id, state, action]
+            self.q_values[agent_id, state, action] = value
+
+    # Holds every lock, for updates that touch many states at once
+    @contextmanager
+    def all_locks(self):
+        with ExitStack() as stack:
+            for lock in self.locks:
+                stack.enter_context(lock)
+            yield
+
+    # Average Q-value of (state, action) over the agents that have seen the state
+    def shared_value(self, state, action):
+        count = self.shared_count[state]
+        return self.shared_sum[state, action] / count if count > 0 else 0
+
+    # Flat keys (agent_id * num_states + state) of the rows that differ from a fresh store: visited,
+    # updated or moved off the initial value. The store is scanned a block of states at a time, so
+    # a memory-mapped one is never read whole.
+    def touched_keys(self):
+        keys = []
+        for agent_id in range(self.num_agents):
+            for start in range(0, self.num_states, SCAN_STATES):
+                block = slice(start, min(start + SCAN_STATES, self.num_states))
+                touched = (np.asarray(self.visited[agent_id, block]) |
+                           (np.asarray(self.num_updates[agent_id, block]) != 0).any(axis=1) |
+                           (np.asarray(self.q_values[agent_id, block]) != self.initial_value).any(axis=1))
+                keys.append(agent_id * self.num_states + start + np.flatnonzero(touched))
+        return np.concatenate(keys)
+
+    # Recomputes the shared aggregate from the Q-tables, e.g. after loading or bulk edits
+    def rebuild_shared(self):
+        self.shared_sum[:] = (self.q_values * self.visited[:, :, None]).sum(axis=0)
+        self.shared_count[:] = self.visited.sum(axis=0)
+
+    # Plain dict of arrays (the layout of older q_table.pickle exports)
+    def to_dict(self):
+        return {
+            'initial_value': self.initial_value,
+            'q_values': self.q_values,
+            'num_updates': self.num_updates,
+            'visited': self.visited
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        num_agents, num_states, num_actions = data['q_values'].shape
+        store = cls(num_agents, num_states, num_actions, data['initial_value'])
+        store.q_values[:] = data['q_values']
+        store.num_updates[:] = data['num_updates']
+        store.visited[:] = data['visited']
+        store.rebuild_shared()
+        return store
+
+    # Converts the old list-of-dicts tables ({state: q_values}) into a store
+    @classmethod
+    def from_dicts(cls, Q_table, num_states, num_actions=6, initial_value=1000):
+        store = cls(len(Q_table), num_states, num_actions, initial_value)
+        for agent_id, table in enumerate(Q_table):
+            for state, q_values in table.items():
+                store.q_values[agent_id, state] = q_values
+                store.visited[agent_id, state] = True
+        store.rebuild_shared()
+        return store
+
+
+# Per-state shared Q-values frozen at a point in time, read instead of the live aggregate so
+# that what one agent sees does not depend on how far the other agents have got in a round.
+# The values can live in shared memory so worker processes read the same snapshot.
+class SharedSnapshot:
+    def __init__(self, num_states, num_actions=6, buffer=None):
+        self.shm = None
+        if buffer is None:
+            self.values = np.zeros((num_states, num_actions))
+        else:
+            self.values = np.ndarray((num_states, num_actions), dtype=np.float64, buffer=buffer)
+
+    @classmethod
+    def create_shared(cls, num_states, num_actions=6):
+        shm = shared_memory.SharedMemory(create=True, size=num_states * num_actions * 8)
+        snapshot = cls(num_states, num_actions, buffer=shm.buf)
+        snapshot.shm = shm
+        snapshot.values.fill(0)
+        return snapshot
+
+    @classmethod
+    def attach_shared(cls, name, num_states, num_actions=6):
+        shm = shared_memory.SharedMemory(name=name)
+        snapshot = cls(num_states, num_actions, buffer=shm.buf)
+        snapshot.shm = shm
+        return snapshot
+
+    def close(self, unlink=False):
+        if self.shm is None:
+            return
+        self.values = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+        self.shm = None
+
+    # Rebuilds the store's aggregate from its tables (so its rounding does not depend on the
+    # order of concurrent updates) and freezes the averages
+    def refresh(self, store):
+        store.rebuild_shared()
+        counts = store.shared_count[:, None]
+        np.divide(store.shared_sum, np.maximum(counts, 1), out=self.values)
+        self.values[store.shared_count == 0] = 0
+
+    def shared_value(self, state, action):
+        return self.values[state, action]
+
+
+# Loads a pickled Q-table export, accepting both the dict-of-arrays and the old list-of-dicts layout
+def load_q_tables(data, num_states):
+    if isinstance(data, dict):
+        return QTableStore.from_dict(data)
+    return QTableStore.from_dicts(data, num_states)
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# Writes named arrays (in order), the header fields and free-form metadata in the binary format.
+# The file is written next to the target and renamed, so a crash never leaves a torn checkpoint.
+def write_arrays(path, named_arrays, fields, metadata=None):
+    arrays = []
+    offset = 0
+    for name, array in named_arrays:
+        dtype = array.dtype.newbyteorder('<')
+        arrays.append({'name': name, 'dtype': dtype.str, 'shape': list(array.shape), 'offset': offset})
+        offset = _aligned(offset + array.nbytes)
+
+    header = json.dumps(dict(fields, arrays=arrays, metadata=metadata or {})).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as handle:
+        handle.write(MAGIC)
+        handle.write(struct.pack('<II', FORMAT_VERSION, len(header)))
+        handle.write(header)
+        for entry, (_, array) in zip(arrays, named_arrays):
+            handle.seek(data_start + entry['offset'])
+            handle.write(np.ascontiguousarray(array, dtype=entry['dtype']).tobytes())
+        handle.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+# Writes the store (and optional JSON-serialisable metadata) in the binary format.
+# sparse=True writes only the touched rows (see QTableStore.touched_keys) with their keys, so the
+# file grows with what was learned rather than with the grid; read_q_tables restores the rest as
+# fresh rows. sparse=False writes every array whole, which read_q_tables memory-maps in place.
+def write_q_tables(store, path, metadata=None, sparse=True):
+    fields = {
+        'num_agents': store.num_agents,
+        'num_states': store.num_states,
+        'num_actions': store.num_actions,
+        'initial_value': store.initial_value
+    }
+    if sparse:
+        keys = store.touched_keys()
+        agent_ids, states = np.divmod(keys, store.num_states)
+        named_arrays = [('keys', keys)] + [(name, getattr(store, name)[agent_ids, states])
+                                           for name in ('q_values', 'num_updates', 'visited')]
+        fields['kind'] = 'sparse'
+    else:
+        named_arrays = [(name, getattr(store, name))
+                        for name, _, _ in store.layout(store.num_agents, store.num_states, store.num_actions)]
+    write_arrays(path, named_arrays, fields, metadata)
+
+# Reads only the header of a binary Q-table file; returns (header, data_start)
+def read_q_table_header(path):
+    with open(path, 'rb') as handle:
+        if handle.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a Q-table file")
+        version, header_len = struct.unpack('<II', handle.read(8))
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{path} uses Q-table format {version}, newer than supported {FORMAT_VERSION}")
+        header = json.loads(handle.read(header_len).decode('utf-8'))
+    return header, _aligned(len(MAGIC) + 8 + header_len)
+
+# Reads every array of a binary file; returns (header, arrays by name).
+# mode is the np.memmap mode: 'r' maps the arrays read-only without reading them, so loading
+# takes the same time for any table size; 'c' is copy-on-write, 'r+' writes through to the file.
+# mode=None reads everything into private memory instead.
+def read_arrays(path, mode='r'):
+    header, data_start = read_q_table_header(path)
+    arrays = {}
+    for entry in header['arrays']:
+        shape = tuple(entry['shape'])
+        if mode is None:
+            count = int(np.prod(shape))
+            with open(path, 'rb') as handle:
+                handle.seek(data_start + entry['offset'])
+                arrays[entry['name']] = np.fromfile(handle, dtype=entry['dtype'], count=count).reshape(shape)
+        else:
+            arrays[entry['name']] = np.memmap(path, dtype=entry['dtype'], mode=mode,
+                                              offset=data_start + entry['offset'], shape=shape)
+    return header, arrays
+
+# Loads a binary Q-table file written by write_q_tables; returns (store, metadata).
+# Dense files are wrapped in place (memory-mapped with the default mode); sparse files are
+# scattered into a new private store.
+def read_q_tables(path, mode='r'):
+    header, arrays = read_arrays(path, mode)
+    kind = header.get('kind', 'dense')
+    if kind == 'sparse':
+        store = QTableStore(header['num_agents'], header['num_states'], header['num_actions'],
+                            header['initial_value'])
+        agent_ids, states = np.divmod(np.asarray(arrays['keys']), store.num_states)
+        for name in ('q_values', 'num_updates', 'visited'):
+            getattr(store, name)[agent_ids, states] = arrays[name]
+        store.rebuild_shared()
+        return store, header['metadata']
+    if kind != 'dense':
+        raise ValueError(f"{path} holds {kind} Q-tables, not a dense store")
+    store = QTableStore(header['num_agents'], header['num_states'], header['num_actions'],
+                        header['initial_value'], arrays=arrays)
+    return store, header['metadata']
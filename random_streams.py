@@ -0,0 +1,27 @@
+import numpy as np
+
+# Independent random streams for seeded training. Every (agent, round) task gets its own NumPy
+# Generator derived from the root seed, so the numbers an agent draws never depend on which
+# thread or process runs it or in what order. Exploration draws are made in blocks and
+# consumed by index, one uniform and one random action per step whether or not it explores.
+
+class RandomStream:
+    def __init__(self, seed_sequence, num_actions=6, block_size=4096):
+        self.generator = np.random.default_rng(seed_sequence)
+        self.num_actions = num_actions
+        self.block_size = block_size
+        self.refill()
+
+    # Draws the next block; lists index faster than NumPy scalars in the per-step loop
+    def refill(self):
+        self.uniforms = self.generator.random(self.block_size).tolist()
+        self.actions = self.generator.integers(0, self.num_actions, self.block_size).tolist()
+        self.index = 0
+
+# Stream of one agent's task that starts at first_episode
+def task_stream(seed, agent_id, first_episode, num_actions=6):
+    return RandomStream(np.random.SeedSequence(seed, spawn_key=(agent_id, first_episode)), num_actions)
+
+# Seed of the replay buffer of one agent's task, independent of the task's exploration stream
+def task_replay_seed(seed, agent_id, first_episode):
+    return np.random.SeedSequence(seed, spawn_key=(agent_id, first_episode, 1))
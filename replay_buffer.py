@@ -0,0 +1,107 @@
+import numpy as np
+from contextlib import nullcontext
+
+# Experience replay for the tabular learner: transitions are kept in preallocated ring-buffer
+# arrays and replayed in minibatches, so one NumPy call applies hundreds of TD updates with
+# the same target Q_learning uses (own max blended with the shared-Q value).
+
+class ReplayBuffer:
+    # prioritized=True samples transitions in proportion to |TD error| ** priority_exponent;
+    # otherwise sampling is uniform. Q_learning replays batch_size transitions every
+    # update_every environment steps once the buffer holds at least batch_size of them.
+    def __init__(self, capacity, batch_size=512, update_every=32, prioritized=False,
+                 priority_exponent=0.6, priority_eps=1e-3, seed=None):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.update_every = update_every
+        self.prioritized = prioritized
+        self.priority_exponent = priority_exponent
+        self.priority_eps = priority_eps
+        self.rng = np.random.default_rng(seed)
+
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_states = np.zeros(capacity, dtype=np.int64)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.priorities = np.zeros(capacity, dtype=np.float64)
+        self.max_priority = 1.0
+        self.index = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    # Stores one transition, overwriting the oldest once the buffer is full.
+    # New transitions get the highest priority seen so far, so each is replayed at least once soon.
+    def add(self, state, action, reward, next_state, done):
+        i = self.index
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        self.priorities[i] = self.max_priority
+        self.index = (i + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    # Indices of batch_size stored transitions
+    def sample(self, batch_size):
+        if not self.prioritized:
+            return self.rng.integers(0, self.size, size=batch_size)
+        weights = np.cumsum(self.priorities[:self.size] ** self.priority_exponent)
+        picks = self.rng.random(batch_size) * weights[-1]
+        return np.minimum(np.searchsorted(weights, picks, side='right'), self.size - 1)
+
+    def update_priorities(self, indices, td_errors):
+        if not self.prioritized:
+            return
+        priorities = np.abs(td_errors) + self.priority_eps
+        self.priorities[indices] = priorities
+        self.max_priority = max(self.max_priority, priorities.max())
+
+# Applies one TD update per transition with the Q_learning target, in a single NumPy pass.
+# Every (agent, state, action) triple must appear at most once, so the step-size schedule,
+# the update counts and the shared aggregate match applying the transitions one at a time.
+# The agents must already have visited the updated states. shared (a q_table.SharedSnapshot) is
+# read for the shared Q-values instead of the live aggregate, as in Q_learning; it is required
+# when the store does not track the aggregate (QTableStore.track_shared).
+# Returns the TD errors.
+def batch_update(Q_table, agent_ids, states, actions, rewards, next_states, dones, gamma,
+                 alpha=0.5, learning_rate=0.2, shared=None):
+    q_values = Q_table.q_values
+    num_updates = Q_table.num_updates
+    with Q_table.all_locks() if Q_table.track_shared else nullcontext():
+        if shared is None:
+            counts = Q_table.shared_count[states]
+            shared_q = np.where(counts > 0, Q_table.shared_sum[states, actions] / np.maximum(counts, 1), 0)
+        else:
+            shared_q = shared.values[states, actions]
+        bootstrap = (1 - alpha) * q_values[agent_ids, next_states].max(axis=1) + alpha * shared_q
+        targets = rewards + np.where(dones, 0, gamma * bootstrap)
+
+        current = q_values[agent_ids, states, actions]
+        td_errors = targets - current
+        eta = learning_rate / (1 + num_updates[agent_ids, states, actions] * 0.1)
+        deltas = eta * td_errors
+        q_values[agent_ids, states, actions] = current + deltas
+        # Several agents can update the same (state, action) in one batch
+        if Q_table.track_shared:
+            np.add.at(Q_table.shared_sum, (states, actions), deltas * Q_table.visited[agent_ids, states])
+        num_updates[agent_ids, states, actions] += 1
+    return td_errors
+
+# Replays one minibatch from the buffer into the agent's Q-table and returns the number of
+# updates applied. Repeated (state, action) pairs in the sample are replayed once.
+def replay_update(Q_table, agent_id, buffer, gamma, alpha=0.5, learning_rate=0.2, shared=None):
+    indices = buffer.sample(buffer.batch_size)
+    pairs = buffer.states[indices] * Q_table.num_actions + buffer.actions[indices]
+    _, first = np.unique(pairs, return_index=True)
+    indices = indices[first]
+
+    td_errors = batch_update(Q_table, np.full(len(indices), agent_id), buffer.states[indices],
+                             buffer.actions[indices], buffer.rewards[indices], buffer.next_states[indices],
+                             buffer.dones[indices], gamma, alpha, learning_rate, shared)
+    buffer.update_priorities(indices, td_errors)
+    return len(indices)
@@ -0,0 +1,201 @@
+import argparse
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from environment import PackageEnv, EVENT_DELIVERED, build_next_cell_table
+
+# All-pairs shortest paths of an obstacle layout, computed once with a batched BFS and cached.
+# dist[target, cell] is the number of moves from cell to target (-1 when it cannot be reached)
+# and next_hop[target, cell] the PackageEnv move (0-3: UP, DOWN, LEFT, RIGHT) that starts a
+# shortest route from cell to target (-1 at the target itself or when unreachable).
+# Both are grid_size^4 entries, so the cache keeps only as many recently used layouts as fit in
+# its byte budget.
+
+# Move that undoes each move: UP <-> DOWN, LEFT <-> RIGHT
+OPPOSITE = np.array([1, 0, 3, 2])
+
+class ShortestPaths:
+    def __init__(self, grid_size, obstacles):
+        self.grid_size = grid_size
+        num_cells = grid_size * grid_size
+        obstacle_grid = np.zeros((grid_size, grid_size), dtype=bool)
+        for x, y in obstacles:
+            obstacle_grid[x, y] = True
+        next_cell = build_next_cell_table(grid_size, obstacle_grid)
+
+        dist_dtype = np.int16 if num_cells < np.iinfo(np.int16).max else np.int32
+        self.dist = np.full((num_cells, num_cells), -1, dtype=dist_dtype)
+        self.next_hop = np.full((num_cells, num_cells), -1, dtype=np.int8)
+
+        # One BFS per free target cell, all advanced together one level at a time. Moves between
+        # free cells are symmetric, so stepping from a frontier cell with move d reaches a cell
+        # whose first move toward the target is the opposite of d.
+        targets = np.flatnonzero(~obstacle_grid.ravel())
+        self.dist[targets, targets] = 0
+        frontier_targets, frontier_cells = targets, targets
+        level = 0
+        while len(frontier_targets):
+            level += 1
+            new_targets, new_cells = [], []
+            for move in range(4):
+                reached = next_cell[frontier_cells, move]
+                fresh = self.dist[frontier_targets, reached] < 0
+                reached_targets, reached = frontier_targets[fresh], reached[fresh]
+                self.dist[reached_targets, reached] = level
+                self.next_hop[reached_targets, reached] = OPPOSITE[move]
+                new_targets.append(reached_targets)
+                new_cells.append(reached)
+            frontier_targets = np.concatenate(new_targets)
+            frontier_cells = np.concatenate(new_cells)
+
+    @property
+    def nbytes(self):
+        return self.dist.nbytes + self.next_hop.nbytes
+
+    def cell(self, position):
+        return position[0] * self.grid_size + position[1]
+
+    # Moves from one (x, y) position to another, -1 when there is no route
+    def distance(self, start, end):
+        return int(self.dist[self.cell(end), self.cell(start)])
+
+    # First PackageEnv move index of a shortest route from start to end, -1 if there is none
+    def next_action(self, start, end):
+        return int(self.next_hop[self.cell(end), self.cell(start)])
+
+    # Steps and reward of the best possible episode from agent to its package and on to the goal:
+    # the moves there, one PICKUP, the moves to the goal and the delivery. None if unreachable.
+    def optimal_route(self, agent, package, goal, rewards):
+        to_package = self.distance(agent, package)
+        to_goal = self.distance(package, goal)
+        if to_package < 0 or to_goal < 0:
+            return None
+        moves = to_package + to_goal
+        return {'steps': moves + 1, 'reward': -moves + rewards['PICKUP'] + rewards['DROP']}
+
+    # Potential of an agent for reward shaping: minus the steps left on its optimal route, 0 when
+    # there is no route. agent_cell and package_cell are flat cell indices.
+    def potential(self, agent_cell, package_cell, picked, goal_cell):
+        dist = self.dist
+        if picked:
+            remaining = int(dist[goal_cell, agent_cell])
+        else:
+            to_package = int(dist[package_cell, agent_cell])
+            to_goal = int(dist[goal_cell, package_cell])
+            if to_package < 0 or to_goal < 0:
+                return 0
+            remaining = to_package + 1 + to_goal
+        return -remaining if remaining >= 0 else 0
+
+# Layout tables keyed by a hash of the grid size and obstacle cells. Once they take more than
+# max_bytes the least recently used are evicted (the newest is always kept). Safe to share
+# between the trainer's threads.
+class PathCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.layouts = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def layout_key(grid_size, obstacles):
+        cells = sorted(x * grid_size + y for x, y in obstacles)
+        return hashlib.blake2b(np.array([grid_size] + cells, dtype=np.int64).tobytes(), digest_size=16).digest()
+
+    def get(self, grid_size, obstacles):
+        key = self.layout_key(grid_size, obstacles)
+        with self.lock:
+            paths = self.layouts.get(key)
+            if paths is not None:
+                self.layouts.move_to_end(key)
+                self.hits += 1
+                return paths
+            self.misses += 1
+        # Computed outside the lock so other threads keep hitting the cache meanwhile
+        paths = ShortestPaths(grid_size, obstacles)
+        with self.lock:
+            if key in self.layouts:
+                # Another thread built the same layout first
+                paths = self.layouts[key]
+            else:
+                self.layouts[key] = paths
+                self.nbytes += paths.nbytes
+            self.layouts.move_to_end(key)
+            while self.nbytes > self.max_bytes and len(self.layouts) > 1:
+                _, evicted = self.layouts.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return paths
+
+path_cache = PathCache()
+
+# Shortest paths of an environment's current layout; works for any env with grid_size and obstacles
+def layout_paths(env, cache=path_cache):
+    return cache.get(env.grid_size, env.obstacles)
+
+# Plays the greedy policy like policy.evaluate_policy and compares every episode that delivers
+# with the optimal route of its layout. Layouts where the package or goal is walled off are skipped.
+# The layouts and the random actions for unseen states both come from seed.
+def compare_to_optimal_routes(policy, num_episodes=1000, max_steps=200, seed=0, **env_kwargs):
+    # Imported here: q_learning imports this module for reward shaping
+    from q_learning import hash_state
+    from policy import UNSEEN
+
+    rng = np.random.default_rng(seed)
+    num_agents = policy.shape[0]
+    env = PackageEnv(num_agents=num_agents, rng=rng, **env_kwargs)
+    delivered = 0
+    unreachable = 0
+    optimal = 0
+    excess_steps = 0
+    regret = 0
+    for episode in range(num_episodes):
+        agent_id = episode % num_agents
+        state, _, _ = env.reset()
+        route = layout_paths(env).optimal_route(env.agent_positions[agent_id], env.package_positions[agent_id],
+                                                env.goal_room, env.rewards)
+        if route is None:
+            unreachable += 1
+            continue
+        event = 0
+        steps = 0
+        reward = 0
+        for _ in range(max_steps):
+            action_idx = policy[agent_id, hash_state(state, agent_id, env)]
+            if action_idx == UNSEEN:
+                action_idx = rng.integers(len(env.actions))
+            event = env.fast_step(action_idx, agent_id)
+            reward += env.event_rewards[event]
+            steps += 1
+            if event >= EVENT_DELIVERED:
+                break
+        if event & EVENT_DELIVERED:
+            delivered += 1
+            optimal += steps == route['steps']
+            excess_steps += steps - route['steps']
+            regret += route['reward'] - reward
+
+    routable = num_episodes - unreachable
+    return {
+        'episodes': routable,
+        'unreachable': unreachable,
+        'delivery_rate': delivered / routable if routable else 0.0,
+        'optimal_rate': optimal / delivered if delivered else 0.0,
+        'mean_excess_steps': excess_steps / delivered if delivered else None,
+        'mean_regret': regret / delivered if delivered else None
+    }
+
+if __name__ == "__main__":
+    from policy import read_policy
+
+    parser = argparse.ArgumentParser(description="Compare the greedy policy's routes with the shortest routes")
+    parser.add_argument('policy', nargs='?', default='policy.npy')
+    parser.add_argument('--episodes', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(compare_to_optimal_routes(read_policy(args.policy), args.episodes, seed=args.seed))
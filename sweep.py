@@ -0,0 +1,153 @@
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from convergence import ConvergenceMonitor
+from policy import compile_policy, evaluate_policy
+from q_learning import q_learning_multi_agent
+
+# Hyperparameter sweeps over the trainer. Every configuration runs once per seed in a process
+# pool with early stopping, and the final reward, the episodes to convergence, the greedy
+# delivery rate and the wall time of every run are collected into one results table.
+# All configurations use the same seeds, so they are compared on the same layouts.
+
+# Values tried for each parameter: a list is a set of choices, a (low, high) tuple is a range
+# that random search samples uniformly (grid search uses both ends)
+DEFAULT_SPACE = {
+    'gamma': [0.9, 0.95, 0.99],
+    'decay_rate': [0.999, 0.9995],
+    'alpha': [0.0, 0.25, 0.5],
+    'learning_rate': [0.1, 0.2, 0.4],
+    'epsilon_floor': [0.1, 0.25]
+}
+
+RESULT_COLUMNS = ['config', 'seed', 'gamma', 'decay_rate', 'alpha', 'learning_rate', 'epsilon_floor',
+                  'final_reward', 'episodes_run', 'converged', 'delivery_rate', 'seconds']
+
+def grid_configs(space):
+    names = list(space)
+    choices = [list(space[name]) for name in names]
+    return [dict(zip(names, values)) for values in itertools.product(*choices)]
+
+def random_configs(space, num_samples, seed=0):
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(num_samples):
+        config = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                config[name] = rng.uniform(*values)
+            else:
+                config[name] = rng.choice(values)
+        configs.append(config)
+    return configs
+
+# One seed per replicate, derived from a single base seed so runs are reproducible
+def replicate_seeds(num_seeds, base_seed=0):
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(base_seed).spawn(num_seeds)]
+
+# Trains one configuration on one seed; runs in a worker process. final_reward is the agents'
+# mean reward over the last final_window episodes.
+def run_config(config_id, config, seed, num_episodes, num_agents, grid_size, final_window=200):
+    convergence = ConvergenceMonitor()
+    recent = []
+
+    def callback(episodes, chunk_rewards):
+        for i in range(len(episodes)):
+            recent.append(sum(rewards[i] for rewards in chunk_rewards) / num_agents)
+        del recent[:-final_window]
+        return False
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        Q_table = q_learning_multi_agent(num_episodes, num_agents, callback=callback, plot=False,
+                                         grid_size=grid_size, convergence=convergence, seed=seed,
+                                         **config)
+    seconds = time.perf_counter() - start
+    evaluation = evaluate_policy(compile_policy(Q_table), num_episodes=500, seed=seed, grid_size=grid_size)
+
+    return dict(config=config_id, seed=seed, **config,
+                final_reward=float(np.mean(recent)),
+                episodes_run=convergence.episodes_run,
+                converged=convergence.stop_reason == 'converged',
+                delivery_rate=evaluation['delivery_rate'],
+                seconds=seconds)
+
+# Runs every configuration on every seed across max_workers processes and returns one row per run
+def run_sweep(configs, seeds, num_episodes=10000, num_agents=3, grid_size=5, max_workers=None):
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_config, config_id, config, seed, num_episodes, num_agents, grid_size)
+                   for config_id, config in enumerate(configs) for seed in seeds]
+        return [future.result() for future in futures]
+
+# Mean of every result over the seeds of each configuration, best final reward first
+def summarize(rows):
+    summary = []
+    for config_id in sorted({row['config'] for row in rows}):
+        runs = [row for row in rows if row['config'] == config_id]
+        entry = {name: runs[0][name] for name in RESULT_COLUMNS[2:7]}
+        entry['config'] = config_id
+        entry['seeds'] = len(runs)
+        for name in ('final_reward', 'episodes_run', 'converged', 'delivery_rate', 'seconds'):
+            entry[name] = float(np.mean([row[name] for row in runs]))
+        summary.append(entry)
+    return sorted(summary, key=lambda entry: entry['final_reward'], reverse=True)
+
+# Writes the per-run table as CSV, or as JSON (with the per-configuration summary) for .json paths
+def write_results(rows, path):
+    if os.path.splitext(path)[1] == '.json':
+        with open(path, 'w') as handle:
+            json.dump({'runs': rows, 'summary': summarize(rows)}, handle, indent=2)
+        return
+    with open(path, 'w', newline='') as handle:
+        writer = csv.DictWriter(handle, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the trainer's hyperparameters in parallel")
+    parser.add_argument('--search', choices=['grid', 'random'], default='random')
+    parser.add_argument('--samples', type=int, default=20, help="configurations drawn by random search")
+    parser.add_argument('--seeds', type=int, default=3, help="runs per configuration")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--episodes', type=int, default=10000, help="episode budget per run")
+    parser.add_argument('--agents', type=int, default=3)
+    parser.add_argument('--grid-size', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--space', default=None, help="JSON file mapping parameters to lists or [low, high] ranges")
+    parser.add_argument('--output', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    space = DEFAULT_SPACE
+    if args.space is not None:
+        with open(args.space) as handle:
+            # JSON has no tuples: two-number lists under "ranges" are sampled as ranges
+            loaded = json.load(handle)
+            space = {name: tuple(values) for name, values in loaded.pop('ranges', {}).items()}
+            space.update(loaded)
+
+    if args.search == 'grid':
+        configs = grid_configs({name: values if isinstance(values, list) else list(values)
+                                for name, values in space.items()})
+    else:
+        configs = random_configs(space, args.samples, args.seed)
+
+    rows = run_sweep(configs, replicate_seeds(args.seeds, args.seed), args.episodes, args.agents,
+                     args.grid_size, args.workers)
+    write_results(rows, args.output)
+
+    print(f"{len(rows)} runs written to {args.output}")
+    header = ['config'] + RESULT_COLUMNS[2:7] + ['final_reward', 'episodes_run', 'delivery_rate', 'seconds']
+    print(' '.join(f"{name:>13}" for name in header))
+    for entry in summarize(rows)[:10]:
+        print(' '.join(f"{entry[name]:>13.4g}" if isinstance(entry[name], float) else f"{entry[name]:>13}"
+                       for name in header))
@@ -0,0 +1,57 @@
+import numpy as np
+
+from environment import EVENT_DELIVERED, PackageEnv, VecPackageEnv
+
+# Action indices past both ends of PackageEnv.actions, which step() and fast_step() treat as invalid
+INVALID_ACTIONS = [-1, 6]
+
+def action_name(env, action_idx):
+    return env.actions[action_idx] if 0 <= action_idx < len(env.actions) else 'INVALID'
+
+def test_fast_step_matches_step():
+    rng = np.random.default_rng(0)
+    # Same seed, so both environments draw the same layouts on every reset
+    slow = PackageEnv(num_agents=3, rng=np.random.default_rng(1))
+    fast = PackageEnv(num_agents=3, rng=np.random.default_rng(1))
+    for _ in range(20000):
+        agent_id = int(rng.integers(3))
+        action_idx = int(rng.integers(-1, 7))
+        state, reward, done, info = slow.step(action_name(slow, action_idx), agent_id)
+        event = fast.fast_step(action_idx, agent_id)
+
+        assert fast.event_rewards[event] == reward
+        assert (event >= EVENT_DELIVERED) == done
+        assert fast.describe_event(event) == info['result']
+        assert fast.current_state == state
+        if done:
+            slow.reset()
+            fast.reset()
+
+def test_vec_env_matches_package_env():
+    num_envs = 200
+    rng = np.random.default_rng(0)
+    vec = VecPackageEnv(num_envs, grid_size=5, num_obstacles=2, seed=0)
+    g = vec.grid_size
+    envs = []
+    for env_id in range(num_envs):
+        obstacles = [divmod(int(cell), g) for cell in np.flatnonzero(vec.obstacles[env_id])]
+        env = PackageEnv(num_agents=1, grid_size=g, obstacles=obstacles)
+        env.agent_positions[0] = divmod(int(vec.agent_cells[env_id, 0]), g)
+        env.package_positions[0] = divmod(int(vec.package_cells[env_id, 0]), g)
+        envs.append(env)
+
+    running = np.ones(num_envs, dtype=bool)
+    for _ in range(150):
+        actions = rng.integers(-1, 7, size=num_envs)
+        _, rewards, dones, _ = vec.step(actions)
+        for env_id in np.flatnonzero(running):
+            env = envs[env_id]
+            _, reward, done, _ = env.step(action_name(env, int(actions[env_id])), 0)
+            assert rewards[env_id] == reward
+            assert dones[env_id] == done
+            assert divmod(int(vec.agent_cells[env_id, 0]), g) == env.agent_positions[0]
+            assert vec.package_picked[env_id, 0] == env.package_picked[0]
+            assert vec.fuel_consumed[env_id, 0] == env.fuel_consumed[0]
+        # Finished episodes are compared up to their last step only
+        running &= ~dones
+    assert not running.all()
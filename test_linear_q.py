@@ -0,0 +1,16 @@
+from linear_q import KNOTS, LinearQ, evaluate_linear, train_linear
+
+# Greedy on the Manhattan moves left alone: the baseline the learned features have to beat
+def manhattan_learner():
+    learner = LinearQ()
+    learner.value_weights[:len(KNOTS)] = -KNOTS
+    return learner
+
+def test_linear_q_beats_random_and_manhattan():
+    learner, _, _ = train_linear(2000, grid_size=20, seed=0)
+    layouts = dict(num_episodes=500, grid_size=20, seed=7)
+    learned = evaluate_linear(learner, **layouts)['delivery_rate']
+    random_play = evaluate_linear(LinearQ(), epsilon=1.0, **layouts)['delivery_rate']
+    manhattan = evaluate_linear(manhattan_learner(), **layouts)['delivery_rate']
+    assert learned > random_play + 0.5
+    assert learned > manhattan + 0.05
@@ -0,0 +1,26 @@
+import numpy as np
+
+from q_table import QTableStore, read_q_tables, write_q_tables
+
+def trained_store():
+    rng = np.random.default_rng(0)
+    store = QTableStore(2, 5000)
+    for _ in range(300):
+        agent_id, state, action = int(rng.integers(2)), int(rng.integers(5000)), int(rng.integers(6))
+        store.visit(agent_id, state)
+        store.update(agent_id, state, action, float(rng.normal(0, 100)))
+        store.num_updates[agent_id, state, action] += 1
+    return store
+
+def test_sparse_file_round_trip(tmp_path):
+    store = trained_store()
+    for sparse in (True, False):
+        path = tmp_path / f"q_table_{sparse}.bin"
+        write_q_tables(store, path, {'episode': 3}, sparse=sparse)
+        loaded, metadata = read_q_tables(path)
+        assert metadata == {'episode': 3}
+        for name in ('q_values', 'num_updates', 'visited', 'shared_count'):
+            assert np.array_equal(getattr(loaded, name), getattr(store, name))
+        # Rebuilt on load, so only equal up to the order of the additions
+        assert np.allclose(loaded.shared_sum, store.shared_sum)
+    assert (tmp_path / "q_table_True.bin").stat().st_size * 10 < (tmp_path / "q_table_False.bin").stat().st_size
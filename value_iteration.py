@@ -0,0 +1,150 @@
+import argparse
+import json
+import random
+import numpy as np
+from environment import PackageEnv, build_next_cell_table
+from q_learning import num_states
+from q_table import QTableStore, read_q_tables, write_q_tables
+
+# Model-based solver for a fixed obstacle layout. Each agent's dynamics only depend on its own
+# cell, its picked flag and its package's cell (other agents never block it), so the transition
+# and reward tensors over those states are built once from the PackageEnv rules and solved with
+# vectorized value iteration. Fuel is not part of hash_state and is left out of the model:
+# with the default 100 fuel an optimal route never runs dry on a 5x5 grid.
+
+NUM_ACTIONS = 6
+PICKUP = 4
+DROP = 5
+
+# Deterministic model of one agent on the layout: next_state[s, a], reward[s, a] and
+# terminal[s, a] for model state s = (cell * 2 + picked) * cells + package_cell.
+# Mirrors PackageEnv.fast_step: moves cost -1, PICKUP on the package's cell gives PICKUP,
+# and any action that leaves a carrying agent in the goal room delivers for DROP points.
+def build_model(grid_size, obstacles, rewards=None):
+    if rewards is None:
+        rewards = PackageEnv(num_agents=1, grid_size=grid_size, obstacles=obstacles).rewards
+    cells = grid_size * grid_size
+    goal_cell = cells - 1
+    obstacle_grid = np.zeros((grid_size, grid_size), dtype=bool)
+    for x, y in obstacles:
+        obstacle_grid[x, y] = True
+    next_cell = build_next_cell_table(grid_size, obstacle_grid)
+
+    cell, picked, package_cell = np.meshgrid(np.arange(cells), np.arange(2), np.arange(cells), indexing='ij')
+    cell, picked, package_cell = cell.ravel(), picked.ravel(), package_cell.ravel()
+
+    new_cell = np.empty((cell.size, NUM_ACTIONS), dtype=np.int64)
+    new_picked = np.repeat(picked[:, None], NUM_ACTIONS, axis=1)
+    reward = np.zeros((cell.size, NUM_ACTIONS))
+    new_cell[:, :4] = next_cell[cell]
+    new_cell[:, 4:] = cell[:, None]
+    reward[:, :4] = rewards['UP']
+
+    can_pick = (cell == package_cell) & (picked == 0)
+    new_picked[can_pick, PICKUP] = 1
+    reward[can_pick, PICKUP] += rewards['PICKUP']
+
+    terminal = (new_cell == goal_cell) & (new_picked == 1)
+    reward[terminal] += rewards['DROP']
+    next_state = (new_cell * 2 + new_picked) * cells + package_cell[:, None]
+    return next_state, reward, terminal
+
+# Runs value iteration on a model from build_model until the values move less than tol.
+# Returns the (model states, actions) Q-values and the number of sweeps.
+def solve_model(next_state, reward, terminal, gamma=0.99, tol=1e-6, max_iterations=10000):
+    continuing = gamma * ~terminal
+    values = np.zeros(next_state.shape[0])
+    for iteration in range(1, max_iterations + 1):
+        q_values = reward + continuing * values[next_state]
+        new_values = q_values.max(axis=1)
+        delta = np.abs(new_values - values).max()
+        values = new_values
+        if delta < tol:
+            break
+    return reward + continuing * values[next_state], iteration
+
+# hash_state row of every model state, with the goal room in the bottom-right corner
+def model_state_hashes(grid_size):
+    cells = grid_size * grid_size
+    cell, picked, package_cell = np.meshgrid(np.arange(cells), np.arange(2), np.arange(cells), indexing='ij')
+    prefix = cell.ravel() * 2 * cells + picked.ravel() * cells + package_cell.ravel()
+    return prefix * grid_size + (cells - 1)
+
+# Model states an agent can act in on this layout: not on an obstacle, package not on an
+# obstacle and not already delivered (carrying in the goal room ends the episode)
+def live_states(grid_size, obstacles):
+    cells = grid_size * grid_size
+    blocked = np.zeros(cells, dtype=bool)
+    for x, y in obstacles:
+        blocked[x * grid_size + y] = True
+    cell, picked, package_cell = np.meshgrid(np.arange(cells), np.arange(2), np.arange(cells), indexing='ij')
+    cell, picked, package_cell = cell.ravel(), picked.ravel(), package_cell.ravel()
+    return ~blocked[cell] & ~blocked[package_cell] & ~((cell == cells - 1) & (picked == 1))
+
+# Solves a layout and returns it as a QTableStore that q_learning_multi_agent, policy.py and
+# write_q_tables accept. Every agent gets the same table; states the agent can act in are
+# marked visited, all other rows keep the initial value.
+def value_iteration(num_agents, grid_size=5, obstacles=(), gamma=0.99, tol=1e-6):
+    next_state, reward, terminal = build_model(grid_size, obstacles)
+    q_values, iterations = solve_model(next_state, reward, terminal, gamma, tol)
+    hashes = model_state_hashes(grid_size)
+    live = live_states(grid_size, obstacles)
+
+    Q_table = QTableStore(num_agents, num_states(grid_size))
+    Q_table.q_values[:, hashes[live]] = q_values[live]
+    Q_table.visited[:, hashes[live]] = True
+    Q_table.rebuild_shared()
+    return Q_table, iterations
+
+# Measures how close learned Q-tables are to the solved ones on the states each agent visited
+# and can act in on this layout. A learned greedy action counts as optimal when it is within
+# tol of the best solved Q-value (several shortest routes are usually tied). regret is the
+# mean solved-value loss of following the learned greedy action.
+def compare_to_solution(learned, solved, grid_size, obstacles, tol=1e-6):
+    hashes = model_state_hashes(grid_size)[live_states(grid_size, obstacles)]
+    solved_q = solved.q_values[0, hashes]
+    best = solved_q.max(axis=1)
+    report = []
+    for agent_id in range(learned.num_agents):
+        states = hashes[learned.visited[agent_id, hashes]]
+        rows = solved.q_values[0, states]
+        greedy = np.argmax(learned.q_values[agent_id, states], axis=1)
+        chosen = rows[np.arange(len(states)), greedy]
+        report.append({
+            'agent': agent_id,
+            'states': int(len(states)),
+            'coverage': len(states) / len(hashes),
+            'optimal_action_rate': float(np.mean(chosen >= rows.max(axis=1) - tol)) if len(states) else 0.0,
+            'regret': float(np.mean(rows.max(axis=1) - chosen)) if len(states) else 0.0
+        })
+    return {'live_states': int(len(hashes)), 'mean_value': float(best.mean()), 'agents': report}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve a fixed layout with value iteration")
+    parser.add_argument('--agents', type=int, default=3)
+    parser.add_argument('--grid-size', type=int, default=5)
+    parser.add_argument('--obstacles', type=int, nargs='*', default=None,
+                        help="flat x y pairs; sampled from --seed when omitted")
+    parser.add_argument('--num-obstacles', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gamma', type=float, default=0.99)
+    parser.add_argument('--output', default='q_table_solved.bin')
+    parser.add_argument('--compare', default=None, help="learned Q-tables to score against the solution")
+    args = parser.parse_args()
+
+    if args.obstacles is None:
+        random.seed(args.seed)
+        goal_room = (args.grid_size - 1, args.grid_size - 1)
+        rooms = [(i, j) for i in range(args.grid_size) for j in range(args.grid_size) if (i, j) != goal_room]
+        obstacles = random.sample(rooms, args.num_obstacles)
+    else:
+        obstacles = list(zip(args.obstacles[::2], args.obstacles[1::2]))
+
+    Q_table, iterations = value_iteration(args.agents, args.grid_size, obstacles, args.gamma)
+    write_q_tables(Q_table, args.output, {'solver': 'value_iteration', 'gamma': args.gamma,
+                                          'obstacles': obstacles, 'iterations': iterations})
+    print(f"Solved obstacles {obstacles} in {iterations} sweeps, wrote {args.output}")
+
+    if args.compare is not None:
+        learned, _ = read_q_tables(args.compare)
+        print(json.dumps(compare_to_solution(learned, Q_table, args.grid_size, obstacles), indent=2))
@@ -1,36 +1,23 @@
+import argparse
 import pygame
 import sys
 import numpy as np
-import pickle
 import random
 import time
+from q_learning import hash_state
+from policy import read_policy, UNSEEN
+from shortest_paths import layout_paths
 
 # used some of the code from old PAs to help with the visualization
 # used GenAI and documentation for debugging and readability
-# visualization is based of .pickle (or .pkl) file that contains the Q-tables
+# visualization is based of the policy.npy file compiled from the Q-tables in q_table.bin
 # so don't run expecting it will show you irl simulation of q-table learning and shared q-table
 # instead it will show you the visualization of the game with the shared q-table already computed
 # (due to computation time and complexity of the game but works with increased grids and agents)
+# run with --headless to evaluate the policy over many seeded layouts without opening a window
 
-# Set random seed for consistency
-np.random.seed(42)
-random.seed(42)
-
-# Initialize Pygame
-pygame.init()
-
-# Get screen dimensions - clutch genai here for readability for all team members
-infoObject = pygame.display.Info()
-SCREEN_WIDTH = infoObject.current_w
-SCREEN_HEIGHT = infoObject.current_h
 GRID_SIZE = 5  
-TEXT_MARGIN = SCREEN_WIDTH // 4  
 GRID_MARGIN = 50  
-available_width = SCREEN_WIDTH - TEXT_MARGIN - 2 * GRID_MARGIN
-available_height = SCREEN_HEIGHT - 2 * GRID_MARGIN
-CELL_SIZE = min(available_width // GRID_SIZE, available_height // GRID_SIZE)
-GRID_WIDTH = GRID_SIZE * CELL_SIZE
-GRID_HEIGHT = GRID_SIZE * CELL_SIZE
 
 # Colors on grid
 WHITE = (255, 255, 255)
@@ -46,13 +33,13 @@ BROWN = (139, 69, 19)
 PURPLE = (128, 0, 128) 
 AGENT_COLORS = [(0, 0, 255), (255, 165, 0), (0, 255, 0)]  
 
-# Create full-screen window
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.FULLSCREEN)
-pygame.display.set_caption("Multi-Agent Package Delivery with Obstacles")
-
 NUM_AGENTS = 3
 NUM_OBSTACLES = 2 
 
+# Policy action indices follow environment.PackageEnv, where UP/DOWN move along y and LEFT/RIGHT
+# along x. This game moves UP/DOWN along x, so each move is mapped to the same direction on the grid.
+POLICY_ACTIONS = ['LEFT', 'RIGHT', 'UP', 'DOWN', 'PICK', 'DROP']
+
 class PackageEnv:
     def __init__(self, num_agents):
         self.num_agents = num_agents
@@ -85,14 +72,17 @@ class PackageEnv:
         return self.current_state, 0, False
 
 class UpdatedPackageEnv(PackageEnv):
-    def __init__(self, num_agents, num_obstacles=2):
+    def __init__(self, num_agents, num_obstacles=2, goal_room=None):
         super().__init__(num_agents)
         self.actions = ['UP', 'DOWN', 'LEFT', 'RIGHT', 'PICK', 'DROP']
         self.num_obstacles = num_obstacles
+        # When set, every package is delivered to goal_room like in training
+        # instead of to its own random drop-off location
+        self.goal_room = goal_room
 
     def reset(self):
         """Reset the environment and define available positions"""
-        available_positions = [pos for pos in self.rooms]
+        available_positions = [pos for pos in self.rooms if pos != self.goal_room]
         total_positions_needed = self.num_agents + self.num_packages + self.num_obstacles
 
         # Check if we have enough positions
@@ -116,7 +106,10 @@ class UpdatedPackageEnv(PackageEnv):
             raise ValueError("Not enough available positions to assign unique drop-off locations.")
 
         # Assign drop-off positions
-        self.drop_off_positions = random.sample(available_positions, self.num_packages)
+        if self.goal_room is not None:
+            self.drop_off_positions = [self.goal_room] * self.num_packages
+        else:
+            self.drop_off_positions = random.sample(available_positions, self.num_packages)
 
         # Initialize package and agent states
         self.package_delivered = [False] * self.num_packages
@@ -206,246 +199,309 @@ class UpdatedPackageEnv(PackageEnv):
                     return "Dropped package", self.rewards['DROP']
         return "No package to drop", 0
 
-env = UpdatedPackageEnv(num_agents=NUM_AGENTS, num_obstacles=NUM_OBSTACLES)
-
-# Load Q-tables
-with open('q_table.pickle', 'rb') as f:
-    Q_tables = pickle.load(f)
-
-# Reset environment
-current_state, total_reward, done = env.reset()
-
-# Initialize fonts - genai came in clutch here for readability
-font_size = SCREEN_HEIGHT // 40 
-font = pygame.font.SysFont('Consolas', font_size)  
-font_bold = pygame.font.SysFont('Consolas', font_size, bold=True)
-
-def draw_grid():
-    """Draws grid lines"""
-    for x in range(GRID_MARGIN, GRID_MARGIN + GRID_WIDTH + 1, CELL_SIZE):
-        pygame.draw.line(screen, GRAY, (x, GRID_MARGIN), (x, GRID_MARGIN + GRID_HEIGHT))
-    for y in range(GRID_MARGIN, GRID_MARGIN + GRID_HEIGHT + 1, CELL_SIZE):
-        pygame.draw.line(screen, GRAY, (GRID_MARGIN, y), (GRID_MARGIN + GRID_WIDTH, y))
-
-def draw_obstacles():
-    """Draws obstacles"""
-    for obstacle in env.obstacles:
-        x, y = obstacle
-        rect = pygame.Rect(GRID_MARGIN + y * CELL_SIZE, GRID_MARGIN + x * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-        pygame.draw.rect(screen, BROWN, rect)
-
-def draw_packages():
-    """Draws packages, pickup, and drop-off locations"""
-    for idx, package_position in enumerate(env.package_positions):
-        drop_x, drop_y = env.drop_off_positions[idx]
-
-        # Draw pickup location only if the package has not been picked up
-        if not env.package_picked[idx]:
-            x, y = package_position
-            rect = pygame.Rect(
-                GRID_MARGIN + y * CELL_SIZE + CELL_SIZE // 4,
-                GRID_MARGIN + x * CELL_SIZE + CELL_SIZE // 4,
-                CELL_SIZE // 2,
-                CELL_SIZE // 2
-            )
-            # Package rectangle
-            pygame.draw.rect(screen, PURPLE, rect)  
-            pickup_rect = pygame.Rect(
-                GRID_MARGIN + y * CELL_SIZE,
-                GRID_MARGIN + x * CELL_SIZE,
-                CELL_SIZE,
-                CELL_SIZE
-            )
-            # Green border for pickup location
-            pygame.draw.rect(screen, GREEN, pickup_rect, 2)  
-        else:
-            # Clear the pickup spot to normal grid
-            x, y = package_position
-            pickup_rect = pygame.Rect(
-                GRID_MARGIN + y * CELL_SIZE,
-                GRID_MARGIN + x * CELL_SIZE,
-                CELL_SIZE,
-                CELL_SIZE
-            )
-            pygame.draw.rect(screen, WHITE, pickup_rect)
-            pygame.draw.rect(screen, GRAY, pickup_rect, 1)
-
-        # Draw drop-off location
-        drop_rect = pygame.Rect(
-            GRID_MARGIN + drop_y * CELL_SIZE,
-            GRID_MARGIN + drop_x * CELL_SIZE,
-            CELL_SIZE,
-            CELL_SIZE
-        )
-        if env.package_delivered[idx]:
-            pygame.draw.rect(screen, WHITE, drop_rect)
-            drop_mark_rect = pygame.Rect(
-                GRID_MARGIN + drop_y * CELL_SIZE + CELL_SIZE // 4,
-                GRID_MARGIN + drop_x * CELL_SIZE + CELL_SIZE // 4,
-                CELL_SIZE // 2,
-                CELL_SIZE // 2
-            )
-            pygame.draw.rect(screen, RED, drop_mark_rect)
-        else:
-            pygame.draw.rect(screen, RED, drop_rect, 2)
-
-def draw_agents():
-    """Draws agents and their carried packages"""
-    for idx, agent_position in enumerate(env.agent_positions):
-        x, y = agent_position
-        rect = pygame.Rect(
-            GRID_MARGIN + y * CELL_SIZE + CELL_SIZE // 6,
-            GRID_MARGIN + x * CELL_SIZE + CELL_SIZE // 6,
-            CELL_SIZE * 2 // 3,
-            CELL_SIZE * 2 // 3
-        )
-        color = AGENT_COLORS[idx % len(AGENT_COLORS)]
-        pygame.draw.ellipse(screen, color, rect)
-        if env.current_state['package_picked'][idx]:
-            # Draw package as part of the agent
-            pygame.draw.circle(
-                screen,
-                PURPLE,
-                (
-                    GRID_MARGIN + y * CELL_SIZE + CELL_SIZE // 2,
-                    GRID_MARGIN + x * CELL_SIZE + CELL_SIZE // 2
-                ),
-                CELL_SIZE // 6
-            )
-
-def draw_hud():
-    """Draws the HUD with rewards and remaining packages"""
-    pygame.draw.rect(
-        screen,
-        WHITE,
-        (GRID_MARGIN + GRID_WIDTH, 0, SCREEN_WIDTH - GRID_WIDTH - GRID_MARGIN, SCREEN_HEIGHT)
-    )
-
-    # All text info + position for the text
-    hud_x = GRID_MARGIN + GRID_WIDTH + 20
-    hud_y = GRID_MARGIN
-    line_height = font_size + 10  
-    title_text = font_bold.render("Simulation Status", True, BLACK)
-    screen.blit(title_text, (hud_x, hud_y))
-    hud_y += line_height + 10 
-
-    # Total Reward
-    reward_text = font.render(f"Total Reward: {total_reward}", True, BLACK)
-    screen.blit(reward_text, (hud_x, hud_y))
-    hud_y += line_height
-
-    # Remaining Packages
-    remaining_packages = sum(1 for d in env.package_delivered if not d)
-    remaining_text = font.render(f"Remaining Packages: {remaining_packages}", True, BLACK)
-    screen.blit(remaining_text, (hud_x, hud_y))
-    hud_y += line_height
-
-    # Just margin line for readability
-    pygame.draw.line(
-        screen,
-        GRAY,
-        (hud_x, hud_y),
-        (SCREEN_WIDTH - GRID_MARGIN - 20, hud_y),
-        1
-    )
-    hud_y += 10
-
-    # Package Status
-    package_status_title = font_bold.render("Package Status:", True, BLACK)
-    screen.blit(package_status_title, (hud_x, hud_y))
-    hud_y += line_height
-
-    # Display status for each package
-    for idx, delivered in enumerate(env.package_delivered):
-        status = "Delivered" if delivered else "In Transit"
-        package_text = font.render(f"Package {idx + 1}: {status}", True, BLACK)
-        screen.blit(package_text, (hud_x + 20, hud_y))
-        hud_y += line_height
-
-    # Just another margin line for readability
-    hud_y += 10
-    pygame.draw.line(
-        screen,
-        GRAY,
-        (hud_x, hud_y),
-        (SCREEN_WIDTH - GRID_MARGIN - 20, hud_y),
-        1
-    )
-    hud_y += 10
-
-    # Agent Status
-    agent_status_title = font_bold.render("Agent Status:", True, BLACK)
-    screen.blit(agent_status_title, (hud_x, hud_y))
-    hud_y += line_height
-
-    # Display status for each agent
-    for idx in range(NUM_AGENTS):
-        carrying = "Yes" if env.current_state['package_picked'][idx] else "No"
-        agent_text = font.render(f"Agent {idx + 1} Carrying Package: {carrying}", True, BLACK)
-        screen.blit(agent_text, (hud_x + 20, hud_y))
-        hud_y += line_height
-
-def get_action_from_Q(agent_id, observation):
-    """Gets an action from the Q-table or chooses randomly if the state is unseen"""
-    state_hash = str(observation)
-    if state_hash in Q_tables[agent_id]:
-        action_values = Q_tables[agent_id][state_hash]
-        return np.argmax(action_values)
-    return np.random.choice(len(env.actions))
-
-# Main loop
-running = True
-clock = pygame.time.Clock()
-total_reward = 0
-
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-            pygame.quit()
-            sys.exit()
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_ESCAPE:
-                running = False
-                pygame.quit()
-                sys.exit()
 
-    # Agent actions
+def make_env():
+    """Creates the game environment; the policy was trained to deliver to the bottom-right room,
+    so the game uses it as the drop-off"""
+    return UpdatedPackageEnv(num_agents=NUM_AGENTS, num_obstacles=NUM_OBSTACLES,
+                             goal_room=(GRID_SIZE - 1, GRID_SIZE - 1))
+
+def get_action_from_Q(env, policy, agent_id, observation):
+    """Gets the greedy action from the compiled policy; unseen states follow the shortest route
+    to the agent's package and then to the goal room, and only fall back to a random action
+    when the layout walls the target off"""
+    # Training ends the episode as soon as a carrying agent reaches the goal room, so the policy
+    # never learned an action there; drop the package like the training environment does
+    if (observation['package_picked'][agent_id] and
+            observation['agent_positions'][agent_id] == env.goal_room):
+        return 'DROP'
+    action_idx = policy[agent_id, hash_state(observation, agent_id, env)]
+    if action_idx == UNSEEN:
+        return shortest_route_action(env, agent_id, observation)
+    return POLICY_ACTIONS[action_idx]
+
+def shortest_route_action(env, agent_id, observation):
+    """Next action on the shortest route to the agent's package, or to the goal room once carrying"""
+    position = observation['agent_positions'][agent_id]
+    if observation['package_picked'][agent_id]:
+        target = env.goal_room
+    else:
+        target = observation['package_positions'][agent_id]
+        if position == target:
+            return 'PICK'
+    action_idx = layout_paths(env).next_action(position, target)
+    if action_idx < 0:
+        return random.choice(env.actions)
+    return POLICY_ACTIONS[action_idx]
+
+def play_step(env, policy):
+    """Chooses every agent's action from the policy, steps them in order and returns the reward"""
+    observation = {
+        'agent_positions': env.agent_positions,
+        'package_positions': env.package_positions,
+        'package_picked': env.current_state['package_picked']
+    }
     actions = {}
-    for agent_id in range(NUM_AGENTS):
-        observation = {
-            'position': env.agent_positions[agent_id],
-            'carrying_package': env.current_state['package_picked'][agent_id]
-        }
-        action_idx = get_action_from_Q(agent_id, observation)
-        actions[agent_id] = env.actions[action_idx]
+    for agent_id in range(env.num_agents):
+        actions[agent_id] = get_action_from_Q(env, policy, agent_id, observation)
 
-    # Step the environment
+    reward = 0
     for agent_id, action in actions.items():
-        current_state, reward, done, info = env.step(action, agent_id)
-        total_reward += reward
-
-    # Clear screen
-    screen.fill(WHITE)
-
-    # Draw environment
-    draw_grid()
-    draw_obstacles()
-    draw_packages()
-    draw_agents()
-    draw_hud()
-
-    # Update display
-    pygame.display.flip()
-
-    # After drawing, check if all packages are delivered
-    if all(env.package_delivered):
-        draw_hud()
+        _, step_reward, _, _ = env.step(action, agent_id)
+        reward += step_reward
+    return reward
+
+def evaluate(policy, num_episodes=1000, max_steps=200, seed=0):
+    """Plays num_episodes seeded layouts without a display and reports delivery statistics"""
+    env = make_env()
+    delivered_packages = 0
+    completed_episodes = 0
+    steps_to_deliver = 0
+    total_reward = 0
+    for episode in range(num_episodes):
+        # Every layout is reproducible from the seed and its episode number
+        random.seed(seed + episode)
+        env.reset()
+        for step in range(1, max_steps + 1):
+            total_reward += play_step(env, policy)
+            if all(env.package_delivered):
+                completed_episodes += 1
+                steps_to_deliver += step
+                break
+        delivered_packages += sum(env.package_delivered)
+
+    return {
+        'episodes': num_episodes,
+        'delivery_rate': delivered_packages / (num_episodes * env.num_packages),
+        'completed_rate': completed_episodes / num_episodes,
+        'mean_steps_to_deliver': steps_to_deliver / completed_episodes if completed_episodes else None,
+        'mean_total_reward': total_reward / num_episodes
+    }
+
+class Renderer:
+    """Draws the game with dirty-rect updates: only cells whose contents changed and the HUD
+    (when its text changed) are redrawn and pushed to the display"""
+
+    def __init__(self, env):
+        pygame.init()
+
+        # Get screen dimensions - clutch genai here for readability for all team members
+        infoObject = pygame.display.Info()
+        self.screen_width = infoObject.current_w
+        self.screen_height = infoObject.current_h
+        text_margin = self.screen_width // 4
+        available_width = self.screen_width - text_margin - 2 * GRID_MARGIN
+        available_height = self.screen_height - 2 * GRID_MARGIN
+        self.cell_size = min(available_width // GRID_SIZE, available_height // GRID_SIZE)
+        self.grid_width = GRID_SIZE * self.cell_size
+
+        # Create full-screen window
+        self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), pygame.FULLSCREEN)
+        pygame.display.set_caption("Multi-Agent Package Delivery with Obstacles")
+
+        # Initialize fonts - genai came in clutch here for readability
+        self.font_size = self.screen_height // 40
+        self.font = pygame.font.SysFont('Consolas', self.font_size)
+        self.font_bold = pygame.font.SysFont('Consolas', self.font_size, bold=True)
+        self.text_cache = {}
+
+        self.env = env
+        self.cell_signatures = {}
+        self.hud_lines = None
+        self.hud_rect = pygame.Rect(GRID_MARGIN + self.grid_width, 0,
+                                    self.screen_width - self.grid_width - GRID_MARGIN, self.screen_height)
+
+    def render_text(self, text, bold=False):
+        """Returns a cached text surface, rendering it only the first time it is shown"""
+        key = (text, bold)
+        surface = self.text_cache.get(key)
+        if surface is None:
+            # Rewards produce new strings all the time, so keep the cache bounded
+            if len(self.text_cache) > 512:
+                self.text_cache.clear()
+            font = self.font_bold if bold else self.font
+            surface = self.text_cache[key] = font.render(text, True, BLACK)
+        return surface
+
+    def cell_rect(self, position, inset=0, size=None):
+        x, y = position
+        size = self.cell_size if size is None else size
+        return pygame.Rect(GRID_MARGIN + y * self.cell_size + inset, GRID_MARGIN + x * self.cell_size + inset,
+                           size, size)
+
+    def cell_signatures_now(self):
+        """Describes what every non-empty cell shows, so changed cells can be found by comparison"""
+        env = self.env
+        contents = {}
+        for position in env.obstacles:
+            contents.setdefault(position, []).append(('obstacle',))
+        for idx, position in enumerate(env.package_positions):
+            # A picked-up package's cell is drawn as a normal grid cell
+            if not env.package_picked[idx]:
+                contents.setdefault(position, []).append(('package',))
+        for idx, position in enumerate(env.drop_off_positions):
+            contents.setdefault(position, []).append(('drop', env.package_delivered[idx]))
+        for idx, position in enumerate(env.agent_positions):
+            contents.setdefault(position, []).append(('agent', idx, env.current_state['package_picked'][idx]))
+        return {position: tuple(items) for position, items in contents.items()}
+
+    def draw_cell(self, position, signature):
+        """Redraws one cell from scratch and returns the rectangle that changed"""
+        cell_size = self.cell_size
+        rect = self.cell_rect(position)
+        pygame.draw.rect(self.screen, WHITE, rect)
+        # Grid lines around the cell (one pixel wider so both edges are drawn)
+        border = self.cell_rect(position, size=cell_size + 1)
+        pygame.draw.rect(self.screen, GRAY, border, 1)
+
+        for item in signature:
+            if item[0] == 'obstacle':
+                pygame.draw.rect(self.screen, BROWN, rect)
+            elif item[0] == 'package':
+                # Package rectangle with a green border for the pickup location
+                pygame.draw.rect(self.screen, PURPLE, self.cell_rect(position, cell_size // 4, cell_size // 2))
+                pygame.draw.rect(self.screen, GREEN, rect, 2)
+            elif item[0] == 'drop':
+                if item[1]:
+                    pygame.draw.rect(self.screen, RED, self.cell_rect(position, cell_size // 4, cell_size // 2))
+                else:
+                    pygame.draw.rect(self.screen, RED, rect, 2)
+            elif item[0] == 'agent':
+                _, idx, carrying = item
+                color = AGENT_COLORS[idx % len(AGENT_COLORS)]
+                pygame.draw.ellipse(self.screen, color, self.cell_rect(position, cell_size // 6, cell_size * 2 // 3))
+                if carrying:
+                    # Draw package as part of the agent
+                    pygame.draw.circle(self.screen, PURPLE, rect.center, cell_size // 6)
+        return border
+
+    def hud_text(self, total_reward):
+        """HUD contents as (text, bold, indent) lines; None marks a separator line"""
+        env = self.env
+        remaining_packages = sum(1 for d in env.package_delivered if not d)
+        lines = [("Simulation Status", True, 0), ("", False, 0),
+                 (f"Total Reward: {total_reward}", False, 0),
+                 (f"Remaining Packages: {remaining_packages}", False, 0),
+                 None,
+                 ("Package Status:", True, 0)]
+        for idx, delivered in enumerate(env.package_delivered):
+            status = "Delivered" if delivered else "In Transit"
+            lines.append((f"Package {idx + 1}: {status}", False, 20))
+        lines += [None, ("Agent Status:", True, 0)]
+        for idx in range(env.num_agents):
+            carrying = "Yes" if env.current_state['package_picked'][idx] else "No"
+            lines.append((f"Agent {idx + 1} Carrying Package: {carrying}", False, 20))
+        return lines
+
+    def draw_hud(self, total_reward):
+        """Draws the HUD with rewards and remaining packages; returns None if nothing changed"""
+        lines = self.hud_text(total_reward)
+        if lines == self.hud_lines:
+            return None
+        self.hud_lines = lines
+
+        pygame.draw.rect(self.screen, WHITE, self.hud_rect)
+        hud_x = GRID_MARGIN + self.grid_width + 20
+        hud_y = GRID_MARGIN
+        line_height = self.font_size + 10
+        for line in lines:
+            if line is None:
+                # Just margin line for readability
+                hud_y += 10
+                pygame.draw.line(self.screen, GRAY, (hud_x, hud_y),
+                                 (self.screen_width - GRID_MARGIN - 20, hud_y), 1)
+                hud_y += 10
+                continue
+            text, bold, indent = line
+            if text:
+                self.screen.blit(self.render_text(text, bold), (hud_x + indent, hud_y))
+                hud_y += line_height
+            else:
+                hud_y += 10
+        return self.hud_rect
+
+    def draw_full(self, total_reward):
+        """Redraws the whole window, used for the first frame and after a reset"""
+        self.screen.fill(WHITE)
+        self.cell_signatures = self.cell_signatures_now()
+        for x in range(GRID_SIZE):
+            for y in range(GRID_SIZE):
+                self.draw_cell((x, y), self.cell_signatures.get((x, y), ()))
+        self.hud_lines = None
+        self.draw_hud(total_reward)
         pygame.display.flip()
-        print("All packages delivered. Resetting environment.")
-        time.sleep(2)
-        current_state, total_reward, done = env.reset()
-        # Reset total reward
-        total_reward = 0  
 
-    clock.tick(20) 
+    def draw(self, total_reward):
+        """Redraws only the cells and HUD that changed since the last frame"""
+        signatures = self.cell_signatures_now()
+        dirty = []
+        for position in signatures.keys() | self.cell_signatures.keys():
+            signature = signatures.get(position, ())
+            if signature != self.cell_signatures.get(position, ()):
+                dirty.append(self.draw_cell(position, signature))
+        self.cell_signatures = signatures
+
+        hud_rect = self.draw_hud(total_reward)
+        if hud_rect is not None:
+            dirty.append(hud_rect)
+        if dirty:
+            pygame.display.update(dirty)
+
+def run_visualization(policy, fps=20, seed=42):
+    """Plays the game in a full-screen window until ESC or the window is closed"""
+    # Set random seed for consistency
+    np.random.seed(seed)
+    random.seed(seed)
+
+    env = make_env()
+    env.reset()
+    renderer = Renderer(env)
+    total_reward = 0
+    renderer.draw_full(total_reward)
+
+    clock = pygame.time.Clock()
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+        if not running:
+            break
+
+        total_reward += play_step(env, policy)
+        renderer.draw(total_reward)
+
+        # After drawing, check if all packages are delivered
+        if all(env.package_delivered):
+            print("All packages delivered. Resetting environment.")
+            time.sleep(2)
+            env.reset()
+            # Reset total reward
+            total_reward = 0
+            renderer.draw_full(total_reward)
+
+        clock.tick(fps)
+
+    pygame.quit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Visualize or evaluate the compiled delivery policy")
+    parser.add_argument('--headless', action='store_true', help="evaluate without a display at full speed")
+    parser.add_argument('--episodes', type=int, default=1000, help="layouts to play in headless mode")
+    parser.add_argument('--max-steps', type=int, default=200, help="step limit per headless episode")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--fps', type=int, default=20)
+    parser.add_argument('--policy', default='policy.npy')
+    args = parser.parse_args()
+
+    policy = read_policy(args.policy)
+    if args.headless:
+        report = evaluate(policy, args.episodes, args.max_steps, 0 if args.seed is None else args.seed)
+        for key, value in report.items():
+            print(f"{key}: {value}")
+    else:
+        run_visualization(policy, args.fps, 42 if args.seed is None else args.seed)
+    sys.exit()